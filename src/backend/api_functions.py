@@ -8,6 +8,7 @@ Le funzioni sono organizzate per area funzionale e utilizzano SQLite come databa
 """
 
 import sqlite3
+import json
 import logging
 from pathlib import Path
 from typing import List, Dict, Optional, Any
@@ -20,6 +21,18 @@ logger = logging.getLogger(__name__)
 
 # Path del database
 DB_PATH = Path(__file__).parent.parent / "database" / "data" / "umami.db"
+SCHEMA_CONFIG_PATH = Path(__file__).parent.parent / "database" / "database_schema.json"
+
+def _load_pragma_profile() -> Dict[str, Any]:
+    """Carica il profilo PRAGMA (sezione 'pragmas') dalla configurazione dello schema"""
+    try:
+        with open(SCHEMA_CONFIG_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f).get("pragmas", {})
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Profilo PRAGMA non caricato: {e}")
+        return {}
+
+DB_PRAGMAS = _load_pragma_profile()
 
 class DatabaseError(Exception):
     """Eccezione personalizzata per errori del database"""
@@ -37,6 +50,8 @@ def get_db_connection():
         conn = sqlite3.connect(DB_PATH)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA foreign_keys = ON;")
+        for pragma, value in DB_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value};")
         yield conn
     except sqlite3.Error as e:
         if conn:
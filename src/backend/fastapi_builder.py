@@ -8,44 +8,90 @@ Implementa tutti gli endpoint descritti nella specifica API.
 """
 
 from fastapi import FastAPI, HTTPException, Query, Path, Body, Depends, UploadFile, File
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
 from datetime import datetime, timedelta
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, List, Dict, Any
 from datetime import date
+import asyncio
+import base64
+import contextvars
+import json
 import logging
 import sqlite3
 import os
+import re
 import csv
 import io
 import shutil
 import tempfile
+import threading
+import queue
+import time
+import zlib
+import gzip
+import hashlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path as PathLib
 
+try:
+    import zstandard  # opzionale: compressione zstd dei backup
+except ImportError:
+    zstandard = None
+
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvio e spegnimento del server (gli hook sono definiti in fondo al modulo)"""
+    await warm_key_cache()
+    await start_status_maintenance()
+    try:
+        yield
+    finally:
+        await stop_status_maintenance()
+        await close_db_pool()
+
 # Inizializzazione FastAPI
 app = FastAPI(
     title="UMAMI API",
     description="API REST per il sistema di gestione ASD UMAMI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Database configuration
 DB_PATH = PathLib(__file__).parent.parent / "database" / "data" / "umami.db"
-
-def get_db_connection():
-    """Get database connection"""
-    if not DB_PATH.exists():
-        raise HTTPException(status_code=500, detail="Database not found")
-    
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    return conn
+SCHEMA_CONFIG_PATH = PathLib(__file__).parent.parent / "database" / "database_schema.json"
+
+# Connection pool configuration
+DB_POOL_SIZE = int(os.environ.get("UMAMI_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("UMAMI_DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE_SECONDS = float(os.environ.get("UMAMI_DB_POOL_RECYCLE", "1800"))
+DB_POOL_PING_AFTER_SECONDS = float(os.environ.get("UMAMI_DB_POOL_PING_AFTER", "60"))
+
+# Executor dedicato al lavoro bloccante su SQLite (di default quanti il pool)
+DB_EXECUTOR_SIZE = int(os.environ.get("UMAMI_DB_EXECUTOR_SIZE", str(DB_POOL_SIZE)))
+
+# Lettori di chiavi elettroniche: eventi massimi per richiesta e credito scalato per una doccia
+ACCESS_BATCH_MAX = int(os.environ.get("UMAMI_ACCESSI_BATCH_MAX", "1000"))
+COSTO_DOCCIA = float(os.environ.get("UMAMI_COSTO_DOCCIA", "1.00"))
+# Età massima della cache delle autorizzazioni chiavi prima di un ricaricamento completo
+KEY_CACHE_TTL_SECONDS = float(os.environ.get("UMAMI_CHIAVI_CACHE_TTL", "300"))
+# Assegnazioni massime per una richiesta di assegnazione massiva dei servizi
+ASSIGNMENT_BATCH_MAX = int(os.environ.get("UMAMI_ASSEGNAZIONI_BATCH_MAX", "2000"))
+# Secondi tra due passate della manutenzione degli stati nel server (0 la disattiva)
+STATUS_SWEEP_INTERVAL_SECONDS = float(os.environ.get("UMAMI_MANUTENZIONE_STATI_INTERVALLO", "3600"))
 
 # Custom exceptions
 class DatabaseError(Exception):
@@ -54,6 +100,642 @@ class DatabaseError(Exception):
 class NotFoundError(Exception):
     pass
 
+# ===== METRICHE =====
+
+# Bucket (secondi) dell'istogramma di latenza per rotta esposto su /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    """Statement SQL e tempo di database accumulati durante una richiesta"""
+    __slots__ = ("method", "path", "sql_statements", "sql_seconds", "connections", "statements_by_sql", "_lock")
+
+    def __init__(self, method=None, path=None):
+        self.method = method
+        self.path = path
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.connections = 0
+        self.statements_by_sql = {}
+        self._lock = threading.Lock()
+
+    def add(self, seconds, statements=1, sql=None):
+        with self._lock:
+            self.sql_statements += statements
+            self.sql_seconds += seconds
+            if sql is not None:
+                self.statements_by_sql[sql] = self.statements_by_sql.get(sql, 0) + 1
+
+    def add_connection(self):
+        with self._lock:
+            self.connections += 1
+
+# Metriche della richiesta in corso: db_executor.run propaga il contesto ai thread del database
+_request_metrics = contextvars.ContextVar("umami_request_metrics", default=None)
+
+def record_sql(sql, parameters, seconds, statements=1):
+    """Hook chiamato dai cursori del pool dopo ogni statement (statements=0 per i fetch)"""
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.add(seconds, statements, sql if statements else None)
+
+def record_checkout():
+    """Hook chiamato dal pool a ogni connessione prelevata"""
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.add_connection()
+
+# ===== SLOW QUERY LOG =====
+
+# Soglia oltre la quale uno statement (esecuzione più fetch) finisce nel registro delle query lente
+SLOW_QUERY_MS = float(os.getenv("UMAMI_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("UMAMI_SLOW_QUERY_LOG_SIZE", "100"))
+SLOW_QUERY_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE)\b", re.IGNORECASE)
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def normalize_sql(sql: str) -> str:
+    """SQL su una riga con i letterali sostituiti da '?', per raggruppare le query con la stessa forma"""
+    return " ".join(_SQL_LITERALS.sub("?", sql).split())
+
+def parameter_shape(parameters):
+    """Tipi dei parametri legati (non i valori), es. ['str', 'int'] o {'anno': 'int'}"""
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+class SlowQueryLog:
+    """Buffer circolare delle query lente con il piano di esecuzione (EXPLAIN QUERY PLAN)"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, size=SLOW_QUERY_LOG_SIZE):
+        self.threshold_seconds = threshold_ms / 1000
+        self._entries = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+        self._captured = 0
+
+    def capture(self, conn, sql, parameters, seconds):
+        """Registra una query lenta; il piano è letto con un cursore non strumentato sulla stessa connessione"""
+        plan = None
+        if parameters is not None and SLOW_QUERY_EXPLAINABLE.match(sql):
+            try:
+                rows = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                plan = [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+            except sqlite3.Error as e:
+                plan = [{"error": str(e)}]
+
+        request = _request_metrics.get()
+        entry = {
+            "captured_at": datetime.now().isoformat(),
+            "duration_ms": round(seconds * 1000, 2),
+            "sql": normalize_sql(sql),
+            "parameters": parameter_shape(parameters),
+            "plan": plan,
+            "full_scan": any("SCAN " in step.get("detail", "") for step in plan or []),
+            "request": f"{request.method} {request.path}" if request is not None else None,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._captured += 1
+        logger.warning(f"Query lenta ({entry['duration_ms']} ms): {entry['sql'][:200]}")
+        return entry
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold_seconds * 1000,
+                "capacity": self._entries.maxlen,
+                "captured_total": self._captured,
+                "queries": list(reversed(self._entries)),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+slow_query_log = SlowQueryLog()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursore che misura la durata di statement e fetch per le metriche della richiesta.
+
+    Il tempo di uno statement comprende i fetch successivi: quando supera la soglia
+    la query finisce nel registro delle query lente (una sola volta, con la durata
+    aggiornata dai fetch seguenti).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statement = None
+        self._elapsed = 0.0
+        self._slow_entry = None
+
+    def _observe(self, seconds, statements):
+        if self._statement is None:
+            record_sql(None, None, seconds, statements)
+            return
+        sql, parameters = self._statement
+        record_sql(sql if statements else None, parameters if statements else None, seconds, statements)
+        self._elapsed += seconds
+        if self._slow_entry is not None:
+            self._slow_entry["duration_ms"] = round(self._elapsed * 1000, 2)
+        elif self._elapsed >= slow_query_log.threshold_seconds:
+            self._slow_entry = slow_query_log.capture(self.connection, sql, parameters, self._elapsed)
+
+    def _begin(self, sql, parameters):
+        self._statement = (sql, parameters)
+        self._elapsed = 0.0
+        self._slow_entry = None
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(time.perf_counter() - started, 1)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Il piano non viene letto per executemany (parametri diversi per ogni riga)
+        self._begin(sql, None)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(time.perf_counter() - started, 1)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._observe(time.perf_counter() - started, 0)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            self._observe(time.perf_counter() - started, 0)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._observe(time.perf_counter() - started, 0)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connessione i cui cursori (anche quelli impliciti di execute) sono InstrumentedCursor"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _prometheus_labels(**labels):
+    """Insieme di etichette Prometheus ({nome="valore",...}) con i caratteri speciali protetti"""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+class MetricsRegistry:
+    """Istogrammi di latenza e contatori SQL per rotta, esposti in formato Prometheus"""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._latency = {}  # (method, route, status) -> [conteggi per bucket, count, sum]
+        self._sql = {}      # (method, route) -> [statement, secondi]
+
+    def observe(self, method, route, status, seconds, request_metrics):
+        with self._lock:
+            series = self._latency.setdefault((method, route, status), [[0] * len(self.buckets), 0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += seconds
+            sql = self._sql.setdefault((method, route), [0, 0.0])
+            sql[0] += request_metrics.sql_statements
+            sql[1] += request_metrics.sql_seconds
+
+    def render(self):
+        with self._lock:
+            latency = {key: (list(value[0]), value[1], value[2]) for key, value in self._latency.items()}
+            sql = {key: tuple(value) for key, value in self._sql.items()}
+        
+        lines = [
+            "# HELP umami_http_request_duration_seconds Durata delle richieste HTTP per rotta",
+            "# TYPE umami_http_request_duration_seconds histogram",
+        ]
+        for (method, route, status), (bucket_counts, count, total) in sorted(latency.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = _prometheus_labels(method=method, route=route, status=status, le=bound)
+                lines.append(f"umami_http_request_duration_seconds_bucket{labels} {bucket_count}")
+            labels = _prometheus_labels(method=method, route=route, status=status, le="+Inf")
+            lines.append(f"umami_http_request_duration_seconds_bucket{labels} {count}")
+            labels = _prometheus_labels(method=method, route=route, status=status)
+            lines.append(f"umami_http_request_duration_seconds_sum{labels} {total:.6f}")
+            lines.append(f"umami_http_request_duration_seconds_count{labels} {count}")
+        
+        lines += [
+            "# HELP umami_sql_statements_total Statement SQL eseguiti per rotta",
+            "# TYPE umami_sql_statements_total counter",
+        ]
+        lines += [
+            f"umami_sql_statements_total{_prometheus_labels(method=method, route=route)} {statements}"
+            for (method, route), (statements, _) in sorted(sql.items())
+        ]
+        lines += [
+            "# HELP umami_sql_duration_seconds_total Tempo trascorso in SQLite (statement e fetch) per rotta",
+            "# TYPE umami_sql_duration_seconds_total counter",
+        ]
+        lines += [
+            f"umami_sql_duration_seconds_total{_prometheus_labels(method=method, route=route)} {seconds:.6f}"
+            for (method, route), (_, seconds) in sorted(sql.items())
+        ]
+        
+        gauges = [
+            ("umami_db_pool_in_use", "Connessioni del pool in uso", db_pool.stats().get("in_use", 0)),
+            ("umami_db_executor_queued", "Lavori in attesa di un thread del database", db_executor.stats().get("queued", 0)),
+        ]
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+# ===== BUDGET DI QUERY PER RICHIESTA =====
+
+# Statement SQL (round-trip verso SQLite) ammessi per richiesta, salvo budget specifici per rotta
+QUERY_BUDGET_DEFAULT = int(os.getenv("UMAMI_QUERY_BUDGET", "20"))
+# Ripetizioni dello stesso statement in una richiesta oltre le quali si segnala un possibile N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("UMAMI_QUERY_REPEAT_THRESHOLD", "5"))
+# In modalità test una richiesta oltre il budget solleva QueryBudgetExceeded
+QUERY_BUDGET_STRICT = os.getenv("UMAMI_QUERY_BUDGET_STRICT", "0").lower() in ("1", "true", "yes")
+
+# Budget delle rotte composite: (metodo, template della rotta) -> statement ammessi.
+# None per le rotte a blocchi, che eseguono statement proporzionali agli elementi ricevuti
+ROUTE_QUERY_BUDGETS = {
+    ("GET", "/associati/{associato_id}"): 1,
+    ("POST", "/pagamenti"): 6,
+    ("POST", "/servizi/{servizio_id}/assegnazioni"): 9,
+    ("POST", "/chiavi/accessi"): None,
+    ("POST", "/assegnazioni-servizi/batch"): None,
+}
+
+class QueryBudgetExceeded(AssertionError):
+    """Richiesta oltre il budget di query (sollevata solo in modalità test)"""
+    pass
+
+class QueryBudgetMonitor:
+    """Conta i round-trip verso il database per rotta e segnala le richieste oltre il budget"""
+
+    def __init__(self, default_budget=QUERY_BUDGET_DEFAULT, budgets=None,
+                 repeat_threshold=QUERY_REPEAT_THRESHOLD, strict=QUERY_BUDGET_STRICT):
+        self.default_budget = default_budget
+        self.budgets = dict(ROUTE_QUERY_BUDGETS if budgets is None else budgets)
+        self.repeat_threshold = repeat_threshold
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._routes = {}  # (method, route) -> statistiche
+
+    def budget_for(self, method, route):
+        return self.budgets.get((method, route), self.default_budget)
+
+    def check(self, method, route, status, request_metrics):
+        """Aggiorna le statistiche della rotta; restituisce la violazione (o None)"""
+        budget = self.budget_for(method, route)
+        over_budget = budget is not None and request_metrics.sql_statements > budget
+        repeated = [] if budget is None else [
+            {"sql": normalize_sql(sql), "count": count}
+            for sql, count in request_metrics.statements_by_sql.items()
+            if count >= self.repeat_threshold
+        ]
+        violation = None
+        if over_budget or repeated:
+            violation = {
+                "method": method,
+                "route": route,
+                "path": request_metrics.path,
+                "status": status,
+                "statements": request_metrics.sql_statements,
+                "connections": request_metrics.connections,
+                "budget": budget,
+                "over_budget": over_budget,
+                "repeated_statements": repeated,
+                "detected_at": datetime.now().isoformat(),
+            }
+        
+        with self._lock:
+            stats = self._routes.setdefault((method, route), {
+                "method": method, "route": route, "budget": budget, "requests": 0,
+                "max_statements": 0, "max_connections": 0, "over_budget": 0,
+                "repeated_statements": 0, "last_violation": None,
+            })
+            stats["budget"] = budget
+            stats["requests"] += 1
+            stats["max_statements"] = max(stats["max_statements"], request_metrics.sql_statements)
+            stats["max_connections"] = max(stats["max_connections"], request_metrics.connections)
+            if violation is not None:
+                stats["over_budget"] += violation["over_budget"]
+                stats["repeated_statements"] += bool(repeated)
+                stats["last_violation"] = violation
+        
+        if violation is not None:
+            logger.warning(
+                f"Budget di query: {method} {route} ha eseguito {violation['statements']} statement "
+                f"su {violation['connections']} connessioni (budget {budget}, ripetuti {len(repeated)})"
+            )
+            if self.strict and violation["over_budget"]:
+                raise QueryBudgetExceeded(
+                    f"{method} {route}: {violation['statements']} statement SQL, budget {budget}"
+                )
+        return violation
+
+    def snapshot(self):
+        with self._lock:
+            routes = [dict(stats) for stats in self._routes.values()]
+        routes.sort(key=lambda stats: (-stats["max_statements"], stats["route"]))
+        return {
+            "default_budget": self.default_budget,
+            "repeat_threshold": self.repeat_threshold,
+            "strict": self.strict,
+            "routes": routes,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+query_budget = QueryBudgetMonitor()
+
+class MetricsMiddleware:
+    """Middleware ASGI: latenza per rotta, statement e tempo SQL, intestazione Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        metrics = RequestMetrics(scope["method"], scope["path"])
+        token = _request_metrics.set(metrics)
+        started = time.perf_counter()
+        status = {"code": 500}
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    f'db;desc="SQL ({metrics.sql_statements})";dur={metrics.sql_seconds * 1000:.2f}, app;dur={elapsed_ms:.2f}'
+                )
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_metrics.reset(token)
+            # Rotta come template (/associati/{associato_id}) per non moltiplicare le serie
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            metrics_registry.observe(scope["method"], route, status["code"], time.perf_counter() - started, metrics)
+            query_budget.check(scope["method"], route, status["code"], metrics)
+
+app.add_middleware(MetricsMiddleware)
+
+# ===== CONNECTION POOL =====
+
+def load_pragma_profile(config_path=SCHEMA_CONFIG_PATH):
+    """Carica il profilo PRAGMA (sezione 'pragmas') dalla configurazione dello schema"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("pragmas", {})
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Profilo PRAGMA non caricato da {config_path}: {e}")
+        return {}
+
+DB_PRAGMAS = load_pragma_profile()
+
+def apply_pragmas(conn, pragmas):
+    """Applica il profilo PRAGMA a una connessione"""
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+def read_pragmas(conn, names):
+    """Legge i valori effettivi dei PRAGMA indicati"""
+    effective = {}
+    for pragma in names:
+        row = conn.execute(f"PRAGMA {pragma}").fetchone()
+        effective[pragma] = row[0] if row else None
+    return effective
+
+class _PoolEntry:
+    """Connessione fisica del pool con i metadati per la politica di riciclo"""
+    __slots__ = ("conn", "generation", "created_at", "last_used")
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+class PooledConnection:
+    """Proxy verso una connessione del pool.
+
+    Espone la stessa interfaccia di sqlite3.Connection, ma close() restituisce
+    la connessione al pool invece di chiuderla.
+    """
+    __slots__ = ("_pool", "_entry")
+
+    def __init__(self, pool, entry):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_entry", entry)
+
+    def _raw(self):
+        if self._entry is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return self._entry.conn
+
+    def __getattr__(self, name):
+        return getattr(self._raw(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw(), name, value)
+
+    def __enter__(self):
+        self._raw().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw().__exit__(exc_type, exc, tb)
+
+    def close(self):
+        entry = self._entry
+        if entry is not None:
+            object.__setattr__(self, "_entry", None)
+            self._pool.release(entry)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """Pool limitato di connessioni SQLite a lunga vita.
+
+    Le connessioni vengono configurate una sola volta alla creazione e riutilizzate
+    tra le richieste. Al checkout si applica la politica di riciclo (età massima)
+    e, dopo un periodo di inattività, un health-check con ``SELECT 1``.
+    """
+
+    def __init__(self, db_path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 recycle_seconds=DB_POOL_RECYCLE_SECONDS, ping_after_seconds=DB_POOL_PING_AFTER_SECONDS,
+                 pragmas=None):
+        self.db_path = PathLib(db_path)
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.recycle_seconds = recycle_seconds
+        self.ping_after_seconds = ping_after_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {"created": 0, "recycled": 0, "failed_health_checks": 0, "checkouts": 0, "in_use": 0}
+
+    def _connect(self):
+        if not self.db_path.exists():
+            raise HTTPException(status_code=500, detail="Database not found")
+        conn = sqlite3.connect(str(self.db_path), timeout=self.timeout, check_same_thread=False,
+                               factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.pragmas)
+        with self._lock:
+            self._stats["created"] += 1
+            return _PoolEntry(conn, self._generation)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _is_healthy(self, entry, now):
+        if entry.generation != self._generation:
+            return False
+        if self.recycle_seconds and now - entry.created_at > self.recycle_seconds:
+            with self._lock:
+                self._stats["recycled"] += 1
+            return False
+        if self.ping_after_seconds and now - entry.last_used > self.ping_after_seconds:
+            try:
+                entry.conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                with self._lock:
+                    self._stats["failed_health_checks"] += 1
+                return False
+        return True
+
+    def acquire(self):
+        """Preleva una connessione dal pool (bloccante fino a ``timeout`` secondi)"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise DatabaseError(f"Connection pool exhausted ({self.size} connections in use)")
+        # PRAGMA di configurazione e health-check sono costi del pool, non della richiesta
+        token = _request_metrics.set(None)
+        try:
+            entry = None
+            now = time.monotonic()
+            while entry is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    entry = self._connect()
+                    break
+                if self._is_healthy(candidate, now):
+                    entry = candidate
+                else:
+                    self._discard(candidate)
+        except BaseException:
+            self._slots.release()
+            raise
+        finally:
+            _request_metrics.reset(token)
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        record_checkout()
+        return PooledConnection(self, entry)
+
+    def release(self, entry):
+        """Restituisce una connessione al pool, annullando eventuali transazioni aperte"""
+        try:
+            conn = entry.conn
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            entry.last_used = time.monotonic()
+            if entry.generation == self._generation:
+                self._idle.put(entry)
+            else:
+                self._discard(entry)
+        except sqlite3.Error:
+            self._discard(entry)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager che restituisce automaticamente la connessione al pool"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def dispose(self):
+        """Chiude le connessioni inattive e invalida quelle in uso (es. dopo un ripristino del DB)"""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(entry)
+
+    def stats(self):
+        """Statistiche del pool per il monitoraggio"""
+        with self._lock:
+            data = dict(self._stats)
+        data.update({"size": self.size, "idle": self._idle.qsize()})
+        return data
+
+    def checkpoint(self):
+        """Riporta il contenuto del WAL nel file principale del database"""
+        with self.connection() as conn:
+            return conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+    def effective_pragmas(self):
+        """Valori PRAGMA effettivi su una connessione del pool"""
+        with self.connection() as conn:
+            return read_pragmas(conn, self.pragmas.keys())
+
+db_pool = ConnectionPool(DB_PATH)
+
+def get_db_connection():
+    """Get a pooled database connection (close() returns it to the pool)"""
+    return db_pool.acquire()
+
 # ===== MODELLI PYDANTIC =====
 
 # Associati Models
@@ -107,6 +789,16 @@ class ChiaveElettronicaCreate(BaseModel):
 class RicaricaCrediti(BaseModel):
     crediti_da_aggiungere: float = Field(..., gt=0)
 
+class EventoAccesso(BaseModel):
+    key_code: str = Field(..., min_length=1, max_length=50)
+    varco: str = Field(..., min_length=1, max_length=50)
+    tipo: str = Field("Porta", pattern="^(Porta|Doccia)$")
+    data_ora: Optional[datetime] = None
+    costo: Optional[float] = Field(None, gt=0, description="Credito da scalare per la doccia (default UMAMI_COSTO_DOCCIA)")
+
+class EventiAccesso(BaseModel):
+    eventi: List[EventoAccesso] = Field(..., min_length=1, max_length=ACCESS_BATCH_MAX)
+
 # Servizi Models
 class ServizioFisicoCreate(BaseModel):
     nome: str = Field(..., min_length=1, max_length=100)
@@ -127,6 +819,12 @@ class AssegnazioneServizioCreate(BaseModel):
     anno_competenza: int
     stato: str = Field("Attivo", pattern="^(Attivo|Sospeso|Terminato)$")
 
+class AssegnazioneServizioBatchItem(AssegnazioneServizioCreate):
+    fk_servizio: int
+
+class AssegnazioniServiziBatch(BaseModel):
+    assegnazioni: List[AssegnazioneServizioBatchItem] = Field(..., min_length=1, max_length=ASSIGNMENT_BATCH_MAX)
+
 class AssegnazioneServizioUpdate(BaseModel):
     fk_associato: Optional[int] = None
     data_inizio: Optional[date] = None
@@ -162,6 +860,11 @@ class ImportResult(BaseModel):
     message: str
     imported_rows: int
     errors: List[str] = []
+    mode: str = "insert"
+    skipped_rows: int = 0
+    failed_rows: int = 0
+    duration_seconds: float = 0.0
+    rows_per_second: float = 0.0
 
 class BackupResult(BaseModel):
     success: bool
@@ -245,20 +948,19 @@ def dict_factory(cursor, row):
 def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = True):
     """Execute database query with error handling"""
     try:
-        conn = get_db_connection()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        
-        if fetch_one:
-            result = cursor.fetchone()
-        elif fetch_all:
-            result = cursor.fetchall()
-        else:
-            result = cursor.rowcount
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = dict_factory
+            cursor.execute(query, params)
             
-        conn.commit()
-        conn.close()
+            if fetch_one:
+                result = cursor.fetchone()
+            elif fetch_all:
+                result = cursor.fetchall()
+            else:
+                result = cursor.rowcount
+                
+            conn.commit()
         return result
     except sqlite3.Error as e:
         logger.error(f"Database error: {e}")
@@ -267,26 +969,491 @@ def execute_query(query: str, params: tuple = (), fetch_one: bool = False, fetch
         logger.error(f"Unexpected error: {e}")
         raise DatabaseError(f"Unexpected error: {str(e)}")
 
+def execute_insert(query: str, params: tuple = ()):
+    """Execute an INSERT statement and return the new row id"""
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.execute(query, params)
+            conn.commit()
+            return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        raise DatabaseError(f"Database operation failed: {str(e)}")
+
+# ===== DATA ACCESS: EXECUTOR =====
+
+class DatabaseExecutor:
+    """Thread pool dedicato e limitato per il lavoro bloccante su SQLite.
+
+    Gli endpoint async attendono il risultato con ``await db_executor.run(...)``
+    così che una query lenta non blocchi l'event loop. Le statistiche riportano
+    la profondità della coda (lavori in attesa di un thread libero).
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "running": 0, "completed": 0, "max_queued": 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="umami-db")
+            return self._executor
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self._stats["queued"] -= 1
+            self._stats["running"] += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._stats["running"] -= 1
+                self._stats["completed"] += 1
+
+    def _on_done(self, future):
+        # Un lavoro annullato prima di partire non passa da _call
+        if future.cancelled():
+            with self._lock:
+                self._stats["queued"] -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """Esegue ``func`` su un thread del pool e ne attende il risultato"""
+        executor = self._get_executor()
+        with self._lock:
+            self._stats["queued"] += 1
+            self._stats["max_queued"] = max(self._stats["max_queued"], self._stats["queued"])
+        # Il contesto (metriche della richiesta) segue il lavoro sul thread del database
+        future = executor.submit(contextvars.copy_context().run, self._call, func, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        """Statistiche dell'executor per il monitoraggio"""
+        with self._lock:
+            data = dict(self._stats)
+        data["max_workers"] = self.max_workers
+        return data
+
+    def shutdown(self):
+        """Attende la fine dei lavori in corso e rilascia i thread"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+db_executor = DatabaseExecutor(DB_EXECUTOR_SIZE)
+
+async def execute_query_async(query: str, params: tuple = (), fetch_one: bool = False, fetch_all: bool = True):
+    """Versione awaitable di execute_query, eseguita sull'executor del database"""
+    return await db_executor.run(execute_query, query, params, fetch_one, fetch_all)
+
+# ===== RICERCA FULL-TEXT =====
+
+# Indice FTS5 creato da DatabaseBuilder (sezione 'search_index' di database_schema.json)
+SEARCH_INDEX_TABLE = "RicercaFTS"
+SEARCH_TYPES = ("associato", "fornitore", "prestazione", "fattura")
+_search_index_state = {"ready": False}
+
+def fts_match_expression(text: Optional[str]) -> str:
+    """Converte il testo libero in una query FTS5: ogni termine è cercato per prefisso (AND implicito)"""
+    terms = re.findall(r"\w+", text or "")
+    return " ".join(f'"{term}"*' for term in terms)
+
+def fts_ids_subquery(tipo: str) -> str:
+    """Sottoquery che restituisce gli ID di un tipo di documento che corrispondono alla MATCH (1 parametro)"""
+    return f"SELECT ref_id FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH ? AND tipo = '{tipo}'"
+
+async def search_index_available() -> bool:
+    """Verifica (una volta) che l'indice full-text esista; altrimenti si usa il fallback LIKE"""
+    if not _search_index_state["ready"]:
+        row = await execute_query_async(
+            "SELECT 1 AS ok FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (SEARCH_INDEX_TABLE,),
+            fetch_one=True,
+        )
+        _search_index_state["ready"] = bool(row)
+    return _search_index_state["ready"]
+
+def is_internal_table(table_name: str) -> bool:
+    """Tabelle di sistema SQLite o derivate (indice full-text, statistiche, partitario, riepiloghi): non importabili"""
+    return (
+        table_name.startswith('sqlite_')
+        or table_name.startswith(SEARCH_INDEX_TABLE)
+        or table_name in (TABLE_STATS_TABLE, RECEIVABLES_TABLE, RECEIVABLES_SUMMARY_TABLE, ROLLUP_TABLE)
+    )
+
+@app.get("/search", summary="Ricerca full-text")
+async def search_endpoint(
+    q: str = Query(..., min_length=1, description="Testo da cercare (ricerca per prefisso, senza accenti)"),
+    tipi: Optional[str] = Query(None, description="Tipi di risultato separati da virgola (associato, fornitore, prestazione, fattura)"),
+    limit: int = Query(20, ge=1, le=100, description="Numero massimo di risultati")
+):
+    """Ricerca full-text su associati, fornitori, prestazioni e numeri fattura con risultati ordinati per rilevanza"""
+    try:
+        match = fts_match_expression(q)
+        if not match:
+            return {"query": q, "count": 0, "results": []}
+        
+        if not await search_index_available():
+            raise HTTPException(status_code=503, detail="Indice di ricerca non disponibile: eseguire db_build.py --upgrade")
+        
+        where_clauses = [f"{SEARCH_INDEX_TABLE} MATCH ?"]
+        params: list[Any] = [match]
+        
+        if tipi:
+            selected = [t.strip() for t in tipi.split(",") if t.strip()]
+            invalid = [t for t in selected if t not in SEARCH_TYPES]
+            if invalid:
+                raise HTTPException(status_code=400, detail=f"Tipi non validi: {', '.join(invalid)}")
+            where_clauses.append(f"tipo IN ({', '.join('?' for _ in selected)})")
+            params.extend(selected)
+        
+        # bm25: il titolo pesa più del testo descrittivo (tipo e ref_id non sono indicizzati)
+        query = f"""
+        SELECT tipo, ref_id AS id, titolo, testo,
+               bm25({SEARCH_INDEX_TABLE}, 0.0, 0.0, 10.0, 1.0) AS score
+        FROM {SEARCH_INDEX_TABLE}
+        WHERE {" AND ".join(where_clauses)}
+        ORDER BY score
+        LIMIT ?
+        """
+        params.append(limit)
+        
+        results = await execute_query_async(query, tuple(params))
+        
+        return {
+            "query": q,
+            "count": len(results),
+            "results": results
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== PAGINAZIONE =====
+
+# Paginazione a cursore (keyset): il cursore codifica i valori della chiave di ordinamento
+# dell'ultima riga restituita, così la pagina successiva parte da lì senza OFFSET.
+
+def encode_cursor(scope: str, values: list) -> str:
+    """Codifica un cursore opaco per l'elenco indicato"""
+    payload = json.dumps({"s": scope, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(scope: str, cursor: str, size: int) -> list:
+    """Decodifica un cursore verificando che appartenga all'elenco indicato"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["v"]
+        if payload["s"] != scope or not isinstance(values, list) or len(values) != size:
+            raise ValueError("cursor scope mismatch")
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido")
+
+def keyset_clause(columns: List[str], descending: bool = False) -> str:
+    """Condizione row-value che seleziona le righe successive al cursore nell'ordinamento dato"""
+    operator = "<" if descending else ">"
+    placeholders = ", ".join("?" for _ in columns)
+    return f"({', '.join(columns)}) {operator} ({placeholders})"
+
+def split_page(rows: list, limit: int, scope: str, key_fields: List[str]):
+    """Separa la pagina dalla riga extra (query con LIMIT limit + 1) e calcola il cursore successivo"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(scope, [last[field] for field in key_fields])
+
+def estimate_row_count(table_name: str) -> int:
+    """Stima il numero di righe di una tabella senza scansionarla.
+
+    Usa le statistiche di ANALYZE (sqlite_stat1) se presenti, altrimenti il
+    massimo rowid (limite superiore: non considera le righe eliminate).
+    """
+    with db_pool.connection() as conn:
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone()
+        if has_stats:
+            row = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1",
+                (table_name,),
+            ).fetchone()
+            if row and row[0]:
+                return int(str(row[0]).split()[0])
+        row = conn.execute(f"SELECT MAX(rowid) FROM {table_name}").fetchone()
+        return int(row[0] or 0)
+
+def estimated_total(filtered: bool, seen: int, table_name: str) -> Optional[int]:
+    """Totale stimato di un elenco senza COUNT(*).
+
+    Senza filtri usa la stima della tabella; con filtri una stima affidabile non
+    esiste e restituisce None (totale sconosciuto, da richiedere con exact_count).
+    """
+    if filtered:
+        return None
+    return max(seen, estimate_row_count(table_name))
+
+def set_pagination_headers(response: Response, next_cursor: Optional[str], count: Optional[int], count_exact: bool):
+    """Espone cursore successivo e conteggio negli header (elenchi che restituiscono una lista).
+
+    Con conteggio sconosciuto (None) l'header X-Total-Count è omesso.
+    """
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if count is not None:
+        response.headers["X-Total-Count"] = str(count)
+    response.headers["X-Total-Count-Exact"] = "true" if count_exact else "false"
+
+# ===== ESPORTAZIONE IN STREAMING =====
+
+# Righe lette dal cursore per ogni fetchmany durante un'esportazione
+EXPORT_FETCH_SIZE = int(os.getenv("UMAMI_EXPORT_FETCH_SIZE", "500"))
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# Parametro comune agli endpoint esportabili: json (default) mantiene la risposta abituale
+EXPORT_FORMAT_PATTERN = "^(json|ndjson|csv)$"
+
+def _open_export_cursor(query: str, params: tuple):
+    """Esegue la query su una connessione del pool e restituisce (connessione, cursore)"""
+    conn = db_pool.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        cursor.execute(query, params)
+        return conn, cursor
+    except Exception:
+        conn.close()
+        raise
+
+async def _iter_export_rows(conn, cursor, batch_size: int):
+    """Legge il cursore a blocchi sul thread pool del database, con memoria costante"""
+    try:
+        while True:
+            rows = await db_executor.run(cursor.fetchmany, batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        # Rilascio immediato (rollback della transazione di lettura e ritorno nel pool)
+        cursor.close()
+        conn.close()
+
+async def _ndjson_chunks(rows):
+    async for row in rows:
+        yield json.dumps(row, default=str, ensure_ascii=False) + "\n"
+
+async def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = None
+    async for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+            writer.writeheader()
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def stream_export(query: str, params: tuple, export_format: str, filename: str) -> StreamingResponse:
+    """Esporta il risultato di una query in NDJSON o CSV senza materializzarlo in memoria.
+
+    La query viene eseguita prima di avviare la risposta, così gli errori SQL
+    restituiscono ancora un 500; le righe sono poi lette con fetchmany.
+    """
+    conn, cursor = await db_executor.run(_open_export_cursor, query, tuple(params))
+    rows = _iter_export_rows(conn, cursor, EXPORT_FETCH_SIZE)
+    chunks = _ndjson_chunks(rows) if export_format == "ndjson" else _csv_chunks(rows)
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+# ===== NUMERAZIONE FATTURE =====
+
+# Serie di numerazione gestite dal contatore NumerazioneFatture
+INVOICE_SERIES = {
+    "SF": "Assegnazioni servizi fisici",
+    "EP": "Erogazioni prestazioni",
+    "MAN": "Fatture inserite manualmente",
+}
+
+def format_invoice_number(serie: str, anno: int, numero: int) -> str:
+    """Formato del numero fattura: SERIE-ANNO-PROGRESSIVO (es. SF-2025-000042)"""
+    return f"{serie}-{anno}-{numero:06d}"
+
+# Numeri nel formato di format_invoice_number: riservati al contatore, non indicabili a mano
+INVOICE_NUMBER_PATTERN = re.compile(rf"^({'|'.join(INVOICE_SERIES)})-\d{{4}}-\d{{6}}$")
+
+def reserve_invoice_numbers(conn, serie: str, anno: int, quantita: int = 1) -> List[str]:
+    """Riserva un blocco contiguo di numeri fattura per serie e anno.
+
+    Va chiamata sulla stessa connessione e nella stessa transazione che inserisce
+    le fatture: l'UPSERT sul contatore acquisisce il lock di scrittura, quindi le
+    richieste concorrenti sono serializzate, e un rollback restituisce anche i
+    numeri (sequenza senza buchi e senza collisioni, senza verifiche su Fatture).
+    """
+    if serie not in INVOICE_SERIES:
+        raise ValueError(f"Serie di numerazione non valida: {serie}")
+    if quantita < 1:
+        raise ValueError("La quantità di numeri da riservare deve essere positiva")
+    
+    rows = conn.execute(
+        """
+        INSERT INTO NumerazioneFatture (serie, anno, ultimo_numero) VALUES (?, ?, ?)
+        ON CONFLICT(serie, anno) DO UPDATE SET ultimo_numero = ultimo_numero + excluded.ultimo_numero
+        RETURNING ultimo_numero
+        """,
+        (serie, anno, quantita),
+    ).fetchall()
+    ultimo = rows[0][0]
+    return [format_invoice_number(serie, anno, numero) for numero in range(ultimo - quantita + 1, ultimo + 1)]
+
+def next_invoice_number(conn, serie: str, data_emissione: date) -> str:
+    """Assegna il prossimo numero della serie per l'anno di emissione"""
+    return reserve_invoice_numbers(conn, serie, data_emissione.year)[0]
+
+# ===== PROFILO ASSOCIATO =====
+
+# Sezioni del profilo (oltre all'anagrafica), nell'ordine della risposta
+PROFILE_SECTIONS = ("riferimento", "tesseramento_fiv", "chiave_elettronica", "servizi_fisici", "prestazioni", "fatture", "pagamenti")
+_schema_columns = {}
+_profile_sql_cache = {}
+
+def schema_columns(table: str) -> List[str]:
+    """Colonne di una tabella secondo database_schema.json (lette una sola volta)"""
+    if not _schema_columns:
+        with open(SCHEMA_CONFIG_PATH, 'r', encoding='utf-8') as f:
+            tables = json.load(f)["tables"]
+        _schema_columns.update({name: list(table_def["columns"]) for name, table_def in tables.items()})
+    return _schema_columns[table]
+
+def json_object_sql(alias: str, columns) -> str:
+    """Espressione json_object con le colonne indicate della tabella/sottoquery ``alias``"""
+    return "json_object(" + ", ".join(f"'{column}', {alias}.{column}" for column in columns) + ")"
+
+def json_array_sql(select_sql: str, columns) -> str:
+    """Array JSON delle righe di una SELECT; l'ORDER BY della sottoquery fissa l'ordine degli elementi"""
+    return f"json((SELECT json_group_array({json_object_sql('x', columns)}) FROM ({select_sql}) x))"
+
+def profile_section_sql(section: str) -> str:
+    """Espressione SQL di una sezione del profilo (parametro :id = associato)"""
+    if section == "riferimento":
+        return (f"json((SELECT {json_object_sql('r', ['id_associato', 'nome', 'cognome'])} "
+                "FROM Associati r WHERE r.id_associato = a.fk_associato_riferimento))")
+    if section == "tesseramento_fiv":
+        return f"json((SELECT {json_object_sql('t', schema_columns('TessereFIV'))} FROM TessereFIV t WHERE t.fk_associato = :id))"
+    if section == "chiave_elettronica":
+        return f"json((SELECT {json_object_sql('k', schema_columns('ChiaviElettroniche'))} FROM ChiaviElettroniche k WHERE k.fk_associato = :id))"
+    if section == "servizi_fisici":
+        return json_array_sql(
+            """
+            SELECT s.*, asf.data_inizio, asf.data_fine, asf.anno_competenza, asf.stato AS stato_assegnazione
+            FROM Servizi s
+            JOIN AssegnazioniServizi asf ON s.id_servizio = asf.fk_servizio
+            WHERE asf.fk_associato = :id
+            ORDER BY asf.anno_competenza DESC
+            """,
+            schema_columns("Servizi") + ["data_inizio", "data_fine", "anno_competenza", "stato_assegnazione"],
+        )
+    if section == "prestazioni":
+        return json_array_sql(
+            """
+            SELECT p.*, ep.data_erogazione
+            FROM Prestazioni p
+            JOIN ErogazioniPrestazioni ep ON p.id_prestazione = ep.fk_prestazione
+            WHERE ep.fk_associato = :id
+            ORDER BY ep.data_erogazione DESC
+            """,
+            schema_columns("Prestazioni") + ["data_erogazione"],
+        )
+    if section == "fatture":
+        return json_array_sql(
+            "SELECT * FROM Fatture WHERE fk_associato = :id ORDER BY data_emissione DESC, id_fattura DESC",
+            schema_columns("Fatture"),
+        )
+    if section == "pagamenti":
+        return json_array_sql(
+            """
+            SELECT p.*, f.numero_fattura, f.tipo_fattura
+            FROM Pagamenti p
+            JOIN Fatture f ON f.id_fattura = p.fk_fattura
+            WHERE f.fk_associato = :id
+            ORDER BY p.data_pagamento DESC, p.id_pagamento DESC
+            """,
+            schema_columns("Pagamenti") + ["numero_fattura", "tipo_fattura"],
+        )
+    raise ValueError(f"Sezione del profilo sconosciuta: {section}")
+
+def profile_query(sections) -> str:
+    """Statement unico che restituisce il profilo come documento JSON (JSON1), in cache per combinazione di sezioni"""
+    key = tuple(sections)
+    if key not in _profile_sql_cache:
+        pairs = [f"'{column}', a.{column}" for column in schema_columns("Associati")]
+        pairs += [f"'{section}', {profile_section_sql(section)}" for section in key]
+        _profile_sql_cache[key] = f"SELECT json_object({', '.join(pairs)}) AS profilo FROM Associati a WHERE a.id_associato = :id"
+    return _profile_sql_cache[key]
+
+def parse_profile_include(include: Optional[str]):
+    """Sezioni richieste con ?include= (tutte se assente, solo anagrafica se vuoto)"""
+    if include is None:
+        return PROFILE_SECTIONS
+    requested = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = sorted(requested - set(PROFILE_SECTIONS))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Sezioni non valide: {', '.join(unknown)}. Disponibili: {', '.join(PROFILE_SECTIONS)}"
+        )
+    return tuple(section for section in PROFILE_SECTIONS if section in requested)
+
 # ===== ENDPOINTS ASSOCIATI =====
 
 @app.get("/associati", summary="Lista associati")
 async def list_associati(
+    response: Response,
     limit: int = Query(20, ge=1, le=100, description="Numero massimo di risultati"),
     offset: int = Query(0, ge=0, description="Offset per paginazione"),
+    cursor: Optional[str] = Query(None, description="Cursore restituito dalla pagina precedente (alternativo a offset)"),
+    exact_count: bool = Query(False, description="Calcola il conteggio esatto (altrimenti stimato)"),
     search: Optional[str] = Query(None, description="Ricerca per nome, cognome, email o codice fiscale"),
     stato: Optional[str] = Query(None, pattern="^(Attivo|Sospeso|Scaduto|Cessato)$", description="Filtra per stato"),
     tesserato_fiv: Optional[bool] = Query(None, description="Filtra per tesseramento FIV")
 ):
-    """Recupera la lista degli associati con filtri e paginazione"""
+    """Recupera la lista degli associati con filtri e paginazione (offset o cursore)"""
     try:
+        if cursor and offset:
+            raise HTTPException(status_code=400, detail="Usare cursor oppure offset, non entrambi")
+        
         # Build query with filters
         where_clauses = []
         params = []
         
         if search:
-            where_clauses.append("(nome LIKE ? OR cognome LIKE ? OR email LIKE ? OR codice_fiscale LIKE ?)")
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param, search_param])
+            match = fts_match_expression(search)
+            if match and await search_index_available():
+                where_clauses.append(f"id_associato IN ({fts_ids_subquery('associato')})")
+                params.append(match)
+            else:
+                where_clauses.append("(nome LIKE ? OR cognome LIKE ? OR email LIKE ? OR codice_fiscale LIKE ?)")
+                search_param = f"%{search}%"
+                params.extend([search_param, search_param, search_param, search_param])
         
         if stato:
             where_clauses.append("stato_associato = ?")
@@ -298,29 +1465,47 @@ async def list_associati(
             else:
                 where_clauses.append("id_associato NOT IN (SELECT fk_associato FROM TessereFIV)")
         
+        filtered = bool(where_clauses)
         where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
         
-        # Count total
-        count_query = f"SELECT COUNT(*) as count FROM Associati WHERE {where_clause}"
-        count_result = execute_query(count_query, tuple(params), fetch_one=True)
-        total_count = count_result['count'] if count_result else 0
+        # Count total (esatto solo su richiesta: con filtri LIKE richiede una scansione completa)
+        if exact_count:
+            count_query = f"SELECT COUNT(*) as count FROM Associati WHERE {where_clause}"
+            count_result = await execute_query_async(count_query, tuple(params), fetch_one=True)
+            total_count = count_result['count'] if count_result else 0
+        
+        # Get results: la chiave (cognome, nome, id_associato) coincide con idx_associati_cognome_nome
+        page_clauses = [where_clause]
+        page_params = list(params)
+        if cursor:
+            page_clauses.append(keyset_clause(["cognome", "nome", "id_associato"]))
+            page_params.extend(decode_cursor("associati", cursor, 3))
         
-        # Get results
         query = f"""
         SELECT id_associato, nome, cognome, codice_fiscale, stato_associato, fk_associato_riferimento
         FROM Associati 
-        WHERE {where_clause}
-        ORDER BY cognome, nome
+        WHERE {" AND ".join(page_clauses)}
+        ORDER BY cognome, nome, id_associato
         LIMIT ? OFFSET ?
         """
-        params.extend([limit, offset])
+        page_params.extend([limit + 1, offset])
         
-        results = execute_query(query, tuple(params))
+        rows = await execute_query_async(query, tuple(page_params))
+        results, next_cursor = split_page(rows, limit, "associati", ["cognome", "nome", "id_associato"])
         
+        if not exact_count:
+            seen = offset + len(results) + (1 if next_cursor else 0)
+            total_count = await db_executor.run(estimated_total, filtered, seen, "Associati")
+        
+        set_pagination_headers(response, next_cursor, total_count, exact_count)
         return {
             "count": total_count,
+            "count_exact": exact_count,
+            "next_cursor": next_cursor,
             "results": results
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in list_associati: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -331,7 +1516,7 @@ async def create_associato_endpoint(associato: AssociatoCreate):
     try:
         # Check if codice_fiscale already exists
         check_query = "SELECT id_associato FROM Associati WHERE codice_fiscale = ?"
-        existing = execute_query(check_query, (associato.codice_fiscale,), fetch_one=True)
+        existing = await execute_query_async(check_query, (associato.codice_fiscale,), fetch_one=True)
         if existing:
             raise HTTPException(status_code=400, detail="Codice fiscale già esistente")
         
@@ -355,16 +1540,11 @@ async def create_associato_endpoint(associato: AssociatoCreate):
             associato.stato_associato
         )
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(insert_query, params)
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        new_id = await db_executor.run(execute_insert, insert_query, params)
         
         # Return created associato
         return_query = "SELECT * FROM Associati WHERE id_associato = ?"
-        result = execute_query(return_query, (new_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (new_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -375,52 +1555,22 @@ async def create_associato_endpoint(associato: AssociatoCreate):
 
 @app.get("/associati/{associato_id}", summary="Dettagli associato")
 async def get_associato_endpoint(
-    associato_id: int = Path(..., description="ID dell'associato")
+    associato_id: int = Path(..., description="ID dell'associato"),
+    include: Optional[str] = Query(None, description=f"Sezioni separate da virgola ({', '.join(PROFILE_SECTIONS)}); default tutte")
 ):
-    """Recupera i dettagli di un associato con tutte le relazioni"""
+    """Recupera i dettagli di un associato con tutte le relazioni.
+
+    Il documento (anagrafica, FIV, chiave, servizi, prestazioni, fatture e pagamenti)
+    è assemblato da SQLite con json_object/json_group_array in un solo statement.
+    """
     try:
-        # Get associato base info
-        query = "SELECT * FROM Associati WHERE id_associato = ?"
-        associato = execute_query(query, (associato_id,), fetch_one=True)
+        sections = parse_profile_include(include)
+        row = await execute_query_async(profile_query(sections), {"id": associato_id}, fetch_one=True)
         
-        if not associato:
+        if not row:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
-        # Get tesseramento FIV if exists
-        fiv_query = "SELECT * FROM TessereFIV WHERE fk_associato = ?"
-        tesseramento_fiv = execute_query(fiv_query, (associato_id,), fetch_one=True)
-        
-        # Get chiave elettronica if exists
-        chiave_query = "SELECT * FROM ChiaviElettroniche WHERE fk_associato = ?"
-        chiave_elettronica = execute_query(chiave_query, (associato_id,), fetch_one=True)
-        
-        # Get servizi assegnati
-        servizi_query = """
-        SELECT s.*, asf.data_inizio, asf.data_fine, asf.anno_competenza, asf.stato as stato_assegnazione
-        FROM Servizi s
-        JOIN AssegnazioniServizi asf ON s.id_servizio = asf.fk_servizio
-        WHERE asf.fk_associato = ?
-        ORDER BY asf.anno_competenza DESC
-        """
-        servizi_fisici = execute_query(servizi_query, (associato_id,))
-        
-        # Get erogazioni prestazioni
-        prestazioni_query = """
-        SELECT p.*, ep.data_erogazione
-        FROM Prestazioni p
-        JOIN ErogazioniPrestazioni ep ON p.id_prestazione = ep.fk_prestazione
-        WHERE ep.fk_associato = ?
-        ORDER BY ep.data_erogazione DESC
-        """
-        prestazioni = execute_query(prestazioni_query, (associato_id,))
-        
-        result = dict(associato)
-        result['tesseramento_fiv'] = tesseramento_fiv
-        result['chiave_elettronica'] = chiave_elettronica
-        result['servizi_fisici'] = servizi_fisici
-        result['prestazioni'] = prestazioni
-        
-        return result
+        return Response(content=row["profilo"], media_type="application/json")
         
     except HTTPException:
         raise
@@ -437,7 +1587,7 @@ async def update_associato_endpoint(
     try:
         # Check if associato exists
         check_query = "SELECT id_associato FROM Associati WHERE id_associato = ?"
-        existing = execute_query(check_query, (associato_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (associato_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
@@ -450,7 +1600,7 @@ async def update_associato_endpoint(
         # Check codice_fiscale uniqueness if being updated
         if 'codice_fiscale' in update_data:
             cf_check_query = "SELECT id_associato FROM Associati WHERE codice_fiscale = ? AND id_associato != ?"
-            cf_existing = execute_query(cf_check_query, (update_data['codice_fiscale'], associato_id), fetch_one=True)
+            cf_existing = await execute_query_async(cf_check_query, (update_data['codice_fiscale'], associato_id), fetch_one=True)
             if cf_existing:
                 raise HTTPException(status_code=400, detail="Codice fiscale già esistente")
         
@@ -462,11 +1612,12 @@ async def update_associato_endpoint(
         update_query = f"UPDATE Associati SET {', '.join(set_clauses)} WHERE id_associato = ?"
         
         params = list(update_data.values()) + [associato_id]
-        execute_query(update_query, tuple(params), fetch_all=False)
+        await execute_query_async(update_query, tuple(params), fetch_all=False)
+        key_cache.invalidate(associato_id)
         
         # Return updated associato
         return_query = "SELECT * FROM Associati WHERE id_associato = ?"
-        result = execute_query(return_query, (associato_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (associato_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -484,19 +1635,19 @@ async def create_tesseramento_fiv_endpoint(
     try:
         # Check if associato exists
         check_query = "SELECT id_associato FROM Associati WHERE id_associato = ?"
-        existing = execute_query(check_query, (associato_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (associato_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
         # Check if tessera number is unique
         tessera_check_query = "SELECT fk_associato FROM TessereFIV WHERE numero_tessera_fiv = ? AND fk_associato != ?"
-        tessera_existing = execute_query(tessera_check_query, (tesseramento.numero_tessera_fiv, associato_id), fetch_one=True)
+        tessera_existing = await execute_query_async(tessera_check_query, (tesseramento.numero_tessera_fiv, associato_id), fetch_one=True)
         if tessera_existing:
             raise HTTPException(status_code=400, detail="Numero tessera FIV già esistente")
         
         # Check if tesseramento already exists for this associato
         existing_fiv_query = "SELECT fk_associato FROM TessereFIV WHERE fk_associato = ?"
-        existing_fiv = execute_query(existing_fiv_query, (associato_id,), fetch_one=True)
+        existing_fiv = await execute_query_async(existing_fiv_query, (associato_id,), fetch_one=True)
         
         if existing_fiv:
             # Update existing
@@ -524,11 +1675,12 @@ async def create_tesseramento_fiv_endpoint(
                 tesseramento.scadenza_certificato_medico.isoformat()
             )
         
-        execute_query(update_query, params, fetch_all=False)
+        await execute_query_async(update_query, params, fetch_all=False)
+        key_cache.invalidate(associato_id)
         
         # Return created/updated tesseramento
         return_query = "SELECT * FROM TessereFIV WHERE fk_associato = ?"
-        result = execute_query(return_query, (associato_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (associato_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -553,9 +1705,14 @@ async def list_fornitori(
         params = []
         
         if search:
-            where_clauses.append("(ragione_sociale LIKE ? OR partita_iva LIKE ? OR email LIKE ?)")
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param])
+            match = fts_match_expression(search)
+            if match and await search_index_available():
+                where_clauses.append(f"id_fornitore IN ({fts_ids_subquery('fornitore')})")
+                params.append(match)
+            else:
+                where_clauses.append("(ragione_sociale LIKE ? OR partita_iva LIKE ? OR email LIKE ?)")
+                search_param = f"%{search}%"
+                params.extend([search_param, search_param, search_param])
         
         # Note: attivo filter not implemented as there's no 'attivo' field in Fornitori table
         # This would require adding an 'attivo' boolean field to the database schema
@@ -564,7 +1721,7 @@ async def list_fornitori(
         
         # Count total
         count_query = f"SELECT COUNT(*) as count FROM Fornitori WHERE {where_clause}"
-        count_result = execute_query(count_query, tuple(params), fetch_one=True)
+        count_result = await execute_query_async(count_query, tuple(params), fetch_one=True)
         total_count = count_result['count'] if count_result else 0
         
         # Get results
@@ -577,7 +1734,7 @@ async def list_fornitori(
         """
         params.extend([limit, offset])
         
-        results = execute_query(query, tuple(params))
+        results = await execute_query_async(query, tuple(params))
         
         return {
             "count": total_count,
@@ -593,7 +1750,7 @@ async def create_fornitore_endpoint(fornitore: FornitoreCreate):
     try:
         # Check if partita_iva already exists
         check_query = "SELECT id_fornitore FROM Fornitori WHERE partita_iva = ?"
-        existing = execute_query(check_query, (fornitore.partita_iva,), fetch_one=True)
+        existing = await execute_query_async(check_query, (fornitore.partita_iva,), fetch_one=True)
         if existing:
             raise HTTPException(status_code=400, detail="Partita IVA già esistente")
         
@@ -610,16 +1767,11 @@ async def create_fornitore_endpoint(fornitore: FornitoreCreate):
             fornitore.telefono
         )
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(insert_query, params)
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        new_id = await db_executor.run(execute_insert, insert_query, params)
         
         # Return created fornitore
         return_query = "SELECT * FROM Fornitori WHERE id_fornitore = ?"
-        result = execute_query(return_query, (new_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (new_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -636,7 +1788,7 @@ async def get_fornitore_endpoint(
     try:
         # Get fornitore base info
         query = "SELECT * FROM Fornitori WHERE id_fornitore = ?"
-        fornitore = execute_query(query, (fornitore_id,), fetch_one=True)
+        fornitore = await execute_query_async(query, (fornitore_id,), fetch_one=True)
         
         if not fornitore:
             raise HTTPException(status_code=404, detail="Fornitore non trovato")
@@ -649,7 +1801,7 @@ async def get_fornitore_endpoint(
         WHERE fk_fornitore = ?
         ORDER BY data_emissione DESC
         """
-        fatture = execute_query(fatture_query, (fornitore_id,))
+        fatture = await execute_query_async(fatture_query, (fornitore_id,))
         
         result = dict(fornitore)
         result['fatture'] = fatture
@@ -671,7 +1823,7 @@ async def update_fornitore_endpoint(
     try:
         # Check if fornitore exists
         check_query = "SELECT id_fornitore FROM Fornitori WHERE id_fornitore = ?"
-        existing = execute_query(check_query, (fornitore_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (fornitore_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Fornitore non trovato")
         
@@ -684,7 +1836,7 @@ async def update_fornitore_endpoint(
         # Check partita_iva uniqueness if being updated
         if 'partita_iva' in update_data:
             piva_check_query = "SELECT id_fornitore FROM Fornitori WHERE partita_iva = ? AND id_fornitore != ?"
-            piva_existing = execute_query(piva_check_query, (update_data['partita_iva'], fornitore_id), fetch_one=True)
+            piva_existing = await execute_query_async(piva_check_query, (update_data['partita_iva'], fornitore_id), fetch_one=True)
             if piva_existing:
                 raise HTTPException(status_code=400, detail="Partita IVA già esistente")
         
@@ -692,11 +1844,11 @@ async def update_fornitore_endpoint(
         update_query = f"UPDATE Fornitori SET {', '.join(set_clauses)} WHERE id_fornitore = ?"
         
         params = list(update_data.values()) + [fornitore_id]
-        execute_query(update_query, tuple(params), fetch_all=False)
+        await execute_query_async(update_query, tuple(params), fetch_all=False)
         
         # Return updated fornitore
         return_query = "SELECT * FROM Fornitori WHERE id_fornitore = ?"
-        result = execute_query(return_query, (fornitore_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (fornitore_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -713,19 +1865,19 @@ async def delete_fornitore_endpoint(
     try:
         # Check if fornitore exists
         check_query = "SELECT id_fornitore FROM Fornitori WHERE id_fornitore = ?"
-        existing = execute_query(check_query, (fornitore_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (fornitore_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Fornitore non trovato")
         
         # Check if fornitore has associated fatture
         fatture_query = "SELECT COUNT(*) as count FROM Fatture WHERE fk_fornitore = ?"
-        fatture_count = execute_query(fatture_query, (fornitore_id,), fetch_one=True)
+        fatture_count = await execute_query_async(fatture_query, (fornitore_id,), fetch_one=True)
         if fatture_count and fatture_count['count'] > 0:
             raise HTTPException(status_code=400, detail="Impossibile eliminare: fornitore ha fatture associate")
         
         # Delete fornitore
         delete_query = "DELETE FROM Fornitori WHERE id_fornitore = ?"
-        execute_query(delete_query, (fornitore_id,), fetch_all=False)
+        await execute_query_async(delete_query, (fornitore_id,), fetch_all=False)
         
         return {"message": "Fornitore eliminato con successo"}
         
@@ -735,6 +1887,365 @@ async def delete_fornitore_endpoint(
         logger.error(f"Error in delete_fornitore: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ===== DISPONIBILITÀ SERVIZI =====
+
+# Due periodi chiusi [inizio, fine] si sovrappongono se ciascuno inizia entro la fine
+# dell'altro: il predicato copre anche i periodi contenuti in (o che contengono) un altro.
+# Con fk_servizio fissato è risolto su idx_assegnazioni_fk_servizio (fk_servizio,
+# data_inizio, data_fine). Parametri: fine del periodo richiesto, poi inizio.
+# Un'assegnazione senza data_fine è a tempo indeterminato: vale come aperta fino a ASSIGNMENT_OPEN_END.
+ASSIGNMENT_OPEN_END = "'9999-12-31'"
+ASSIGNMENT_END_SQL = f"COALESCE(asf.data_fine, {ASSIGNMENT_OPEN_END})"
+ASSIGNMENT_OVERLAP_SQL = f"asf.stato = 'Attivo' AND asf.data_inizio <= ? AND {ASSIGNMENT_END_SQL} >= ?"
+
+def find_overlapping_assignment(conn, servizio_id: int, data_inizio: date, data_fine: date,
+                                exclude_id: Optional[int] = None):
+    """Prima assegnazione attiva del servizio che si sovrappone al periodo (o None)"""
+    query = f"""
+        SELECT asf.id_assegnazione, asf.fk_associato, asf.data_inizio, asf.data_fine
+        FROM AssegnazioniServizi asf
+        WHERE asf.fk_servizio = ? AND {ASSIGNMENT_OVERLAP_SQL}
+    """
+    params = [servizio_id, data_fine.isoformat(), data_inizio.isoformat()]
+    if exclude_id is not None:
+        query += " AND asf.id_assegnazione != ?"
+        params.append(exclude_id)
+    return conn.execute(query + " LIMIT 1", params).fetchone()
+
+# Stato di un servizio nel giorno :oggi, ricavato dalle assegnazioni attive
+# (sonda su idx_assegnazioni_fk_servizio per ogni servizio; senza data_fine l'assegnazione è aperta)
+SERVIZIO_STATO_SQL = f"""CASE WHEN EXISTS (
+        SELECT 1 FROM AssegnazioniServizi asf
+        WHERE asf.fk_servizio = Servizi.id_servizio AND asf.stato = 'Attivo'
+          AND asf.data_inizio <= :oggi AND {ASSIGNMENT_END_SQL} >= :oggi
+    ) THEN 'Occupato' ELSE 'Disponibile' END"""
+
+def refresh_servizi_stato(conn, servizi: Optional[List[int]] = None, oggi: Optional[date] = None):
+    """Allinea Servizi.stato alle assegnazioni attive nel giorno indicato.
+
+    Considera solo i servizi indicati (tutti se None) e non tocca quelli 'In Manutenzione';
+    restituisce le righe (id_servizio, stato) effettivamente modificate.
+    """
+    query = f"UPDATE Servizi SET stato = {SERVIZIO_STATO_SQL} WHERE stato IN ('Disponibile', 'Occupato')"
+    params = {"oggi": (oggi or date.today()).isoformat()}
+    if servizi is not None:
+        query += " AND id_servizio IN (SELECT value FROM json_each(:servizi))"
+        params["servizi"] = json.dumps(sorted(set(servizi)))
+    query += f" AND stato != {SERVIZIO_STATO_SQL} RETURNING id_servizio, stato"
+    return conn.execute(query, params).fetchall()
+
+def free_periods(dal: date, al: date, occupazioni) -> List[Dict[str, str]]:
+    """Periodi liberi in [dal, al] dati i periodi occupati ordinati per data di inizio.
+
+    Un periodo senza data_fine occupa il servizio fino alla fine dell'intervallo.
+    """
+    liberi = []
+    libero_dal = dal
+    for occupazione in occupazioni:
+        inizio = date.fromisoformat(occupazione["data_inizio"][:10])
+        fine = date.fromisoformat(occupazione["data_fine"][:10]) if occupazione["data_fine"] else al
+        if inizio > libero_dal:
+            liberi.append({"dal": libero_dal.isoformat(), "al": min(inizio - timedelta(days=1), al).isoformat()})
+        libero_dal = max(libero_dal, fine + timedelta(days=1))
+        if libero_dal > al:
+            break
+    if libero_dal <= al:
+        liberi.append({"dal": libero_dal.isoformat(), "al": al.isoformat()})
+    return liberi
+
+# ===== CACHE AUTORIZZAZIONI CHIAVI =====
+
+# Tabelle i cui dati finiscono nella cache: un'importazione CSV su una di queste la invalida
+KEY_CACHE_TABLES = ("ChiaviElettroniche", "Associati", "TessereFIV")
+
+KEY_CACHE_QUERY = """
+    SELECT k.key_code, k.fk_associato, k.in_regola, k.credito,
+           a.nome, a.cognome, a.stato_associato,
+           t.scadenza_tesseramento_fiv, t.scadenza_certificato_medico
+    FROM ChiaviElettroniche k
+    JOIN Associati a ON a.id_associato = k.fk_associato
+    LEFT JOIN TessereFIV t ON t.fk_associato = k.fk_associato
+"""
+
+class KeyAuthorizationCache:
+    """Mappa in memoria key_code -> dati di autorizzazione (socio, in regola, credito, FIV, stato).
+
+    Caricata all'avvio. Le scritture dell'API su chiavi, associati e tessere FIV
+    invalidano le voci del socio coinvolto, ricaricate alla lettura successiva con
+    una sola query; importazioni e ripristini la invalidano per intero. Dopo
+    ``ttl_seconds`` viene ricaricata comunque, per le modifiche fatte fuori dall'API.
+    """
+
+    def __init__(self, ttl_seconds=KEY_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._key_by_associato = {}
+        self._loaded_at = None
+        self._seq = 0             # numero progressivo delle invalidazioni
+        self._stale_seq = 0       # ultima invalidazione completa
+        self._dirty = {}          # id_associato -> invalidazione che lo riguarda
+        self._epoch = int(time.time())
+        self.version = 0
+        self._stats = {"full_loads": 0, "partial_loads": 0}
+
+    def invalidate(self, associato_id: Optional[int] = None):
+        """Invalida le voci di un socio (o tutta la cache se ``associato_id`` è None)"""
+        with self._lock:
+            self._seq += 1
+            if associato_id is None:
+                self._stale_seq = self._seq
+            else:
+                self._dirty[associato_id] = self._seq
+
+    def _store(self, row):
+        self._by_key[row["key_code"]] = {
+            "key_code": row["key_code"],
+            "id_associato": row["fk_associato"],
+            "nome": row["nome"],
+            "cognome": row["cognome"],
+            "in_regola": bool(row["in_regola"]),
+            "credito": row["credito"],
+            "stato_associato": row["stato_associato"],
+            "scadenza_tesseramento_fiv": row["scadenza_tesseramento_fiv"],
+            "scadenza_certificato_medico": row["scadenza_certificato_medico"],
+        }
+        self._key_by_associato[row["fk_associato"]] = row["key_code"]
+
+    def refresh(self, conn=None):
+        """Ricarica quanto invalidato (tutto, o solo i soci modificati); ``conn`` evita un secondo checkout"""
+        if conn is None:
+            with db_pool.connection() as conn:
+                return self.refresh(conn)
+        
+        with self._lock:
+            seq = self._seq
+            expired = self.ttl_seconds and self._loaded_at is not None and time.monotonic() - self._loaded_at > self.ttl_seconds
+            full = self._loaded_at is None or self._stale_seq > 0 or expired
+            dirty = dict(self._dirty)
+        if not full and not dirty:
+            return
+        
+        if full:
+            rows = conn.execute(KEY_CACHE_QUERY).fetchall()
+        else:
+            placeholders = ", ".join("?" for _ in dirty)
+            rows = conn.execute(f"{KEY_CACHE_QUERY} WHERE k.fk_associato IN ({placeholders})", tuple(dirty)).fetchall()
+        
+        with self._lock:
+            if full:
+                self._by_key.clear()
+                self._key_by_associato.clear()
+                self._loaded_at = time.monotonic()
+                self._stats["full_loads"] += 1
+                # Invalidazioni arrivate durante il caricamento restano in sospeso
+                if self._stale_seq <= seq:
+                    self._stale_seq = 0
+                self._dirty = {associato: at for associato, at in self._dirty.items() if at > seq}
+            else:
+                for associato in dirty:
+                    old_key = self._key_by_associato.pop(associato, None)
+                    if old_key is not None:
+                        self._by_key.pop(old_key, None)
+                    if self._dirty.get(associato) == dirty[associato]:
+                        del self._dirty[associato]
+                self._stats["partial_loads"] += 1
+            for row in rows:
+                self._store(row)
+            self.version += 1
+
+    def peek(self, key_code: str):
+        """Voce della chiave senza ricaricare (da usare dopo ``refresh``)"""
+        with self._lock:
+            entry = self._by_key.get(key_code)
+            return dict(entry) if entry is not None else None
+
+    def get(self, key_code: str):
+        self.refresh()
+        return self.peek(key_code)
+
+    def update_credito(self, key_code: str, credito: float):
+        """Aggiorna il credito dopo un addebito già registrato nel database"""
+        with self._lock:
+            entry = self._by_key.get(key_code)
+            if entry is not None:
+                entry["credito"] = credito
+                self.version += 1
+
+    def etag(self, version: int) -> str:
+        return f'W/"{self._epoch}-{version}"'
+
+    def snapshot(self):
+        """Tutte le voci, con la validità FIV alla data odierna e l'esito dell'autorizzazione"""
+        self.refresh()
+        oggi = date.today().isoformat()
+        with self._lock:
+            entries = [dict(entry) for entry in self._by_key.values()]
+            version = self.version
+        for entry in entries:
+            entry["fiv_valida"] = bool(
+                entry["scadenza_tesseramento_fiv"] and entry["scadenza_tesseramento_fiv"] >= oggi
+                and entry["scadenza_certificato_medico"] and entry["scadenza_certificato_medico"] >= oggi
+            )
+            # Stessa regola dei varchi online, per i lettori che lavorano offline
+            entry["autorizzata"] = access_denial_reason(entry) is None
+        entries.sort(key=lambda entry: entry["key_code"])
+        return version, entries
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update(entries=len(self._by_key), version=self.version, pending_invalidations=len(self._dirty) + bool(self._stale_seq))
+        return data
+
+key_cache = KeyAuthorizationCache()
+
+# ===== MANUTENZIONE STATI =====
+
+class StatusMaintenance:
+    """Rende persistenti gli stati che dipendono dalla data odierna.
+
+    Così le letture filtrano su colonne salvate e indicizzate invece di calcolare
+    date('now') riga per riga:
+
+    - Servizi.stato: 'Occupato' se un'assegnazione attiva copre la data odierna,
+      altrimenti 'Disponibile' ('In Manutenzione' non viene toccato). Dopo la prima
+      passata sono ricalcolati solo i servizi con assegnazioni iniziate o terminate
+      dall'ultima passata (indici parziali sulle date delle assegnazioni attive).
+    - Fatture.stato: 'Emessa' diventa 'Scaduta' oltre la data di scadenza, e torna
+      'Emessa' se la scadenza viene posticipata (indice parziale delle fatture aperte).
+    - Associati.stato_associato: 'Attivo' diventa 'Scaduto' con la tessera FIV
+      scaduta; la riattivazione resta manuale.
+
+    Ogni passata è una transazione; ogni UPDATE scrive solo le righe che cambiano stato.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ultimo_giorno = None
+        self._stats = {"runs": 0, "servizi": 0, "fatture": 0, "associati": 0, "errors": 0}
+        self.last_run = None
+
+    def _servizi_da_ricalcolare(self, conn, dal: date, oggi: date) -> List[int]:
+        """Servizi con assegnazioni attive iniziate in (dal, oggi] o terminate in [dal, oggi).
+
+        Le assegnazioni senza data_fine non terminano: entrano solo dal ramo delle iniziate.
+        """
+        rows = conn.execute(
+            """
+            SELECT fk_servizio FROM AssegnazioniServizi
+            WHERE stato = 'Attivo' AND data_inizio > ? AND data_inizio <= ?
+            UNION
+            SELECT fk_servizio FROM AssegnazioniServizi
+            WHERE stato = 'Attivo' AND data_fine >= ? AND data_fine < ?
+            """,
+            (dal.isoformat(), oggi.isoformat(), dal.isoformat(), oggi.isoformat())
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def run(self, oggi: Optional[date] = None, completa: bool = False):
+        """Esegue una passata e ne restituisce l'esito"""
+        oggi = oggi or date.today()
+        with self._lock:
+            dal = None if completa else self._ultimo_giorno
+            start = time.perf_counter()
+            try:
+                with db_pool.connection() as conn:
+                    try:
+                        conn.execute("BEGIN IMMEDIATE")
+                        if dal is None:
+                            servizi = refresh_servizi_stato(conn, None, oggi)
+                        else:
+                            candidati = self._servizi_da_ricalcolare(conn, dal, oggi) if dal < oggi else []
+                            servizi = refresh_servizi_stato(conn, candidati, oggi) if candidati else []
+                        
+                        # stato IN (...) ripete il filtro di idx_fatture_aperte_scadenza,
+                        # condizione perché il planner possa usare l'indice parziale
+                        scadute = conn.execute(
+                            """
+                            UPDATE Fatture SET stato = 'Scaduta'
+                            WHERE stato IN ('Emessa', 'Scaduta') AND data_scadenza < ? AND stato = 'Emessa'
+                            RETURNING id_fattura
+                            """,
+                            (oggi.isoformat(),)
+                        ).fetchall()
+                        riaperte = conn.execute(
+                            """
+                            UPDATE Fatture SET stato = 'Emessa'
+                            WHERE stato IN ('Emessa', 'Scaduta') AND data_scadenza >= ? AND stato = 'Scaduta'
+                            RETURNING id_fattura
+                            """,
+                            (oggi.isoformat(),)
+                        ).fetchall()
+                        associati = conn.execute(
+                            """
+                            UPDATE Associati SET stato_associato = 'Scaduto'
+                            WHERE stato_associato = 'Attivo' AND id_associato IN (
+                                SELECT fk_associato FROM TessereFIV WHERE scadenza_tesseramento_fiv < ?
+                            )
+                            RETURNING id_associato
+                            """,
+                            (oggi.isoformat(),)
+                        ).fetchall()
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+            
+            for row in associati:
+                key_cache.invalidate(row[0])
+            
+            self._ultimo_giorno = oggi
+            self._stats["runs"] += 1
+            self._stats["servizi"] += len(servizi)
+            self._stats["fatture"] += len(scadute) + len(riaperte)
+            self._stats["associati"] += len(associati)
+            self.last_run = {
+                "data": oggi.isoformat(),
+                "completa": dal is None,
+                "eseguita_il": datetime.now().isoformat(timespec="seconds"),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "servizi": [{"id_servizio": row[0], "stato": row[1]} for row in servizi],
+                "fatture_scadute": len(scadute),
+                "fatture_riaperte": len(riaperte),
+                "associati_scaduti": [row[0] for row in associati],
+            }
+            return dict(self.last_run)
+
+    def reset(self):
+        """La prossima passata ricalcola tutti i servizi (es. dopo un ripristino del database)"""
+        with self._lock:
+            self._ultimo_giorno = None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "interval_seconds": STATUS_SWEEP_INTERVAL_SECONDS,
+                "ultimo_giorno": self._ultimo_giorno.isoformat() if self._ultimo_giorno else None,
+                "stats": dict(self._stats),
+                "last_run": self.last_run,
+            }
+
+status_maintenance = StatusMaintenance()
+_status_maintenance_task = None
+
+async def _status_maintenance_loop():
+    """Passata all'avvio e poi ogni STATUS_SWEEP_INTERVAL_SECONDS"""
+    while True:
+        try:
+            esito = await db_executor.run(status_maintenance.run)
+            logger.info(
+                f"Manutenzione stati: {len(esito['servizi'])} servizi, "
+                f"{esito['fatture_scadute'] + esito['fatture_riaperte']} fatture, "
+                f"{len(esito['associati_scaduti'])} associati aggiornati"
+            )
+        except Exception as e:
+            logger.error(f"Error in manutenzione stati: {e}")
+        await asyncio.sleep(STATUS_SWEEP_INTERVAL_SECONDS)
+
 # ===== ENDPOINTS CHIAVI ELETTRONICHE =====
 
 @app.get("/associati/{associato_id}/chiave-elettronica", summary="Dettagli chiave elettronica")
@@ -745,13 +2256,13 @@ async def get_chiave_elettronica_endpoint(
     try:
         # Check if associato exists
         check_query = "SELECT id_associato FROM Associati WHERE id_associato = ?"
-        existing = execute_query(check_query, (associato_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (associato_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
         # Get chiave elettronica
         query = "SELECT * FROM ChiaviElettroniche WHERE fk_associato = ?"
-        chiave = execute_query(query, (associato_id,), fetch_one=True)
+        chiave = await execute_query_async(query, (associato_id,), fetch_one=True)
         
         if not chiave:
             raise HTTPException(status_code=404, detail="Chiave elettronica non trovata")
@@ -773,42 +2284,40 @@ async def create_chiave_elettronica_endpoint(
     try:
         # Check if associato exists
         check_query = "SELECT id_associato FROM Associati WHERE id_associato = ?"
-        existing = execute_query(check_query, (associato_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (associato_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
-        # Check if key_code is unique
-        key_check_query = "SELECT fk_associato FROM ChiaviElettroniche WHERE key_code = ? AND fk_associato != ?"
-        key_existing = execute_query(key_check_query, (chiave.key_code, associato_id), fetch_one=True)
-        if key_existing:
+        # Inserimento o aggiornamento in un solo statement: l'unicità di key_code
+        # è garantita dal vincolo UNIQUE (e dal suo indice), non da una ricerca preventiva
+        def _upsert_chiave():
+            with db_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = dict_factory
+                try:
+                    row = cursor.execute(
+                        """
+                        INSERT INTO ChiaviElettroniche (fk_associato, key_code, in_regola, credito)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(fk_associato) DO UPDATE SET
+                            key_code = excluded.key_code, in_regola = excluded.in_regola, credito = excluded.credito
+                        RETURNING *
+                        """,
+                        (associato_id, chiave.key_code, chiave.in_regola, chiave.credito)
+                    ).fetchall()[0]
+                    conn.commit()
+                except sqlite3.IntegrityError as e:
+                    conn.rollback()
+                    if "key_code" in str(e):
+                        return None
+                    raise
+                return row
+        
+        result = await db_executor.run(_upsert_chiave)
+        if result is None:
             raise HTTPException(status_code=400, detail="Codice chiave già esistente")
-        
-        # Check if chiave already exists for this associato
-        existing_chiave_query = "SELECT fk_associato FROM ChiaviElettroniche WHERE fk_associato = ?"
-        existing_chiave = execute_query(existing_chiave_query, (associato_id,), fetch_one=True)
-        
-        if existing_chiave:
-            # Update existing
-            update_query = """
-            UPDATE ChiaviElettroniche 
-            SET key_code = ?, in_regola = ?, credito = ?
-            WHERE fk_associato = ?
-            """
-            params = (chiave.key_code, chiave.in_regola, chiave.credito, associato_id)
-        else:
-            # Insert new
-            update_query = """
-            INSERT INTO ChiaviElettroniche (fk_associato, key_code, in_regola, credito)
-            VALUES (?, ?, ?, ?)
-            """
-            params = (associato_id, chiave.key_code, chiave.in_regola, chiave.credito)
-        
-        execute_query(update_query, params, fetch_all=False)
-        
-        # Return created/updated chiave
-        return_query = "SELECT * FROM ChiaviElettroniche WHERE fk_associato = ?"
-        result = execute_query(return_query, (associato_id,), fetch_one=True)
-        return result
+        key_cache.invalidate(associato_id)
+        return result
         
     except HTTPException:
         raise
@@ -823,21 +2332,17 @@ async def ricarica_crediti_endpoint(
 ):
     """Ricarica i crediti docce per una chiave elettronica"""
     try:
-        # Check if chiave exists
-        check_query = "SELECT credito FROM ChiaviElettroniche WHERE fk_associato = ?"
-        existing = execute_query(check_query, (associato_id,), fetch_one=True)
-        if not existing:
+        # Incremento atomico: nessuna ricarica concorrente (o addebito di una doccia) va persa
+        update_query = """
+        UPDATE ChiaviElettroniche SET credito = ROUND(COALESCE(credito, 0) + ?, 2)
+        WHERE fk_associato = ?
+        RETURNING *
+        """
+        rows = await execute_query_async(update_query, (ricarica.crediti_da_aggiungere, associato_id))
+        if not rows:
             raise HTTPException(status_code=404, detail="Chiave elettronica non trovata")
-        
-        # Update credito
-        new_credito = existing['credito'] + ricarica.crediti_da_aggiungere
-        update_query = "UPDATE ChiaviElettroniche SET credito = ? WHERE fk_associato = ?"
-        execute_query(update_query, (new_credito, associato_id), fetch_all=False)
-        
-        # Return updated chiave
-        return_query = "SELECT * FROM ChiaviElettroniche WHERE fk_associato = ?"
-        result = execute_query(return_query, (associato_id,), fetch_one=True)
-        return result
+        key_cache.update_credito(rows[0]["key_code"], rows[0]["credito"])
+        return rows[0]
         
     except HTTPException:
         raise
@@ -845,6 +2350,212 @@ async def ricarica_crediti_endpoint(
         logger.error(f"Error in ricarica_crediti_endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def access_denial_reason(chiave) -> Optional[str]:
+    """Motivo del diniego per una chiave (None se l'accesso è consentito).
+
+    Accedono solo i soci 'Attivo' con la chiave in regola e la tessera FIV non
+    scaduta (stessa regola della manutenzione stati, applicata anche tra una
+    passata e l'altra); il credito delle docce è verificato a parte.
+    """
+    if chiave is None:
+        return "Chiave sconosciuta"
+    if chiave["stato_associato"] != "Attivo":
+        return f"Socio {chiave['stato_associato']}"
+    scadenza_fiv = chiave["scadenza_tesseramento_fiv"]
+    if scadenza_fiv and str(scadenza_fiv)[:10] < date.today().isoformat():
+        return "Tessera FIV scaduta"
+    if not chiave["in_regola"]:
+        return "Non in regola"
+    return None
+
+def _process_access_events(eventi: List[EventoAccesso]):
+    """Autorizza una sequenza di eventi dei lettori in un'unica transazione.
+
+    Per le docce l'addebito è un solo UPDATE condizionato (``credito >= costo``):
+    eventi concorrenti sulla stessa chiave non possono portare il credito sotto zero.
+    Il registro AccessiChiavi viene scritto con un executemany prima del commit.
+    Le porte sono autorizzate dalla cache in memoria delle chiavi.
+    """
+    ricevuto_il = datetime.now().isoformat(timespec="seconds")
+    oggi = date.today().isoformat()
+    risultati = []
+    registro = []
+    addebiti = {}
+    with db_pool.connection() as conn:
+        key_cache.refresh(conn)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for evento in eventi:
+                addebito = 0.0
+                chiave = None
+                if evento.tipo == "Doccia":
+                    costo = evento.costo or COSTO_DOCCIA
+                    # Stesse condizioni di access_denial_reason, verificate nell'UPDATE stesso
+                    addebitata = conn.execute(
+                        """
+                        UPDATE ChiaviElettroniche SET credito = ROUND(credito - ?, 2)
+                        WHERE key_code = ? AND in_regola = 1 AND credito >= ?
+                          AND EXISTS (
+                              SELECT 1 FROM Associati a
+                              WHERE a.id_associato = ChiaviElettroniche.fk_associato AND a.stato_associato = 'Attivo'
+                          )
+                          AND NOT EXISTS (
+                              SELECT 1 FROM TessereFIV t
+                              WHERE t.fk_associato = ChiaviElettroniche.fk_associato AND t.scadenza_tesseramento_fiv < ?
+                          )
+                        RETURNING fk_associato, in_regola, credito
+                        """,
+                        (costo, evento.key_code, costo, oggi)
+                    ).fetchall()
+                    if addebitata:
+                        chiave = dict(addebitata[0], stato_associato="Attivo", scadenza_tesseramento_fiv=None)
+                        addebito = costo
+                        addebiti[evento.key_code] = chiave["credito"]
+                    else:
+                        # Diniego: il motivo è letto dal database, non dalla cache
+                        chiave = conn.execute(
+                            """
+                            SELECT k.fk_associato, k.in_regola, k.credito, a.stato_associato,
+                                   t.scadenza_tesseramento_fiv
+                            FROM ChiaviElettroniche k
+                            JOIN Associati a ON a.id_associato = k.fk_associato
+                            LEFT JOIN TessereFIV t ON t.fk_associato = k.fk_associato
+                            WHERE k.key_code = ?
+                            """,
+                            (evento.key_code,)
+                        ).fetchone()
+                else:
+                    voce = key_cache.peek(evento.key_code)
+                    if voce is not None:
+                        chiave = {"fk_associato": voce["id_associato"], "in_regola": voce["in_regola"],
+                                  "credito": voce["credito"], "stato_associato": voce["stato_associato"],
+                                  "scadenza_tesseramento_fiv": voce["scadenza_tesseramento_fiv"]}
+                
+                motivo = access_denial_reason(chiave)
+                if motivo is None and evento.tipo == "Doccia" and not addebito:
+                    motivo = "Credito insufficiente"
+                
+                esito = "Negato" if motivo else "Consentito"
+                fk_associato = chiave["fk_associato"] if chiave is not None else None
+                credito = chiave["credito"] if chiave is not None else None
+                data_ora = evento.data_ora.isoformat(timespec="seconds") if evento.data_ora else ricevuto_il
+                registro.append((evento.key_code, fk_associato, evento.varco, evento.tipo, data_ora,
+                                 esito, motivo, addebito, credito))
+                risultati.append({
+                    "key_code": evento.key_code,
+                    "varco": evento.varco,
+                    "tipo": evento.tipo,
+                    "consentito": motivo is None,
+                    "esito": esito,
+                    "motivo": motivo,
+                    "id_associato": fk_associato,
+                    "credito_addebitato": addebito,
+                    "credito_residuo": credito,
+                })
+            
+            conn.executemany(
+                """
+                INSERT INTO AccessiChiavi (key_code, fk_associato, varco, tipo, data_ora,
+                                           esito, motivo, credito_addebitato, credito_residuo)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                registro
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    for key_code, credito in addebiti.items():
+        key_cache.update_credito(key_code, credito)
+    return risultati
+
+@app.post("/chiavi/accessi", summary="Registra eventi dei lettori di chiavi")
+async def register_access_events(batch: EventiAccesso):
+    """Autorizza gli eventi di porte e docce (anche a blocchi) e li aggiunge al registro accessi.
+
+    I risultati sono nello stesso ordine degli eventi; più docce della stessa chiave
+    nello stesso blocco scalano il credito in sequenza.
+    """
+    try:
+        risultati = await db_executor.run(_process_access_events, batch.eventi)
+        consentiti = sum(1 for r in risultati if r["consentito"])
+        return {
+            "elaborati": len(risultati),
+            "consentiti": consentiti,
+            "negati": len(risultati) - consentiti,
+            "risultati": risultati,
+        }
+    except Exception as e:
+        logger.error(f"Error in register_access_events: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chiavi/accessi", summary="Registro accessi")
+async def list_access_events(
+    key_code: Optional[str] = Query(None, description="Filtra per codice chiave"),
+    associato_id: Optional[int] = Query(None, description="Filtra per associato"),
+    esito: Optional[str] = Query(None, pattern="^(Consentito|Negato)$"),
+    dal: Optional[datetime] = Query(None, description="Eventi da questo istante"),
+    al: Optional[datetime] = Query(None, description="Eventi fino a questo istante"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Eventi del registro accessi, dal più recente"""
+    try:
+        query = "SELECT * FROM AccessiChiavi WHERE 1=1"
+        params = []
+        
+        if key_code:
+            query += " AND key_code = ?"
+            params.append(key_code)
+        
+        if associato_id is not None:
+            query += " AND fk_associato = ?"
+            params.append(associato_id)
+        
+        if esito:
+            query += " AND esito = ?"
+            params.append(esito)
+        
+        if dal:
+            query += " AND data_ora >= ?"
+            params.append(dal.isoformat(timespec="seconds"))
+        
+        if al:
+            query += " AND data_ora <= ?"
+            params.append(al.isoformat(timespec="seconds"))
+        
+        query += " ORDER BY data_ora DESC, id_accesso DESC LIMIT ?"
+        params.append(limit)
+        
+        results = await execute_query_async(query, tuple(params))
+        return {"count": len(results), "results": results}
+    except Exception as e:
+        logger.error(f"Error in list_access_events: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chiavi/snapshot", summary="Esportazione autorizzazioni chiavi")
+async def chiavi_snapshot(request: Request):
+    """Tutte le chiavi con i dati di autorizzazione, per i lettori che lavorano offline.
+
+    Servita dalla cache in memoria; con If-None-Match uguale all'ETag della
+    versione corrente risponde 304 senza corpo.
+    """
+    try:
+        version, chiavi = await db_executor.run(key_cache.snapshot)
+        etag = key_cache.etag(version)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        payload = {
+            "versione": version,
+            "generato_il": datetime.now().isoformat(timespec="seconds"),
+            "count": len(chiavi),
+            "chiavi": chiavi,
+        }
+        return JSONResponse(content=payload, headers={"ETag": etag})
+    except Exception as e:
+        logger.error(f"Error in chiavi_snapshot: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/servizi", summary="Lista servizi")
 async def list_servizi(
     stato: Optional[str] = Query(None, pattern="^(Disponibile|Occupato|In Manutenzione)$", description="Filtra per stato"),
@@ -879,16 +2590,20 @@ async def list_servizi(
             a.cognome as assegnatario_cognome
         FROM Servizi s
         LEFT JOIN PrezziServizi ps ON s.fk_prezzo = ps.id_prezzo
-        LEFT JOIN (
-            SELECT asf.* FROM AssegnazioniServizi asf
-            WHERE asf.stato = 'Attivo' AND asf.data_fine >= date('now')
-        ) asf ON asf.fk_servizio = s.id_servizio
+        -- Assegnazione attiva in corso o successiva più vicina: una ricerca sull'indice per servizio
+        LEFT JOIN AssegnazioniServizi asf ON asf.id_assegnazione = (
+            SELECT x.id_assegnazione FROM AssegnazioniServizi x
+            WHERE x.fk_servizio = s.id_servizio AND x.stato = 'Attivo'
+              AND COALESCE(x.data_fine, {ASSIGNMENT_OPEN_END}) >= date('now')
+            ORDER BY x.data_inizio
+            LIMIT 1
+        )
         LEFT JOIN Associati a ON asf.fk_associato = a.id_associato
         WHERE {where_clause}
         ORDER BY s.categoria, s.id_servizio
         """
         
-        results = execute_query(query, tuple(params))
+        results = await execute_query_async(query, tuple(params))
         
         return {
             "count": len(results),
@@ -911,22 +2626,86 @@ async def create_servizio_endpoint(servizio: ServizioFisicoCreate):
         # Use the correct field mapping
         params = (servizio.nome, servizio.descrizione, servizio.tipo, servizio.stato)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(insert_query, params)
-        new_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        new_id = await db_executor.run(execute_insert, insert_query, params)
         
         # Return created servizio
         return_query = "SELECT * FROM Servizi WHERE id_servizio = ?"
-        result = execute_query(return_query, (new_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (new_id,), fetch_one=True)
         return result
         
     except Exception as e:
         logger.error(f"Error in create_servizio: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/servizi/disponibilita", summary="Disponibilità servizi nel periodo")
+async def servizi_disponibilita(
+    dal: date = Query(..., description="Inizio del periodo (incluso)"),
+    al: date = Query(..., description="Fine del periodo (inclusa)"),
+    categoria: Optional[str] = Query(None, description="Categoria dei servizi (es. Posto Barca, Armadietto)"),
+    solo_liberi: bool = Query(False, description="Restituisce solo i servizi liberi per tutto il periodo")
+):
+    """Calendario di disponibilità: per ogni servizio le occupazioni nel periodo e i periodi liberi.
+
+    Un'unica query per tutta la categoria; le assegnazioni di ogni servizio sono
+    cercate sull'indice (fk_servizio, data_inizio, data_fine).
+    """
+    if al < dal:
+        raise HTTPException(status_code=400, detail="La data 'al' deve essere uguale o successiva a 'dal'")
+    try:
+        query = f"""
+        SELECT s.id_servizio, s.nome, s.categoria, s.stato,
+               asf.id_assegnazione, asf.fk_associato, a.nome AS associato_nome, a.cognome AS associato_cognome,
+               asf.data_inizio, asf.data_fine
+        FROM Servizi s
+        LEFT JOIN AssegnazioniServizi asf ON asf.fk_servizio = s.id_servizio AND {ASSIGNMENT_OVERLAP_SQL}
+        LEFT JOIN Associati a ON a.id_associato = asf.fk_associato
+        """
+        params = [al.isoformat(), dal.isoformat()]
+        if categoria:
+            query += " WHERE s.categoria = ?"
+            params.append(categoria)
+        query += " ORDER BY s.categoria, s.id_servizio, asf.data_inizio"
+        
+        rows = await execute_query_async(query, tuple(params))
+        
+        servizi = {}
+        for row in rows:
+            servizio = servizi.setdefault(row["id_servizio"], {
+                "id_servizio": row["id_servizio"],
+                "nome": row["nome"],
+                "categoria": row["categoria"],
+                "stato": row["stato"],
+                "occupazioni": [],
+            })
+            if row["id_assegnazione"] is not None:
+                servizio["occupazioni"].append({
+                    "id_assegnazione": row["id_assegnazione"],
+                    "fk_associato": row["fk_associato"],
+                    "associato": f"{row['associato_nome']} {row['associato_cognome']}",
+                    "data_inizio": row["data_inizio"],
+                    "data_fine": row["data_fine"],
+                })
+        
+        results = []
+        for servizio in servizi.values():
+            in_manutenzione = servizio["stato"] == "In Manutenzione"
+            servizio["periodi_liberi"] = [] if in_manutenzione else free_periods(dal, al, servizio["occupazioni"])
+            servizio["libero"] = not in_manutenzione and not servizio["occupazioni"]
+            if servizio["libero"] or not solo_liberi:
+                results.append(servizio)
+        
+        return {
+            "dal": dal.isoformat(),
+            "al": al.isoformat(),
+            "categoria": categoria,
+            "count": len(results),
+            "liberi": sum(1 for servizio in results if servizio["libero"]),
+            "results": results,
+        }
+    except Exception as e:
+        logger.error(f"Error in servizi_disponibilita: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/servizi/{servizio_id}", summary="Dettagli servizio")
 async def get_servizio_endpoint(
     servizio_id: int = Path(..., description="ID del servizio")
@@ -935,7 +2714,7 @@ async def get_servizio_endpoint(
     try:
         # Get servizio base info
         query = "SELECT * FROM Servizi WHERE id_servizio = ?"
-        servizio = execute_query(query, (servizio_id,), fetch_one=True)
+        servizio = await execute_query_async(query, (servizio_id,), fetch_one=True)
         
         if not servizio:
             raise HTTPException(status_code=404, detail="Servizio non trovato")
@@ -948,7 +2727,7 @@ async def get_servizio_endpoint(
         WHERE asf.fk_servizio = ?
         ORDER BY asf.anno_competenza DESC, asf.data_inizio DESC
         """
-        assegnazioni = execute_query(assegnazioni_query, (servizio_id,))
+        assegnazioni = await execute_query_async(assegnazioni_query, (servizio_id,))
         
         result = dict(servizio)
         result['assegnazioni'] = assegnazioni
@@ -970,7 +2749,7 @@ async def update_servizio_endpoint(
     try:
         # Check if servizio exists
         check_query = "SELECT id_servizio FROM Servizi WHERE id_servizio = ?"
-        existing = execute_query(check_query, (servizio_id,), fetch_one=True)
+        existing = await execute_query_async(check_query, (servizio_id,), fetch_one=True)
         if not existing:
             raise HTTPException(status_code=404, detail="Servizio non trovato")
         
@@ -990,11 +2769,11 @@ async def update_servizio_endpoint(
         update_query = f"UPDATE Servizi SET {', '.join(set_clauses)} WHERE id_servizio = ?"
         
         params = list(db_update.values()) + [servizio_id]
-        execute_query(update_query, tuple(params), fetch_all=False)
+        await execute_query_async(update_query, tuple(params), fetch_all=False)
         
         # Return updated servizio
         return_query = "SELECT * FROM Servizi WHERE id_servizio = ?"
-        result = execute_query(return_query, (servizio_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (servizio_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -1010,124 +2789,315 @@ async def create_assegnazione_servizio_endpoint(
 ):
     """Assegna un servizio a un socio"""
     try:
-        # Check if servizio exists and get details (including fk_prezzo)
-        servizio_query = "SELECT id_servizio, nome, categoria, fk_prezzo FROM Servizi WHERE id_servizio = ?"
-        servizio_row = execute_query(servizio_query, (servizio_id,), fetch_one=True)
+        # Check if servizio exists and get details (including the linked prezzo)
+        servizio_query = """
+        SELECT s.id_servizio, s.nome, s.categoria, s.fk_prezzo, ps.costo
+        FROM Servizi s
+        LEFT JOIN PrezziServizi ps ON ps.id_prezzo = s.fk_prezzo
+        WHERE s.id_servizio = ?
+        """
+        servizio_row = await execute_query_async(servizio_query, (servizio_id,), fetch_one=True)
         if not servizio_row:
             raise HTTPException(status_code=404, detail="Servizio non trovato")
         
         # Check if associato exists
         associato_query = "SELECT id_associato FROM Associati WHERE id_associato = ?"
-        associato_exists = execute_query(associato_query, (assegnazione.fk_associato,), fetch_one=True)
+        associato_exists = await execute_query_async(associato_query, (assegnazione.fk_associato,), fetch_one=True)
         if not associato_exists:
             raise HTTPException(status_code=404, detail="Associato non trovato")
         
-        # Check for overlapping assignments
-        overlap_query = """
-        SELECT id_assegnazione FROM AssegnazioniServizi 
-        WHERE fk_servizio = ? AND stato = 'Attivo'
-        AND ((data_inizio <= ? AND data_fine >= ?) OR (data_inizio <= ? AND data_fine >= ?))
-        """
-        overlap_exists = execute_query(overlap_query, (
-            servizio_id, 
-            assegnazione.data_inizio.isoformat(), assegnazione.data_inizio.isoformat(),
-            assegnazione.data_fine.isoformat(), assegnazione.data_fine.isoformat()
-        ), fetch_one=True)
-        
-        if overlap_exists:
-            raise HTTPException(status_code=400, detail="Servizio già assegnato nel periodo specificato")
-        
-        # Compute prezzo using linked prezzo record
-        prezzo_row = execute_query(
-            "SELECT costo FROM PrezziServizi WHERE id_prezzo = ?",
-            (servizio_row["fk_prezzo"],),
-            fetch_one=True,
-        )
-        costo = float(prezzo_row.get("costo") if prezzo_row else 0.0)
+        if assegnazione.data_fine < assegnazione.data_inizio:
+            raise HTTPException(status_code=400, detail="La data di fine deve essere uguale o successiva alla data di inizio")
+        
+        costo = float(servizio_row["costo"] or 0.0)
 
         # Transaction: create assegnazione, set servizio Occupato, create fattura
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-
-            # 1) Insert new assegnazione
-            insert_query = """
-            INSERT INTO AssegnazioniServizi (fk_servizio, fk_associato, data_inizio, data_fine, anno_competenza, stato)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """
-            cur.execute(
-                insert_query,
-                (
-                    servizio_id,
-                    assegnazione.fk_associato,
-                    assegnazione.data_inizio.isoformat(),
-                    assegnazione.data_fine.isoformat(),
-                    assegnazione.anno_competenza,
-                    assegnazione.stato,
-                ),
-            )
-            new_id = cur.lastrowid
+        def _create_assegnazione_tx():
+            conn = get_db_connection()
+            try:
+                cur = conn.cursor()
+                # Verifica delle sovrapposizioni e inserimento sotto lo stesso lock di scrittura:
+                # due richieste concorrenti non possono assegnare lo stesso periodo
+                cur.execute("BEGIN IMMEDIATE")
+                if assegnazione.stato == "Attivo" and find_overlapping_assignment(
+                    conn, servizio_id, assegnazione.data_inizio, assegnazione.data_fine
+                ):
+                    raise HTTPException(status_code=400, detail="Servizio già assegnato nel periodo specificato")
+
+                # 1) Insert new assegnazione
+                insert_query = """
+                INSERT INTO AssegnazioniServizi (fk_servizio, fk_associato, data_inizio, data_fine, anno_competenza, stato)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """
+                cur.execute(
+                    insert_query,
+                    (
+                        servizio_id,
+                        assegnazione.fk_associato,
+                        assegnazione.data_inizio.isoformat(),
+                        assegnazione.data_fine.isoformat(),
+                        assegnazione.anno_competenza,
+                        assegnazione.stato,
+                    ),
+                )
+                new_id = cur.lastrowid
+
+                # 2) Update servizio status (Occupato se l'assegnazione copre la data odierna)
+                refresh_servizi_stato(conn, [servizio_id])
+
+                # 3) Create Fattura (Attiva)
+                imponibile = costo
+                iva = 0.00  # IVA management can be added later
+                totale = imponibile + iva
+                today = date.today()
+                scadenza = today + timedelta(days=30)
+                numero_fattura = next_invoice_number(conn, "SF", today)
+
+                cur.execute(
+                    """
+                    INSERT INTO Fatture (
+                        numero_fattura, data_emissione, data_scadenza, fk_associato,
+                        fk_fornitore, tipo_fattura, importo_imponibile, importo_iva, importo_totale, stato,
+                        fk_assegnazione_servizio
+                    ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa', ?)
+                    """,
+                    (
+                        numero_fattura,
+                        today.strftime("%Y-%m-%d"),
+                        scadenza.strftime("%Y-%m-%d"),
+                        assegnazione.fk_associato,
+                        imponibile,
+                        iva,
+                        totale,
+                        new_id,
+                    ),
+                )
+                id_fattura = cur.lastrowid
+
+                conn.commit()
+
+                # Return created assegnazione plus invoice info
+                created = dict(cur.execute("SELECT * FROM AssegnazioniServizi WHERE id_assegnazione = ?", (new_id,)).fetchone())
+                created.update({
+                    "id_fattura": id_fattura,
+                    "numero_fattura": numero_fattura,
+                    "importo_totale": totale,
+                })
+                return created
+            except HTTPException:
+                conn.rollback()
+                raise
+            except Exception as inner_e:
+                conn.rollback()
+                logger.error(f"Transaction error in create_assegnazione_servizio: {inner_e}")
+                raise HTTPException(status_code=500, detail=str(inner_e))
+            finally:
+                conn.close()
+
+        return await db_executor.run(_create_assegnazione_tx)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in create_assegnazione_servizio: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            # 2) Update servizio status to Occupato
-            cur.execute("UPDATE Servizi SET stato = 'Occupato' WHERE id_servizio = ?", (servizio_id,))
+def _validate_assignment_batch(conn, voci: List[AssegnazioneServizioBatchItem]) -> Dict[int, str]:
+    """Motivo di rifiuto per indice di voce; le voci assenti dal risultato sono valide.
 
-            # 3) Create Fattura (Attiva)
-            imponibile = costo
-            iva = 0.00  # IVA management can be added later
-            totale = imponibile + iva
-            today = date.today()
-            scadenza = today + timedelta(days=30)
-            numero_fattura = f"SF-{assegnazione.fk_associato}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    Servizi, associati e sovrapposizioni con le assegnazioni già presenti sono
+    verificati con una query ciascuno sull'intero blocco (json_each); le
+    sovrapposizioni interne al blocco sono risolte in memoria: vince la prima voce.
+    """
+    rifiuti = {}
+    for indice, voce in enumerate(voci):
+        if voce.data_fine < voce.data_inizio:
+            rifiuti[indice] = "La data di fine deve essere uguale o successiva alla data di inizio"
+    
+    servizi = {row[0] for row in conn.execute(
+        "SELECT id_servizio FROM Servizi WHERE id_servizio IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted({voce.fk_servizio for voce in voci})),)
+    ).fetchall()}
+    associati = {row[0] for row in conn.execute(
+        "SELECT id_associato FROM Associati WHERE id_associato IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted({voce.fk_associato for voce in voci})),)
+    ).fetchall()}
+    for indice, voce in enumerate(voci):
+        if indice in rifiuti:
+            continue
+        if voce.fk_servizio not in servizi:
+            rifiuti[indice] = "Servizio non trovato"
+        elif voce.fk_associato not in associati:
+            rifiuti[indice] = "Associato non trovato"
+    
+    attive = [(indice, voce) for indice, voce in enumerate(voci) if voce.stato == "Attivo" and indice not in rifiuti]
+    if not attive:
+        return rifiuti
+    
+    # Sovrapposizioni con le assegnazioni attive esistenti, stesso predicato di
+    # ASSIGNMENT_OVERLAP_SQL, risolto su idx_assegnazioni_fk_servizio per ogni voce
+    periodi = json.dumps([[indice, voce.fk_servizio, voce.data_inizio.isoformat(), voce.data_fine.isoformat()]
+                          for indice, voce in attive])
+    conflitti = conn.execute(
+        f"""
+        WITH richieste AS (
+            SELECT json_extract(value, '$[0]') AS indice,
+                   json_extract(value, '$[1]') AS fk_servizio,
+                   json_extract(value, '$[2]') AS data_inizio,
+                   json_extract(value, '$[3]') AS data_fine
+            FROM json_each(?)
+        )
+        SELECT r.indice, MIN(asf.id_assegnazione)
+        FROM richieste r
+        JOIN AssegnazioniServizi asf
+          ON asf.fk_servizio = r.fk_servizio
+         AND asf.stato = 'Attivo' AND asf.data_inizio <= r.data_fine AND {ASSIGNMENT_END_SQL} >= r.data_inizio
+        GROUP BY r.indice
+        """,
+        (periodi,)
+    ).fetchall()
+    for indice, id_assegnazione in conflitti:
+        rifiuti[indice] = f"Servizio già assegnato nel periodo specificato (assegnazione {id_assegnazione})"
+    
+    accettate = {}
+    for indice, voce in attive:
+        if indice in rifiuti:
+            continue
+        periodi_servizio = accettate.setdefault(voce.fk_servizio, [])
+        conflitto = next((altro for altro, inizio, fine in periodi_servizio
+                          if inizio <= voce.data_fine and fine >= voce.data_inizio), None)
+        if conflitto is not None:
+            rifiuti[indice] = f"Sovrapposizione con la voce {conflitto} del blocco"
+        else:
+            periodi_servizio.append((indice, voce.data_inizio, voce.data_fine))
+    return rifiuti
 
-            attempt = 0
-            while True:
-                check = cur.execute("SELECT 1 FROM Fatture WHERE numero_fattura = ?", (numero_fattura,)).fetchone()
-                if not check:
-                    break
-                attempt += 1
-                numero_fattura = f"SF-{assegnazione.fk_associato}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{attempt}"
+def _create_assignment_batch(voci: List[AssegnazioneServizioBatchItem], dry_run: bool):
+    """Valida e inserisce un blocco di assegnazioni con le relative fatture in una transazione.
 
-            cur.execute(
+    Assegnazioni e fatture sono scritte con un executemany ciascuna; i numeri
+    fattura della serie SF sono riservati in un solo aggiornamento del contatore.
+    Gli ID generati sono letti dopo l'inserimento: sotto BEGIN IMMEDIATE le righe
+    con ID maggiore del massimo precedente sono solo quelle del blocco, in ordine.
+    """
+    oggi = date.today()
+    scadenza = oggi + timedelta(days=30)
+    with db_pool.connection() as conn:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rifiuti = _validate_assignment_batch(conn, voci)
+            valide = [(indice, voce) for indice, voce in enumerate(voci) if indice not in rifiuti]
+            
+            risultati = [
+                {
+                    "indice": indice,
+                    "fk_servizio": voce.fk_servizio,
+                    "fk_associato": voce.fk_associato,
+                    "data_inizio": voce.data_inizio.isoformat(),
+                    "data_fine": voce.data_fine.isoformat(),
+                    "stato": voce.stato,
+                    "esito": "Rifiutata" if indice in rifiuti else ("Valida" if dry_run else "Creata"),
+                    "motivo": rifiuti.get(indice),
+                }
+                for indice, voce in enumerate(voci)
+            ]
+            if dry_run or not valide:
+                conn.rollback()
+                return risultati
+            
+            servizi = {row["id_servizio"]: row for row in conn.execute(
+                """
+                SELECT s.id_servizio, s.nome, COALESCE(ps.costo, 0) AS costo
+                FROM Servizi s
+                LEFT JOIN PrezziServizi ps ON ps.id_prezzo = s.fk_prezzo
+                WHERE s.id_servizio IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(sorted({voce.fk_servizio for _, voce in valide})),)
+            ).fetchall()}
+            
+            ultimo_id = conn.execute("SELECT COALESCE(MAX(id_assegnazione), 0) FROM AssegnazioniServizi").fetchone()[0]
+            conn.executemany(
+                """
+                INSERT INTO AssegnazioniServizi (fk_servizio, fk_associato, data_inizio, data_fine, anno_competenza, stato)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (voce.fk_servizio, voce.fk_associato, voce.data_inizio.isoformat(),
+                     voce.data_fine.isoformat(), voce.anno_competenza, voce.stato)
+                    for _, voce in valide
+                ]
+            )
+            id_assegnazioni = [row[0] for row in conn.execute(
+                "SELECT id_assegnazione FROM AssegnazioniServizi WHERE id_assegnazione > ? ORDER BY id_assegnazione",
+                (ultimo_id,)
+            ).fetchall()]
+            
+            # Come nell'assegnazione singola: una fattura attiva per assegnazione
+            numeri = reserve_invoice_numbers(conn, "SF", oggi.year, len(valide))
+            ultima_fattura = conn.execute("SELECT COALESCE(MAX(id_fattura), 0) FROM Fatture").fetchone()[0]
+            fatture = []
+            for (indice, voce), id_assegnazione, numero in zip(valide, id_assegnazioni, numeri):
+                servizio = servizi[voce.fk_servizio]
+                totale = float(servizio["costo"])
+                fatture.append((
+                    numero, oggi.isoformat(), scadenza.isoformat(), voce.fk_associato,
+                    totale, 0.0, totale, f"{servizio['nome']} - competenza {voce.anno_competenza}",
+                    id_assegnazione,
+                ))
+                risultati[indice].update({
+                    "id_assegnazione": id_assegnazione,
+                    "numero_fattura": numero,
+                    "importo_totale": totale,
+                })
+            conn.executemany(
                 """
                 INSERT INTO Fatture (
-                    numero_fattura, data_emissione, data_scadenza, fk_associato,
-                    fk_fornitore, tipo_fattura, importo_imponibile, importo_iva, importo_totale, stato
-                ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa')
+                    numero_fattura, data_emissione, data_scadenza, fk_associato, fk_fornitore,
+                    tipo_fattura, importo_imponibile, importo_iva, importo_totale, stato,
+                    descrizione, fk_assegnazione_servizio
+                ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa', ?, ?)
                 """,
-                (
-                    numero_fattura,
-                    today.strftime("%Y-%m-%d"),
-                    scadenza.strftime("%Y-%m-%d"),
-                    assegnazione.fk_associato,
-                    imponibile,
-                    iva,
-                    totale,
-                ),
+                fatture
             )
-            id_fattura = cur.lastrowid
-
+            id_fatture = conn.execute(
+                "SELECT id_fattura FROM Fatture WHERE id_fattura > ? ORDER BY id_fattura",
+                (ultima_fattura,)
+            ).fetchall()
+            for (indice, _), row in zip(valide, id_fatture):
+                risultati[indice]["id_fattura"] = row[0]
+            
+            refresh_servizi_stato(conn, [voce.fk_servizio for _, voce in valide], oggi)
             conn.commit()
-
-            # Return created assegnazione plus invoice info
-            created = execute_query("SELECT * FROM AssegnazioniServizi WHERE id_assegnazione = ?", (new_id,), fetch_one=True)
-            created = dict(created)
-            created.update({
-                "id_fattura": id_fattura,
-                "numero_fattura": numero_fattura,
-                "importo_totale": totale,
-            })
-            return created
-        except Exception as inner_e:
+            return risultati
+        except Exception:
             conn.rollback()
-            logger.error(f"Transaction error in create_assegnazione_servizio: {inner_e}")
-            raise HTTPException(status_code=500, detail=str(inner_e))
-        finally:
-            conn.close()
-        
-    except HTTPException:
-        raise
+            raise
+
+@app.post("/assegnazioni-servizi/batch", summary="Assegnazione massiva servizi")
+async def create_assegnazioni_servizi_batch(
+    batch: AssegnazioniServiziBatch,
+    dry_run: bool = Query(False, description="Valida il blocco senza creare assegnazioni né fatture")
+):
+    """Assegna un blocco di servizi (es. l'assegnazione stagionale dei posti barca).
+
+    Ogni voce è validata come nell'assegnazione singola, comprese le sovrapposizioni
+    con le altre voci del blocco; le voci valide sono create con le relative fatture
+    in un'unica transazione, quelle rifiutate sono riportate con il motivo.
+    I risultati sono nello stesso ordine delle voci.
+    """
+    try:
+        risultati = await db_executor.run(_create_assignment_batch, batch.assegnazioni, dry_run)
+        rifiutate = sum(1 for r in risultati if r["esito"] == "Rifiutata")
+        return {
+            "elaborate": len(risultati),
+            "create": 0 if dry_run else len(risultati) - rifiutate,
+            "rifiutate": rifiutate,
+            "importo_totale": round(sum(r.get("importo_totale", 0.0) for r in risultati), 2),
+            "dry_run": dry_run,
+            "risultati": risultati,
+        }
     except Exception as e:
-        logger.error(f"Error in create_assegnazione_servizio: {e}")
+        logger.error(f"Error in create_assegnazioni_servizi_batch: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/assegnazioni-servizi/{assegnazione_id}", summary="Aggiorna assegnazione servizio")
@@ -1137,25 +3107,53 @@ async def update_assegnazione_servizio_endpoint(
 ):
     """Aggiorna un'assegnazione di servizio esistente"""
     try:
-        # Check if assegnazione exists
-        check_query = "SELECT * FROM AssegnazioniServizi WHERE id_assegnazione = ?"
-        existing = execute_query(check_query, (assegnazione_id,), fetch_one=True)
-        if not existing:
-            raise HTTPException(status_code=404, detail="Assegnazione non trovata")
-        
         update_data = assegnazione.model_dump(exclude_unset=True)
         if not update_data:
             raise HTTPException(status_code=400, detail="Nessun campo da aggiornare")
+        for campo in ("fk_associato", "data_inizio", "data_fine", "stato"):
+            if campo in update_data and update_data[campo] is None:
+                raise HTTPException(status_code=400, detail=f"Il campo {campo} non può essere nullo")
         
         set_clauses = [f"{key} = ?" for key in update_data.keys()]
         update_query = f"UPDATE AssegnazioniServizi SET {', '.join(set_clauses)} WHERE id_assegnazione = ?"
-        
-        params = list(update_data.values()) + [assegnazione_id]
-        execute_query(update_query, tuple(params), fetch_all=False)
+        params = [v.isoformat() if isinstance(v, date) else v for v in update_data.values()] + [assegnazione_id]
+        
+        def _update_tx():
+            with db_pool.connection() as conn:
+                try:
+                    # Lettura, verifica delle sovrapposizioni e aggiornamento sotto lo stesso lock di scrittura
+                    conn.execute("BEGIN IMMEDIATE")
+                    existing = conn.execute(
+                        "SELECT * FROM AssegnazioniServizi WHERE id_assegnazione = ?", (assegnazione_id,)
+                    ).fetchone()
+                    if not existing:
+                        raise HTTPException(status_code=404, detail="Assegnazione non trovata")
+                    
+                    # Il periodo risultante non deve sovrapporsi ad altre assegnazioni attive dello stesso servizio;
+                    # una data_fine assente vale come periodo senza scadenza (ASSIGNMENT_OPEN_END)
+                    data_inizio = update_data.get("data_inizio") or date.fromisoformat(existing["data_inizio"][:10])
+                    data_fine = update_data.get("data_fine") or (
+                        date.fromisoformat(existing["data_fine"][:10]) if existing["data_fine"] else date.max
+                    )
+                    if data_fine < data_inizio:
+                        raise HTTPException(status_code=400, detail="La data di fine deve essere uguale o successiva alla data di inizio")
+                    if update_data.get("stato", existing["stato"]) == "Attivo" and find_overlapping_assignment(
+                        conn, existing["fk_servizio"], data_inizio, data_fine, exclude_id=assegnazione_id
+                    ):
+                        raise HTTPException(status_code=400, detail="Servizio già assegnato nel periodo specificato")
+                    
+                    conn.execute(update_query, params)
+                    refresh_servizi_stato(conn, [existing["fk_servizio"]])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        
+        await db_executor.run(_update_tx)
         
         # Return updated assegnazione
         return_query = "SELECT * FROM AssegnazioniServizi WHERE id_assegnazione = ?"
-        result = execute_query(return_query, (assegnazione_id,), fetch_one=True)
+        result = await execute_query_async(return_query, (assegnazione_id,), fetch_one=True)
         return result
         
     except HTTPException:
@@ -1217,7 +3215,7 @@ async def list_erogazioni_prestazioni(
         ORDER BY ep.data_erogazione DESC
         """
         
-        result = execute_query(query, tuple(params))
+        result = await execute_query_async(query, tuple(params))
         return result
         
     except Exception as e:
@@ -1230,7 +3228,8 @@ async def list_erogazioni_prestazioni(
     prestazione_id: Optional[int] = Query(None, description="Filtra per prestazione"),
     data_da: Optional[str] = Query(None, description="Data da (YYYY-MM-DD)"),
     data_a: Optional[str] = Query(None, description="Data a (YYYY-MM-DD)"),
-    search: Optional[str] = Query(None, description="Testo su nome/cognome/descrizione")
+    search: Optional[str] = Query(None, description="Testo su nome/cognome/descrizione"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato: json, ndjson o csv (streaming)")
 ):
     try:
         where_clauses = []
@@ -1248,9 +3247,17 @@ async def list_erogazioni_prestazioni(
             where_clauses.append("date(ep.data_erogazione) <= date(?)")
             params.append(data_a)
         if search:
-            like = f"%{search}%"
-            where_clauses.append("(a.nome LIKE ? OR a.cognome LIKE ? OR p.nome_prestazione LIKE ? OR p.descrizione LIKE ?)")
-            params.extend([like, like, like, like])
+            match = fts_match_expression(search)
+            if match and await search_index_available():
+                where_clauses.append(
+                    f"(ep.fk_associato IN ({fts_ids_subquery('associato')}) "
+                    f"OR ep.fk_prestazione IN ({fts_ids_subquery('prestazione')}))"
+                )
+                params.extend([match, match])
+            else:
+                like = f"%{search}%"
+                where_clauses.append("(a.nome LIKE ? OR a.cognome LIKE ? OR p.nome_prestazione LIKE ? OR p.descrizione LIKE ?)")
+                params.extend([like, like, like, like])
 
         where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
 
@@ -1271,8 +3278,13 @@ async def list_erogazioni_prestazioni(
         ORDER BY ep.data_erogazione DESC
         """
 
-        result = execute_query(query, tuple(params))
+        if export_format != "json":
+            return await stream_export(query, tuple(params), export_format, "erogazioni_prestazioni")
+
+        result = await execute_query_async(query, tuple(params))
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in list_erogazioni_prestazioni: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1291,12 +3303,12 @@ async def create_erogazione_prestazione(payload: dict):
             raise HTTPException(status_code=400, detail="fk_associato e fk_prestazione sono obbligatori")
 
         # Validate associato
-        assoc = execute_query("SELECT id_associato FROM Associati WHERE id_associato = ?", (fk_associato,), fetch_one=True)
+        assoc = await execute_query_async("SELECT id_associato FROM Associati WHERE id_associato = ?", (fk_associato,), fetch_one=True)
         if not assoc:
             raise HTTPException(status_code=404, detail="Associato non trovato")
 
         # Validate prestazione
-        prest = execute_query("SELECT id_prestazione, nome_prestazione, costo FROM Prestazioni WHERE id_prestazione = ?", (fk_prestazione,), fetch_one=True)
+        prest = await execute_query_async("SELECT id_prestazione, nome_prestazione, costo FROM Prestazioni WHERE id_prestazione = ?", (fk_prestazione,), fetch_one=True)
         if not prest:
             raise HTTPException(status_code=404, detail="Prestazione non trovata")
 
@@ -1317,90 +3329,66 @@ async def create_erogazione_prestazione(payload: dict):
             data_erogazione_norm = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # Begin transaction to insert erogazione, fattura, dettaglio fattura
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-
-            # 1) Insert ErogazionePrestazione
-            insert_erog = (
-                "INSERT INTO ErogazioniPrestazioni (fk_associato, fk_prestazione, data_erogazione) "
-                "VALUES (?, ?, ?)"
-            )
-            cur.execute(insert_erog, (fk_associato, fk_prestazione, data_erogazione_norm))
-            id_erogazione = cur.lastrowid
-
-            # 2) Create Fattura (Attiva) for this erogazione
-            costo = float(prest["costo"]) if prest and prest["costo"] is not None else 0.0
-            imponibile = costo
-            iva = 0.00  # IVA non gestita per ora; aggiornabile in futuro
-            totale = imponibile + iva
-
-            today = date.today()
-            scadenza = today + timedelta(days=30)
-            numero_fattura = f"EP-{fk_associato}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-            # Ensure numero_fattura uniqueness (best-effort: retry suffix if collision)
-            attempt = 0
-            while True:
-                check = cur.execute("SELECT 1 FROM Fatture WHERE numero_fattura = ?", (numero_fattura,)).fetchone()
-                if not check:
-                    break
-                attempt += 1
-                numero_fattura = f"EP-{fk_associato}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{attempt}"
-
-            insert_fatt = (
-                """
-                INSERT INTO Fatture (
-                    numero_fattura, data_emissione, data_scadenza, fk_associato,
-                    fk_fornitore, tipo_fattura, importo_imponibile, importo_iva,
-                    importo_totale, stato
-                ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa')
-                """
-            )
-            cur.execute(
-                insert_fatt,
-                (
-                    numero_fattura,
-                    today.strftime("%Y-%m-%d"),
-                    scadenza.strftime("%Y-%m-%d"),
-                    fk_associato,
-                    imponibile,
-                    iva,
-                    totale,
-                ),
-            )
-            id_fattura = cur.lastrowid
-
-            # 3) Insert DettaglioFattura linked to erogazione
-            descr = f"{prest['nome_prestazione']} (erogazione {id_erogazione})"
-            insert_det = (
-                """
-                INSERT INTO DettagliFatture (
-                    fk_fattura, descrizione, quantita, prezzo_unitario, importo_totale,
-                    fk_assegnazione_servizio_fisico, fk_erogazione_servizio_prestazionale
-                ) VALUES (?, ?, ?, ?, ?, NULL, ?)
-                """
-            )
-            cur.execute(
-                insert_det,
-                (
-                    id_fattura,
-                    descr,
-                    1.0,
-                    costo,
-                    costo,
-                    id_erogazione,
-                ),
-            )
-
-            conn.commit()
-            return {"status": "created", "id_erogazione": id_erogazione, "id_fattura": id_fattura, "numero_fattura": numero_fattura}
-        except Exception as inner_e:
-            conn.rollback()
-            logger.error(f"Transaction error in create_erogazione_prestazione: {inner_e}")
-            raise HTTPException(status_code=500, detail=str(inner_e))
-        finally:
-            conn.close()
+        def _create_erogazione_tx():
+            conn = get_db_connection()
+            try:
+                cur = conn.cursor()
+
+                # 1) Insert ErogazionePrestazione
+                insert_erog = (
+                    "INSERT INTO ErogazioniPrestazioni (fk_associato, fk_prestazione, data_erogazione) "
+                    "VALUES (?, ?, ?)"
+                )
+                cur.execute(insert_erog, (fk_associato, fk_prestazione, data_erogazione_norm))
+                id_erogazione = cur.lastrowid
+
+                # 2) Create Fattura (Attiva) for this erogazione
+                costo = float(prest["costo"]) if prest and prest["costo"] is not None else 0.0
+                imponibile = costo
+                iva = 0.00  # IVA non gestita per ora; aggiornabile in futuro
+                totale = imponibile + iva
+
+                today = date.today()
+                scadenza = today + timedelta(days=30)
+                numero_fattura = next_invoice_number(conn, "EP", today)
+
+                # La fattura è la singola voce: descrizione e link all'erogazione (ex DettagliFatture)
+                descr = f"{prest['nome_prestazione']} (erogazione {id_erogazione})"
+                insert_fatt = (
+                    """
+                    INSERT INTO Fatture (
+                        numero_fattura, data_emissione, data_scadenza, fk_associato,
+                        fk_fornitore, tipo_fattura, importo_imponibile, importo_iva,
+                        importo_totale, stato, descrizione, fk_erogazione_prestazione
+                    ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa', ?, ?)
+                    """
+                )
+                cur.execute(
+                    insert_fatt,
+                    (
+                        numero_fattura,
+                        today.strftime("%Y-%m-%d"),
+                        scadenza.strftime("%Y-%m-%d"),
+                        fk_associato,
+                        imponibile,
+                        iva,
+                        totale,
+                        descr,
+                        id_erogazione,
+                    ),
+                )
+                id_fattura = cur.lastrowid
+
+                conn.commit()
+                return {"status": "created", "id_erogazione": id_erogazione, "id_fattura": id_fattura, "numero_fattura": numero_fattura}
+            except Exception as inner_e:
+                conn.rollback()
+                logger.error(f"Transaction error in create_erogazione_prestazione: {inner_e}")
+                raise HTTPException(status_code=500, detail=str(inner_e))
+            finally:
+                conn.close()
+
+        return await db_executor.run(_create_erogazione_tx)
     except HTTPException:
         raise
     except Exception as e:
@@ -1409,24 +3397,45 @@ async def create_erogazione_prestazione(payload: dict):
 
 # ===== ENDPOINTS REPORT =====
 
+# Partitario dei crediti verso i soci mantenuto da trigger (sezione 'receivables_ledger' di database_schema.json)
+RECEIVABLES_TABLE = "PartiteAperte"
+RECEIVABLES_SUMMARY_TABLE = "SaldiAssociati"
+# Fasce di anzianità dello scaduto: (etichetta, giorni minimi di ritardo); non ancora scadute in "0-30"
+AGEING_BUCKETS = [("0-30", None), ("31-60", 31), ("61-90", 61), ("90+", 91)]
+
+def ageing_bucket_sql(giorni_expr: str) -> str:
+    """Espressione CASE che assegna la fascia di anzianità ai giorni di ritardo indicati"""
+    cases = " ".join(
+        f"WHEN {giorni_expr} >= {minimo} THEN '{label}'"
+        for label, minimo in reversed(AGEING_BUCKETS) if minimo is not None
+    )
+    return f"CASE {cases} ELSE '{AGEING_BUCKETS[0][0]}' END"
+
 @app.get("/report/soci-morosi", summary="Report soci morosi")
 async def report_soci_morosi(
     giorni_scadenza: int = Query(0, ge=0, description="Minimo giorni di scadenza"),
     importo_minimo: Optional[float] = Query(None, ge=0, description="Importo minimo dovuto"),
-    include_sospesi: bool = Query(False, description="Includi associati sospesi")
+    include_sospesi: bool = Query(False, description="Includi associati sospesi"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato: json, ndjson o csv (streaming)")
 ):
-    """Genera il report dei soci morosi (con fatture non pagate)"""
+    """Genera il report dei soci morosi (con fatture non pagate).
+
+    Legge il partitario dei crediti: saldo residuo per fattura al netto dei pagamenti
+    parziali e saldo complessivo per socio, con le fasce di anzianità dello scaduto.
+    """
     try:
-        # Build query for soci morosi
-        where_clauses = ["f.stato IN ('Emessa', 'Scaduta')"]
+        oggi = date.today().isoformat()
+        giorni = f"CAST(julianday('{oggi}') - julianday(p.data_scadenza) AS INTEGER)"
+        where_clauses = ["1=1"]
         params = []
         
         if giorni_scadenza > 0:
-            where_clauses.append("julianday('now') - julianday(f.data_scadenza) >= ?")
-            params.append(giorni_scadenza)
+            # Intervallo sull'indice di PartiteAperte(data_scadenza)
+            where_clauses.append("p.data_scadenza <= ?")
+            params.append((date.today() - timedelta(days=giorni_scadenza)).isoformat())
         
         if importo_minimo:
-            where_clauses.append("f.importo_totale >= ?")
+            where_clauses.append("s.saldo >= ?")
             params.append(importo_minimo)
         
         if not include_sospesi:
@@ -1436,20 +3445,28 @@ async def report_soci_morosi(
         
         query = f"""
         SELECT a.id_associato, a.nome, a.cognome, a.email, a.telefono, a.stato_associato,
-               f.id_fattura, f.numero_fattura, f.data_emissione, f.data_scadenza, 
-               f.importo_totale, f.stato,
-               CAST(julianday('now') - julianday(f.data_scadenza) AS INTEGER) as giorni_scadenza
-        FROM Associati a
-        JOIN Fatture f ON a.id_associato = f.fk_associato
+               f.id_fattura, f.numero_fattura, f.data_emissione, p.data_scadenza,
+               p.importo_totale, p.importo_pagato, p.saldo, f.stato,
+               {giorni} as giorni_scadenza,
+               {ageing_bucket_sql(giorni)} as fascia_scadenza
+        FROM {RECEIVABLES_TABLE} p
+        JOIN {RECEIVABLES_SUMMARY_TABLE} s ON s.fk_associato = p.fk_associato
+        JOIN Associati a ON a.id_associato = p.fk_associato
+        JOIN Fatture f ON f.id_fattura = p.id_fattura
         WHERE {where_clause}
-        ORDER BY a.cognome, a.nome, f.data_scadenza
+        ORDER BY a.cognome, a.nome, p.data_scadenza
         """
         
-        results = execute_query(query, tuple(params))
+        if export_format != "json":
+            # In esportazione una riga per fattura non pagata (dati del socio ripetuti)
+            return await stream_export(query, tuple(params), export_format, "soci_morosi")
+        
+        results = await execute_query_async(query, tuple(params))
         
         # Group by associato
         soci_morosi = {}
         totale_crediti = 0
+        ageing_totale = {label: 0 for label, _ in AGEING_BUCKETS}
         
         for row in results:
             associato_id = row['id_associato']
@@ -1462,7 +3479,8 @@ async def report_soci_morosi(
                     'telefono': row['telefono'],
                     'stato_associato': row['stato_associato'],
                     'fatture_non_pagate': [],
-                    'totale_dovuto': 0
+                    'totale_dovuto': 0,
+                    'ageing': {label: 0 for label, _ in AGEING_BUCKETS}
                 }
             
             fattura = {
@@ -1471,17 +3489,24 @@ async def report_soci_morosi(
                 'data_emissione': row['data_emissione'],
                 'data_scadenza': row['data_scadenza'],
                 'importo_totale': row['importo_totale'],
+                'importo_pagato': row['importo_pagato'],
+                'saldo': row['saldo'],
                 'giorni_scadenza': row['giorni_scadenza'],
+                'fascia_scadenza': row['fascia_scadenza'],
                 'stato': row['stato']
             }
             
-            soci_morosi[associato_id]['fatture_non_pagate'].append(fattura)
-            soci_morosi[associato_id]['totale_dovuto'] += row['importo_totale']
-            totale_crediti += row['importo_totale']
+            socio = soci_morosi[associato_id]
+            socio['fatture_non_pagate'].append(fattura)
+            socio['totale_dovuto'] += row['saldo']
+            socio['ageing'][row['fascia_scadenza']] += row['saldo']
+            ageing_totale[row['fascia_scadenza']] += row['saldo']
+            totale_crediti += row['saldo']
         
         return {
             "count": len(soci_morosi),
-            "totale_crediti": totale_crediti,
+            "totale_crediti": round(totale_crediti, 2),
+            "ageing": {label: round(importo, 2) for label, importo in ageing_totale.items()},
             "results": list(soci_morosi.values())
         }
         
@@ -1491,7 +3516,8 @@ async def report_soci_morosi(
 
 @app.get("/report/tesserati-fiv", summary="Report tesserati FIV")
 async def report_tesserati_fiv(
-    stato_tesseramento: Optional[str] = Query(None, pattern="^(Attivo|Scaduto)$", description="Filtra per stato tesseramento")
+    stato_tesseramento: Optional[str] = Query(None, pattern="^(Attivo|Scaduto)$", description="Filtra per stato tesseramento"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato: json, ndjson o csv (streaming)")
 ):
     """Genera il report dei tesserati FIV"""
     try:
@@ -1520,20 +3546,26 @@ async def report_tesserati_fiv(
         ORDER BY a.cognome, a.nome
         """
         
-        results = execute_query(query, tuple(params))
+        if export_format != "json":
+            return await stream_export(query, tuple(params), export_format, "tesserati_fiv")
+        
+        results = await execute_query_async(query, tuple(params))
         
         return {
             "count": len(results),
             "results": results
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in report_tesserati_fiv: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/report/certificati-in-scadenza", summary="Report certificati medici in scadenza")
 async def report_certificati_in_scadenza(
-    giorni_alla_scadenza: int = Query(30, ge=1, le=365, description="Giorni alla scadenza")
+    giorni_alla_scadenza: int = Query(30, ge=1, le=365, description="Giorni alla scadenza"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato: json, ndjson o csv (streaming)")
 ):
     """Genera il report dei certificati medici in scadenza"""
     try:
@@ -1548,70 +3580,223 @@ async def report_certificati_in_scadenza(
         ORDER BY tf.scadenza_certificato_medico, a.cognome, a.nome
         """
         
-        results = execute_query(query, (giorni_alla_scadenza,))
+        if export_format != "json":
+            return await stream_export(query, (giorni_alla_scadenza,), export_format, "certificati_in_scadenza")
+        
+        results = await execute_query_async(query, (giorni_alla_scadenza,))
         
         return {
             "count": len(results),
             "results": results
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in report_certificati_in_scadenza: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Riepilogo mensile delle fatture mantenuto da trigger (sezione 'monthly_rollup' di database_schema.json)
+ROLLUP_TABLE = "RiepilogoMensile"
+TIPI_FATTURA = ("Attiva", "Passiva")
+
+def rebuild_monthly_rollup(conn, anno: int):
+    """Ricalcola da Fatture le righe del riepilogo di un anno (nella transazione del chiamante)"""
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE anno = ?", (anno,))
+    conn.execute(
+        f"""
+        INSERT INTO {ROLLUP_TABLE} (anno, mese, tipo_fattura, categoria, gruppo, settore, numero_fatture, imponibile, iva, totale)
+        SELECT ?, CAST(strftime('%m', data_emissione) AS INTEGER), tipo_fattura,
+               COALESCE(categoria, ''), COALESCE(gruppo, ''), COALESCE(settore, ''),
+               COUNT(*), ROUND(SUM(importo_imponibile), 2), ROUND(SUM(importo_iva), 2), ROUND(SUM(importo_totale), 2)
+        FROM Fatture
+        WHERE data_emissione BETWEEN ? AND ? AND stato != 'Annullata'
+        GROUP BY 2, 3, 4, 5, 6
+        """,
+        (anno, f"{anno}-01-01", f"{anno}-12-31")
+    )
+
+def fatturato_periodo(periodo_inizio: date, periodo_fine: date) -> Dict[str, Dict[str, float]]:
+    """Imponibile, IVA e totale per tipo fattura nel periodo.
+
+    I mesi interamente compresi nel periodo sono letti dal riepilogo mensile; solo gli
+    eventuali mesi parziali agli estremi sono sommati direttamente da Fatture.
+    """
+    # Primo giorno del primo e dell'ultimo mese interamente compresi nel periodo
+    primo_mese = periodo_inizio if periodo_inizio.day == 1 else (periodo_inizio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if (periodo_fine + timedelta(days=1)).day == 1:
+        ultimo_mese = periodo_fine.replace(day=1)
+    else:
+        ultimo_mese = (periodo_fine.replace(day=1) - timedelta(days=1)).replace(day=1)
+    
+    query_fatture = """
+    SELECT tipo_fattura, SUM(importo_imponibile) as imponibile, SUM(importo_iva) as iva, SUM(importo_totale) as totale
+    FROM Fatture
+    WHERE data_emissione BETWEEN ? AND ? AND stato != 'Annullata'
+    GROUP BY tipo_fattura
+    """
+    query_riepilogo = f"""
+    SELECT tipo_fattura, SUM(imponibile) as imponibile, SUM(iva) as iva, SUM(totale) as totale
+    FROM {ROLLUP_TABLE}
+    WHERE (anno, mese) >= (?, ?) AND (anno, mese) <= (?, ?)
+    GROUP BY tipo_fattura
+    """
+    
+    parti = []
+    if primo_mese > ultimo_mese:
+        parti.append((query_fatture, (periodo_inizio.isoformat(), periodo_fine.isoformat())))
+    else:
+        parti.append((query_riepilogo, (primo_mese.year, primo_mese.month, ultimo_mese.year, ultimo_mese.month)))
+        if periodo_inizio < primo_mese:
+            parti.append((query_fatture, (periodo_inizio.isoformat(), (primo_mese - timedelta(days=1)).isoformat())))
+        if periodo_fine.replace(day=1) != ultimo_mese:
+            parti.append((query_fatture, (periodo_fine.replace(day=1).isoformat(), periodo_fine.isoformat())))
+    
+    fatturato = {tipo: {"imponibile": 0.0, "iva": 0.0, "totale": 0.0} for tipo in TIPI_FATTURA}
+    with db_pool.connection() as conn:
+        for query, params in parti:
+            for row in conn.execute(query, params).fetchall():
+                for campo in ("imponibile", "iva", "totale"):
+                    fatturato[row["tipo_fattura"]][campo] += row[campo] or 0
+    return {tipo: {campo: round(valore, 2) for campo, valore in importi.items()} for tipo, importi in fatturato.items()}
+
 @app.get("/report/fatturato", summary="Report fatturato")
 async def report_fatturato(
     periodo_inizio: date = Query(..., description="Data inizio periodo"),
-    periodo_fine: date = Query(..., description="Data fine periodo")
+    periodo_fine: date = Query(..., description="Data fine periodo"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato: json, ndjson o csv (streaming)")
 ):
     """Genera un report sul fatturato per un dato periodo"""
     try:
-        # Fatturato attivo
-        query_attivo = """
-        SELECT 
-            SUM(importo_imponibile) as imponibile,
-            SUM(importo_iva) as iva,
-            SUM(importo_totale) as totale
-        FROM Fatture 
-        WHERE tipo_fattura = 'Attiva' 
-        AND data_emissione BETWEEN ? AND ?
-        AND stato != 'Annullata'
-        """
-        
-        fatturato_attivo = execute_query(query_attivo, (periodo_inizio.isoformat(), periodo_fine.isoformat()), fetch_one=True)
-        
-        # Fatturato passivo
-        query_passivo = """
-        SELECT 
-            SUM(importo_imponibile) as imponibile,
-            SUM(importo_iva) as iva,
-            SUM(importo_totale) as totale
-        FROM Fatture 
-        WHERE tipo_fattura = 'Passiva' 
-        AND data_emissione BETWEEN ? AND ?
-        AND stato != 'Annullata'
-        """
+        if export_format != "json":
+            # Una riga per tipo di fattura (Attiva / Passiva)
+            query_export = """
+            SELECT 
+                tipo_fattura,
+                COALESCE(SUM(importo_imponibile), 0) as imponibile,
+                COALESCE(SUM(importo_iva), 0) as iva,
+                COALESCE(SUM(importo_totale), 0) as totale
+            FROM Fatture 
+            WHERE data_emissione BETWEEN ? AND ?
+            AND stato != 'Annullata'
+            GROUP BY tipo_fattura
+            ORDER BY tipo_fattura
+            """
+            return await stream_export(query_export, (periodo_inizio.isoformat(), periodo_fine.isoformat()), export_format, "fatturato")
         
-        fatturato_passivo = execute_query(query_passivo, (periodo_inizio.isoformat(), periodo_fine.isoformat()), fetch_one=True)
+        fatturato = await db_executor.run(fatturato_periodo, periodo_inizio, periodo_fine)
         
         return {
             "periodo": f"{periodo_inizio.isoformat()} - {periodo_fine.isoformat()}",
-            "fatturato_attivo": {
-                "imponibile": fatturato_attivo['imponibile'] or 0.00,
-                "iva": fatturato_attivo['iva'] or 0.00,
-                "totale": fatturato_attivo['totale'] or 0.00
-            },
-            "fatturato_passivo": {
-                "imponibile": fatturato_passivo['imponibile'] or 0.00,
-                "iva": fatturato_passivo['iva'] or 0.00,
-                "totale": fatturato_passivo['totale'] or 0.00
-            }
+            "fatturato_attivo": fatturato["Attiva"],
+            "fatturato_passivo": fatturato["Passiva"]
         }
         
     except Exception as e:
         logger.error(f"Error in report_fatturato: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/report/bilancio/{anno}", summary="Bilancio annuale")
+async def report_bilancio(
+    anno: int = Path(..., ge=1900, le=9999, description="Anno del bilancio"),
+    rebuild: bool = Query(False, description="Ricalcola il riepilogo mensile dell'anno dalle fatture prima di rispondere"),
+    top_controparti: int = Query(10, ge=0, le=100, description="Numero di controparti principali per tipo fattura")
+):
+    """Bilancio dell'anno: totali, andamento mensile e ripartizione per categoria dal riepilogo
+    mensile, più le controparti principali (soci per le attive, fornitori per le passive).
+    """
+    def _collect_bilancio():
+        with db_pool.connection() as conn:
+            if rebuild:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rebuild_monthly_rollup(conn, anno)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            rows = conn.execute(
+                f"""
+                SELECT mese, tipo_fattura, categoria, gruppo, settore, numero_fatture, imponibile, iva, totale
+                FROM {ROLLUP_TABLE}
+                WHERE anno = ?
+                ORDER BY mese, tipo_fattura, categoria, gruppo, settore
+                """,
+                (anno,)
+            ).fetchall()
+            
+            # Controparti: un solo passaggio sulle fatture dell'anno (indice su data_emissione)
+            controparti = conn.execute(
+                """
+                SELECT tipo_fattura, controparte, numero_fatture, totale FROM (
+                    SELECT f.tipo_fattura,
+                           CASE
+                               WHEN fo.id_fornitore IS NOT NULL THEN fo.ragione_sociale
+                               WHEN a.id_associato IS NOT NULL THEN a.cognome || ' ' || a.nome
+                               ELSE 'Non assegnata'
+                           END as controparte,
+                           COUNT(*) as numero_fatture,
+                           ROUND(SUM(f.importo_totale), 2) as totale,
+                           ROW_NUMBER() OVER (PARTITION BY f.tipo_fattura ORDER BY SUM(f.importo_totale) DESC) as posizione
+                    FROM Fatture f
+                    LEFT JOIN Associati a ON a.id_associato = f.fk_associato
+                    LEFT JOIN Fornitori fo ON fo.id_fornitore = f.fk_fornitore
+                    WHERE f.data_emissione BETWEEN ? AND ? AND f.stato != 'Annullata'
+                    GROUP BY f.tipo_fattura, f.fk_associato, f.fk_fornitore
+                )
+                WHERE posizione <= ?
+                ORDER BY tipo_fattura, posizione
+                """,
+                (f"{anno}-01-01", f"{anno}-12-31", top_controparti)
+            ).fetchall()
+        
+        def vuoto():
+            return {"numero_fatture": 0, "imponibile": 0.0, "iva": 0.0, "totale": 0.0}
+        
+        def somma(destinazione, row):
+            destinazione["numero_fatture"] += row["numero_fatture"]
+            for campo in ("imponibile", "iva", "totale"):
+                destinazione[campo] = round(destinazione[campo] + row[campo], 2)
+        
+        totali = {tipo: vuoto() for tipo in TIPI_FATTURA}
+        mensile = [{"mese": mese, **{tipo: vuoto() for tipo in TIPI_FATTURA}} for mese in range(1, 13)]
+        per_categoria = {}
+        for row in rows:
+            somma(totali[row["tipo_fattura"]], row)
+            somma(mensile[row["mese"] - 1][row["tipo_fattura"]], row)
+            chiave = (row["tipo_fattura"], row["categoria"], row["gruppo"], row["settore"])
+            if chiave not in per_categoria:
+                per_categoria[chiave] = {
+                    "tipo_fattura": row["tipo_fattura"],
+                    "categoria": row["categoria"] or None,
+                    "gruppo": row["gruppo"] or None,
+                    "settore": row["settore"] or None,
+                    **vuoto()
+                }
+            somma(per_categoria[chiave], row)
+        
+        return {
+            "anno": anno,
+            "totali": totali,
+            "risultato": round(totali["Attiva"]["totale"] - totali["Passiva"]["totale"], 2),
+            "mensile": mensile,
+            "per_categoria": sorted(per_categoria.values(), key=lambda voce: (voce["tipo_fattura"], -voce["totale"])),
+            "controparti": {
+                tipo: [
+                    {"controparte": row["controparte"], "numero_fatture": row["numero_fatture"], "totale": row["totale"]}
+                    for row in controparti if row["tipo_fattura"] == tipo
+                ]
+                for tipo in TIPI_FATTURA
+            },
+            "ricalcolato": rebuild
+        }
+    
+    try:
+        return await db_executor.run(_collect_bilancio)
+    except Exception as e:
+        logger.error(f"Error in report_bilancio: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== ENDPOINT PREZZI SERVIZI =====
 
 class PrezzoServizioCreate(BaseModel):
@@ -1639,7 +3824,7 @@ async def list_prezzi_servizi(
     query += " ORDER BY categoria_servizio LIMIT ? OFFSET ?"
     params.extend([limit, offset])
     
-    prezzi = execute_query(query, tuple(params))
+    prezzi = await execute_query_async(query, tuple(params))
     return prezzi or []
 
 @app.post("/prezzi-servizi", status_code=201, summary="Crea prezzo servizio")
@@ -1649,19 +3834,19 @@ async def create_prezzo_servizio(prezzo: PrezzoServizioCreate):
         INSERT INTO PrezziServizi (categoria_servizio, costo)
         VALUES (?, ?)
     """
-    execute_query(insert_query, (
+    await execute_query_async(insert_query, (
         prezzo.categoria_servizio,
         prezzo.costo,
     ))
     # Return created record
     return_query = "SELECT * FROM PrezziServizi ORDER BY id_prezzo DESC LIMIT 1"
-    return execute_query(return_query, tuple(), fetch_one=True)
+    return await execute_query_async(return_query, tuple(), fetch_one=True)
 
 @app.get("/prezzi-servizi/{prezzo_id}", summary="Dettagli prezzo servizio")
 async def get_prezzo_servizio(prezzo_id: int):
     """Ottieni dettagli di un prezzo servizio"""
     query = "SELECT * FROM PrezziServizi WHERE id_prezzo = ?"
-    prezzo = execute_query(query, (prezzo_id,), fetch_one=True)
+    prezzo = await execute_query_async(query, (prezzo_id,), fetch_one=True)
     
     if not prezzo:
         raise HTTPException(status_code=404, detail="Prezzo servizio non trovato")
@@ -1673,7 +3858,7 @@ async def update_prezzo_servizio(prezzo_id: int, prezzo: PrezzoServizioUpdate):
     """Aggiorna un prezzo servizio esistente"""
     # Check if exists
     check_query = "SELECT id_prezzo FROM PrezziServizi WHERE id_prezzo = ?"
-    existing = execute_query(check_query, (prezzo_id,), fetch_one=True)
+    existing = await execute_query_async(check_query, (prezzo_id,), fetch_one=True)
     
     if not existing:
         raise HTTPException(status_code=404, detail="Prezzo servizio non trovato")
@@ -1687,29 +3872,29 @@ async def update_prezzo_servizio(prezzo_id: int, prezzo: PrezzoServizioUpdate):
     update_query = f"UPDATE PrezziServizi SET {', '.join(set_clauses)} WHERE id_prezzo = ?"
     
     params = list(update_data.values()) + [prezzo_id]
-    execute_query(update_query, tuple(params))
+    await execute_query_async(update_query, tuple(params))
     
     # Return updated record
     return_query = "SELECT * FROM PrezziServizi WHERE id_prezzo = ?"
-    return execute_query(return_query, (prezzo_id,), fetch_one=True)
+    return await execute_query_async(return_query, (prezzo_id,), fetch_one=True)
 
 @app.delete("/prezzi-servizi/{prezzo_id}", status_code=204, summary="Elimina prezzo servizio")
 async def delete_prezzo_servizio(prezzo_id: int):
     """Elimina un prezzo servizio"""
     # Check if exists
     check_query = "SELECT id_prezzo FROM PrezziServizi WHERE id_prezzo = ?"
-    existing = execute_query(check_query, (prezzo_id,), fetch_one=True)
+    existing = await execute_query_async(check_query, (prezzo_id,), fetch_one=True)
     
     if not existing:
         raise HTTPException(status_code=404, detail="Prezzo servizio non trovato")
     
     delete_query = "DELETE FROM PrezziServizi WHERE id_prezzo = ?"
-    execute_query(delete_query, (prezzo_id,))
+    await execute_query_async(delete_query, (prezzo_id,))
 
 # ===== ENDPOINT FATTURE =====
 
 class FatturaCreate(BaseModel):
-    numero_fattura: str = Field(..., max_length=20)
+    numero_fattura: Optional[str] = Field(None, max_length=20, description="Se omesso viene assegnato dalla serie MAN")
     data_emissione: date
     data_scadenza: date
     fk_associato: Optional[int] = None
@@ -1732,13 +3917,24 @@ class FatturaUpdate(BaseModel):
 
 @app.get("/fatture", summary="Lista fatture")
 async def list_fatture(
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursore dell'header X-Next-Cursor (alternativo a offset)"),
+    exact_count: bool = Query(False, description="Calcola il conteggio esatto in X-Total-Count"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="json (paginato) oppure ndjson/csv (esportazione completa in streaming)"),
     tipo: Optional[str] = Query(None, pattern="^(Attiva|Passiva)$"),
     stato: Optional[str] = Query(None, pattern="^(Non pagata|Pagata|Parzialmente pagata|Scaduta)$"),
     search: Optional[str] = Query(None)
 ):
-    """Lista fatture con filtri opzionali"""
+    """Lista fatture con filtri opzionali.
+
+    Restituisce una lista; cursore della pagina successiva e conteggio sono negli
+    header X-Next-Cursor, X-Total-Count e X-Total-Count-Exact.
+    """
+    if cursor and offset:
+        raise HTTPException(status_code=400, detail="Usare cursor oppure offset, non entrambi")
+    
     query = """
         SELECT f.*, 
                CASE WHEN f.fk_associato IS NOT NULL 
@@ -1762,15 +3958,45 @@ async def list_fatture(
         params.append(stato)
     
     if search:
-        query += " AND (f.numero_fattura LIKE ? OR a.nome LIKE ? OR a.cognome LIKE ? OR fo.ragione_sociale LIKE ?)"
-        search_param = f"%{search}%"
-        params.extend([search_param, search_param, search_param, search_param])
+        match = fts_match_expression(search)
+        if match and await search_index_available():
+            query += (
+                f" AND (f.id_fattura IN ({fts_ids_subquery('fattura')})"
+                f" OR f.fk_associato IN ({fts_ids_subquery('associato')})"
+                f" OR f.fk_fornitore IN ({fts_ids_subquery('fornitore')}))"
+            )
+            params.extend([match, match, match])
+        else:
+            query += " AND (f.numero_fattura LIKE ? OR a.nome LIKE ? OR a.cognome LIKE ? OR fo.ragione_sociale LIKE ?)"
+            search_param = f"%{search}%"
+            params.extend([search_param, search_param, search_param, search_param])
     
-    query += " ORDER BY f.data_emissione DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+    if export_format != "json":
+        # L'esportazione ignora limit/offset/cursor e restituisce tutte le fatture filtrate
+        query += " ORDER BY f.data_emissione DESC, f.id_fattura DESC"
+        return await stream_export(query, tuple(params), export_format, "fatture")
     
-    fatture = execute_query(query, tuple(params))
-    return fatture or []
+    filtered = bool(params)
+    if exact_count:
+        count_result = await execute_query_async(f"SELECT COUNT(*) AS count FROM ({query})", tuple(params), fetch_one=True)
+        total_count = count_result['count'] if count_result else 0
+    
+    # Chiave (data_emissione, id_fattura) decrescente, servita da idx_fatture_data_emissione
+    if cursor:
+        query += " AND " + keyset_clause(["f.data_emissione", "f.id_fattura"], descending=True)
+        params.extend(decode_cursor("fatture", cursor, 2))
+    
+    query += " ORDER BY f.data_emissione DESC, f.id_fattura DESC LIMIT ? OFFSET ?"
+    params.extend([limit + 1, offset])
+    
+    rows = await execute_query_async(query, tuple(params))
+    fatture, next_cursor = split_page(rows or [], limit, "fatture", ["data_emissione", "id_fattura"])
+    
+    if not exact_count:
+        seen = offset + len(fatture) + (1 if next_cursor else 0)
+        total_count = await db_executor.run(estimated_total, filtered, seen, "Fatture")
+    set_pagination_headers(response, next_cursor, total_count, exact_count)
+    return fatture
 
 @app.post("/fatture", status_code=201, summary="Crea fattura")
 async def create_fattura(fattura: FatturaCreate):
@@ -1779,37 +4005,336 @@ async def create_fattura(fattura: FatturaCreate):
     if fattura.fk_associato and fattura.fk_fornitore:
         raise HTTPException(status_code=400, detail="Specificare solo associato o fornitore, non entrambi")
     
-    # Check numero_fattura uniqueness
-    check_query = "SELECT id_fattura FROM Fatture WHERE numero_fattura = ?"
-    existing = execute_query(check_query, (fattura.numero_fattura,), fetch_one=True)
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Numero fattura già esistente")
+    # Un numero indicato dall'utente (es. numero del fornitore) non può occupare la numerazione automatica
+    if fattura.numero_fattura and INVOICE_NUMBER_PATTERN.match(fattura.numero_fattura):
+        raise HTTPException(status_code=400, detail="Numero fattura riservato alla numerazione automatica")
     
     # Lo schema Fatture usa la colonna 'stato' con valori ('Emessa','Pagata','Scaduta','Annullata')
     stato_iniziale = 'Emessa'
+    # Il modello riceve solo il totale: imponibile = totale e IVA a zero; le note finiscono in 'descrizione'
     insert_query = """
         INSERT INTO Fatture (numero_fattura, data_emissione, data_scadenza, fk_associato, 
-                            fk_fornitore, importo_totale, stato, tipo_fattura, note)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            fk_fornitore, importo_imponibile, importo_iva, importo_totale,
+                            stato, tipo_fattura, descrizione)
+        VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?)
     """
-    execute_query(insert_query, (
-        fattura.numero_fattura,
-        fattura.data_emissione,
-        fattura.data_scadenza,
-        fattura.fk_associato,
-        fattura.fk_fornitore,
-        fattura.importo_totale,
-        stato_iniziale,
-        fattura.tipo_fattura,
-        fattura.note
-    ))
+    
+    def _insert_fattura():
+        # Verifica di unicità, numero e fattura nella stessa transazione: se l'inserimento
+        # fallisce il numero non è consumato
+        with db_pool.connection() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                if fattura.numero_fattura and conn.execute(
+                    "SELECT 1 FROM Fatture WHERE numero_fattura = ?", (fattura.numero_fattura,)
+                ).fetchone():
+                    raise HTTPException(status_code=400, detail="Numero fattura già esistente")
+                numero_fattura = fattura.numero_fattura or next_invoice_number(conn, "MAN", fattura.data_emissione)
+                conn.execute(insert_query, (
+                    numero_fattura,
+                    fattura.data_emissione.isoformat(),
+                    fattura.data_scadenza.isoformat(),
+                    fattura.fk_associato,
+                    fattura.fk_fornitore,
+                    fattura.importo_totale,
+                    fattura.importo_totale,
+                    stato_iniziale,
+                    fattura.tipo_fattura,
+                    fattura.note
+                ))
+                conn.commit()
+                return numero_fattura
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                raise HTTPException(status_code=400, detail=f"Fattura non valida: {e}")
+            except Exception:
+                conn.rollback()
+                raise
+    
+    try:
+        numero_fattura = await db_executor.run(_insert_fattura)
+    except sqlite3.Error as e:
+        logger.error(f"Database error in create_fattura: {e}")
+        raise DatabaseError(f"Database operation failed: {str(e)}")
     
     # Return created record
     return_query = "SELECT * FROM Fatture WHERE numero_fattura = ?"
-    return execute_query(return_query, (fattura.numero_fattura,), fetch_one=True)
+    return await execute_query_async(return_query, (numero_fattura,), fetch_one=True)
 
-@app.get("/fatture/{fattura_id}", summary="Dettagli fattura")
+@app.get("/fatture/numerazione", summary="Stato numerazione fatture")
+async def get_numerazione_fatture(anno: Optional[int] = Query(None, description="Filtra per anno")):
+    """Restituisce l'ultimo numero assegnato per ogni serie e anno"""
+    query = "SELECT serie, anno, ultimo_numero FROM NumerazioneFatture"
+    params = []
+    if anno:
+        query += " WHERE anno = ?"
+        params.append(anno)
+    query += " ORDER BY anno DESC, serie"
+    
+    contatori = await execute_query_async(query, tuple(params))
+    for contatore in contatori:
+        contatore["descrizione"] = INVOICE_SERIES.get(contatore["serie"], "")
+        contatore["ultimo_numero_fattura"] = (
+            format_invoice_number(contatore["serie"], contatore["anno"], contatore["ultimo_numero"])
+            if contatore["ultimo_numero"] else None
+        )
+    return contatori
+
+# ===== GENERAZIONE MASSIVA FATTURE =====
+
+# Voci fatturate per transazione durante la generazione massiva
+GENERAZIONE_CHUNK_SIZE = int(os.getenv("UMAMI_GENERAZIONE_CHUNK_SIZE", "500"))
+# Numero di job di generazione conservati in memoria per la consultazione dell'avanzamento
+GENERAZIONE_JOBS_RETENTION = 20
+
+_generazione_jobs: Dict[str, Dict[str, Any]] = {}
+_generazione_tasks = set()
+_generazione_lock = threading.Lock()
+
+# Voci fatturabili nel periodo: assegnazioni attive e erogazioni senza una fattura non annullata.
+# La fattura è intestata al socio pagante (fk_associato_riferimento) se presente, come da
+# fatturazione consolidata dei gruppi familiari.
+VOCI_FATTURABILI_QUERY = """
+    SELECT 'SF' AS serie,
+           s.id_assegnazione AS fk_assegnazione_servizio,
+           NULL AS fk_erogazione_prestazione,
+           COALESCE(a.fk_associato_riferimento, a.id_associato) AS fk_associato,
+           ps.costo AS importo,
+           sv.nome || COALESCE(' - competenza ' || s.anno_competenza, '') AS descrizione
+    FROM AssegnazioniServizi s
+    JOIN Servizi sv ON sv.id_servizio = s.fk_servizio
+    JOIN PrezziServizi ps ON ps.id_prezzo = sv.fk_prezzo
+    JOIN Associati a ON a.id_associato = s.fk_associato
+    WHERE s.stato = 'Attivo'
+      AND s.data_inizio <= :periodo_fine
+      AND (s.data_fine IS NULL OR s.data_fine >= :periodo_inizio)
+      AND ps.costo > 0
+      AND NOT EXISTS (
+          SELECT 1 FROM Fatture f
+          WHERE f.fk_assegnazione_servizio = s.id_assegnazione AND f.stato != 'Annullata'
+      )
+    UNION ALL
+    SELECT 'EP' AS serie,
+           NULL AS fk_assegnazione_servizio,
+           ep.id_erogazione AS fk_erogazione_prestazione,
+           COALESCE(a.fk_associato_riferimento, a.id_associato) AS fk_associato,
+           p.costo AS importo,
+           p.nome_prestazione || ' del ' || date(ep.data_erogazione) AS descrizione
+    FROM ErogazioniPrestazioni ep
+    JOIN Prestazioni p ON p.id_prestazione = ep.fk_prestazione
+    JOIN Associati a ON a.id_associato = ep.fk_associato
+    WHERE ep.data_erogazione >= :periodo_inizio
+      AND ep.data_erogazione < date(:periodo_fine, '+1 day')
+      AND p.costo > 0
+      AND NOT EXISTS (
+          SELECT 1 FROM Fatture f
+          WHERE f.fk_erogazione_prestazione = ep.id_erogazione AND f.stato != 'Annullata'
+      )
+"""
+
+def _generazione_params(richiesta: GenerazioneFattureRequest) -> dict:
+    return {
+        "periodo_inizio": richiesta.periodo_inizio.isoformat(),
+        "periodo_fine": richiesta.periodo_fine.isoformat(),
+    }
+
+def _update_generazione_job(job_id: str, **changes):
+    with _generazione_lock:
+        _generazione_jobs[job_id].update(changes)
+
+def _preview_generazione(richiesta: GenerazioneFattureRequest, job_id: str):
+    """Dry-run: riepilogo per serie e anteprima delle prime voci, senza scrivere nulla"""
+    params = _generazione_params(richiesta)
+    anno = richiesta.data_emissione.year
+    with db_pool.connection() as conn:
+        riepilogo = [dict(row) for row in conn.execute(
+            f"""
+            SELECT v.serie, COUNT(*) AS fatture, SUM(v.importo) AS importo_totale,
+                   COUNT(DISTINCT v.fk_associato) AS associati,
+                   COALESCE(n.ultimo_numero, 0) + 1 AS primo_numero
+            FROM ({VOCI_FATTURABILI_QUERY}) v
+            LEFT JOIN NumerazioneFatture n ON n.serie = v.serie AND n.anno = {anno}
+            GROUP BY v.serie
+            ORDER BY v.serie
+            """,
+            params,
+        ).fetchall()]
+        anteprima = [dict(row) for row in conn.execute(
+            f"SELECT * FROM ({VOCI_FATTURABILI_QUERY}) ORDER BY serie, fk_associato LIMIT 20",
+            params,
+        ).fetchall()]
+    
+    for voce in riepilogo:
+        voce["primo_numero"] = format_invoice_number(voce["serie"], anno, voce["primo_numero"])
+    
+    totale_fatture = sum(voce["fatture"] for voce in riepilogo)
+    _update_generazione_job(
+        job_id,
+        stato="completato",
+        messaggio="Simulazione completata: nessuna fattura creata.",
+        voci_totali=totale_fatture,
+        fatture_generate=0,
+        importo_totale=round(sum(voce["importo_totale"] or 0 for voce in riepilogo), 2),
+        riepilogo=riepilogo,
+        anteprima=anteprima,
+        completato_il=datetime.now().isoformat(),
+    )
+
+def _generate_fatture_chunk(conn, richiesta: GenerazioneFattureRequest, params: dict):
+    """Fattura un blocco di voci in una singola transazione; restituisce (fatture, importo)"""
+    # BEGIN IMMEDIATE: lettura delle voci e inserimento sotto lo stesso lock di scrittura,
+    # così esecuzioni concorrenti non possono fatturare due volte la stessa voce
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        voci = conn.execute(
+            f"""
+            SELECT * FROM ({VOCI_FATTURABILI_QUERY})
+            ORDER BY serie, fk_associato, fk_assegnazione_servizio, fk_erogazione_prestazione
+            LIMIT :chunk_size
+            """,
+            {**params, "chunk_size": GENERAZIONE_CHUNK_SIZE},
+        ).fetchall()
+        
+        righe = []
+        for serie in INVOICE_SERIES:
+            voci_serie = [voce for voce in voci if voce["serie"] == serie]
+            if not voci_serie:
+                continue
+            # Un solo aggiornamento del contatore per l'intero blocco della serie
+            numeri = reserve_invoice_numbers(conn, serie, richiesta.data_emissione.year, len(voci_serie))
+            righe.extend(
+                (
+                    numero,
+                    richiesta.data_emissione.isoformat(),
+                    richiesta.data_scadenza.isoformat(),
+                    voce["fk_associato"],
+                    voce["importo"],
+                    0.0,
+                    voce["importo"],
+                    voce["descrizione"],
+                    voce["fk_assegnazione_servizio"],
+                    voce["fk_erogazione_prestazione"],
+                )
+                for numero, voce in zip(numeri, voci_serie)
+            )
+        
+        conn.executemany(
+            """
+            INSERT INTO Fatture (
+                numero_fattura, data_emissione, data_scadenza, fk_associato, fk_fornitore,
+                tipo_fattura, importo_imponibile, importo_iva, importo_totale, stato,
+                descrizione, fk_assegnazione_servizio, fk_erogazione_prestazione
+            ) VALUES (?, ?, ?, ?, NULL, 'Attiva', ?, ?, ?, 'Emessa', ?, ?, ?)
+            """,
+            righe,
+        )
+        conn.commit()
+        return len(righe), sum(riga[6] for riga in righe)
+    except Exception:
+        conn.rollback()
+        raise
+
+def _run_generazione(richiesta: GenerazioneFattureRequest, job_id: str):
+    """Esegue la generazione a blocchi aggiornando l'avanzamento del job"""
+    params = _generazione_params(richiesta)
+    with db_pool.connection() as conn:
+        voci_totali = conn.execute(f"SELECT COUNT(*) FROM ({VOCI_FATTURABILI_QUERY})", params).fetchone()[0]
+        _update_generazione_job(job_id, voci_totali=voci_totali)
+        
+        fatture_generate = 0
+        importo_totale = 0.0
+        while fatture_generate < voci_totali:
+            create, importo = _generate_fatture_chunk(conn, richiesta, params)
+            if not create:
+                break
+            fatture_generate += create
+            importo_totale += importo
+            _update_generazione_job(
+                job_id,
+                fatture_generate=fatture_generate,
+                importo_totale=round(importo_totale, 2),
+                percentuale=round(100.0 * fatture_generate / voci_totali, 1),
+            )
+    
+    _update_generazione_job(
+        job_id,
+        stato="completato",
+        messaggio="Generazione fatture completata.",
+        percentuale=100.0,
+        completato_il=datetime.now().isoformat(),
+    )
+
+def _execute_generazione_job(richiesta: GenerazioneFattureRequest, job_id: str, dry_run: bool):
+    try:
+        if dry_run:
+            _preview_generazione(richiesta, job_id)
+        else:
+            _run_generazione(richiesta, job_id)
+    except Exception as e:
+        logger.error(f"Error in generazione fatture (job {job_id}): {e}")
+        _update_generazione_job(job_id, stato="errore", errore=str(e), completato_il=datetime.now().isoformat())
+    with _generazione_lock:
+        return dict(_generazione_jobs[job_id])
+
+@app.post("/fatture/genera-attive", summary="Generazione massiva fatture attive")
+async def genera_fatture_attive(
+    richiesta: GenerazioneFattureRequest,
+    dry_run: bool = Query(False, description="Simula la generazione senza creare fatture"),
+    background: bool = Query(False, description="Avvia in background e restituisce subito l'ID del job (202)")
+):
+    """Genera le fatture attive per assegnazioni servizi ed erogazioni prestazioni non ancora fatturate nel periodo.
+
+    Le voci sono selezionate e valorizzate con una query set-based e inserite a blocchi
+    (executemany, una transazione per blocco) con numeri riservati dalle serie SF ed EP.
+    L'avanzamento è consultabile con GET /fatture/genera-attive/{job_id}.
+    """
+    if richiesta.periodo_inizio > richiesta.periodo_fine:
+        raise HTTPException(status_code=400, detail="periodo_inizio deve precedere periodo_fine")
+    if richiesta.data_scadenza < richiesta.data_emissione:
+        raise HTTPException(status_code=400, detail="data_scadenza non può precedere data_emissione")
+    
+    job_id = datetime.now().strftime("%Y%m%d%H%M%S") + "-" + os.urandom(3).hex()
+    with _generazione_lock:
+        _generazione_jobs[job_id] = {
+            "job_id": job_id,
+            "stato": "in_corso",
+            "dry_run": dry_run,
+            "periodo_inizio": richiesta.periodo_inizio.isoformat(),
+            "periodo_fine": richiesta.periodo_fine.isoformat(),
+            "voci_totali": None,
+            "fatture_generate": 0,
+            "importo_totale": 0.0,
+            "percentuale": 0.0,
+            "avviato_il": datetime.now().isoformat(),
+            "completato_il": None,
+        }
+        # Conserva solo gli ultimi job
+        for vecchio_id in list(_generazione_jobs)[:-GENERAZIONE_JOBS_RETENTION]:
+            if _generazione_jobs[vecchio_id]["stato"] != "in_corso":
+                del _generazione_jobs[vecchio_id]
+    
+    if background:
+        task = asyncio.create_task(db_executor.run(_execute_generazione_job, richiesta, job_id, dry_run))
+        _generazione_tasks.add(task)
+        task.add_done_callback(_generazione_tasks.discard)
+        with _generazione_lock:
+            return JSONResponse(status_code=202, content=dict(_generazione_jobs[job_id]))
+    
+    job = await db_executor.run(_execute_generazione_job, richiesta, job_id, dry_run)
+    if job["stato"] == "errore":
+        raise HTTPException(status_code=500, detail=f"Errore nella generazione fatture: {job.get('errore')}")
+    return job
+
+@app.get("/fatture/genera-attive/{job_id}", summary="Avanzamento generazione fatture")
+async def get_generazione_fatture(job_id: str):
+    """Restituisce lo stato e l'avanzamento di un job di generazione fatture"""
+    with _generazione_lock:
+        job = _generazione_jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job di generazione non trovato")
+        return dict(job)
+
+@app.get("/fatture/{fattura_id}", summary="Dettagli fattura")
 async def get_fattura(fattura_id: int):
     """Ottieni dettagli di una fattura"""
     query = """
@@ -1825,14 +4350,14 @@ async def get_fattura(fattura_id: int):
         LEFT JOIN Fornitori fo ON f.fk_fornitore = fo.id_fornitore
         WHERE f.id_fattura = ?
     """
-    fattura = execute_query(query, (fattura_id,), fetch_one=True)
+    fattura = await execute_query_async(query, (fattura_id,), fetch_one=True)
     
     if not fattura:
         raise HTTPException(status_code=404, detail="Fattura non trovata")
     
     # Get pagamenti for this fattura
     pagamenti_query = "SELECT * FROM Pagamenti WHERE fk_fattura = ? ORDER BY data_pagamento DESC"
-    pagamenti = execute_query(pagamenti_query, (fattura_id,))
+    pagamenti = await execute_query_async(pagamenti_query, (fattura_id,))
     
     fattura['pagamenti'] = pagamenti or []
     return fattura
@@ -1854,13 +4379,24 @@ class PagamentoUpdate(BaseModel):
 
 @app.get("/pagamenti", summary="Lista pagamenti")
 async def list_pagamenti(
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursore dell'header X-Next-Cursor (alternativo a offset)"),
+    exact_count: bool = Query(False, description="Calcola il conteggio esatto in X-Total-Count"),
+    export_format: str = Query("json", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="json (paginato) oppure ndjson/csv (esportazione completa in streaming)"),
     metodo: Optional[str] = Query(None),
     dal: Optional[date] = Query(None),
     al: Optional[date] = Query(None)
 ):
-    """Lista pagamenti con filtri opzionali"""
+    """Lista pagamenti con filtri opzionali.
+
+    Restituisce una lista; cursore della pagina successiva e conteggio sono negli
+    header X-Next-Cursor, X-Total-Count e X-Total-Count-Exact.
+    """
+    if cursor and offset:
+        raise HTTPException(status_code=400, detail="Usare cursor oppure offset, non entrambi")
+    
     query = """
         SELECT p.*, f.numero_fattura, f.tipo_fattura,
                CASE WHEN f.fk_associato IS NOT NULL 
@@ -1887,18 +4423,39 @@ async def list_pagamenti(
         query += " AND p.data_pagamento <= ?"
         params.append(al)
     
-    query += " ORDER BY p.data_pagamento DESC LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+    if export_format != "json":
+        # L'esportazione ignora limit/offset/cursor e restituisce tutti i pagamenti filtrati
+        query += " ORDER BY p.data_pagamento DESC, p.id_pagamento DESC"
+        return await stream_export(query, tuple(params), export_format, "pagamenti")
+    
+    filtered = bool(params)
+    if exact_count:
+        count_result = await execute_query_async(f"SELECT COUNT(*) AS count FROM ({query})", tuple(params), fetch_one=True)
+        total_count = count_result['count'] if count_result else 0
     
-    pagamenti = execute_query(query, tuple(params))
-    return pagamenti or []
+    # Chiave (data_pagamento, id_pagamento) decrescente, servita da idx_pagamenti_data
+    if cursor:
+        query += " AND " + keyset_clause(["p.data_pagamento", "p.id_pagamento"], descending=True)
+        params.extend(decode_cursor("pagamenti", cursor, 2))
+    
+    query += " ORDER BY p.data_pagamento DESC, p.id_pagamento DESC LIMIT ? OFFSET ?"
+    params.extend([limit + 1, offset])
+    
+    rows = await execute_query_async(query, tuple(params))
+    pagamenti, next_cursor = split_page(rows or [], limit, "pagamenti", ["data_pagamento", "id_pagamento"])
+    
+    if not exact_count:
+        seen = offset + len(pagamenti) + (1 if next_cursor else 0)
+        total_count = await db_executor.run(estimated_total, filtered, seen, "Pagamenti")
+    set_pagination_headers(response, next_cursor, total_count, exact_count)
+    return pagamenti
 
 @app.post("/pagamenti", status_code=201, summary="Registra pagamento")
 async def create_pagamento(pagamento: PagamentoCreate):
     """Registra un nuovo pagamento"""
     # Check if fattura exists
     fattura_query = "SELECT * FROM Fatture WHERE id_fattura = ?"
-    fattura = execute_query(fattura_query, (pagamento.fk_fattura,), fetch_one=True)
+    fattura = await execute_query_async(fattura_query, (pagamento.fk_fattura,), fetch_one=True)
     
     if not fattura:
         raise HTTPException(status_code=404, detail="Fattura non trovata")
@@ -1907,39 +4464,55 @@ async def create_pagamento(pagamento: PagamentoCreate):
     # Se fattura è 'Attiva' => Entrata, se 'Passiva' => Uscita
     tipo_mov = 'Entrata' if (fattura.get('tipo_fattura') == 'Attiva') else 'Uscita'
 
-    # Insert pagamento con colonna 'tipo'
-    insert_query = """
-        INSERT INTO Pagamenti (fk_fattura, data_pagamento, importo, metodo, tipo)
-        VALUES (?, ?, ?, ?, ?)
-    """
-    execute_query(insert_query, (
-        pagamento.fk_fattura,
-        pagamento.data_pagamento,
-        pagamento.importo,
-        pagamento.metodo_pagamento,
-        tipo_mov,
-    ))
-    
-    # Update fattura status based on total payments
-    pagamenti_query = "SELECT SUM(importo) as totale_pagato FROM Pagamenti WHERE fk_fattura = ?"
-    totale_pagato = execute_query(pagamenti_query, (pagamento.fk_fattura,), fetch_one=True)
-    
-    importo_fattura = fattura['importo_totale']
-    totale_pagato_val = totale_pagato['totale_pagato'] or 0
-    
-    if totale_pagato_val >= importo_fattura:
-        nuovo_stato = "Pagata"
-    else:
-        # Non sono gestiti qui 'Scaduta'/'Annullata'; default rimane 'Emessa'
-        nuovo_stato = "Emessa"
-    
-    # Update fattura status
-    update_fattura_query = "UPDATE Fatture SET stato = ? WHERE id_fattura = ?"
-    execute_query(update_fattura_query, (nuovo_stato, pagamento.fk_fattura))
+    def _register_pagamento():
+        # Pagamento e stato della fattura nella stessa transazione: i trigger del partitario
+        # crediti aggiornano saldo della fattura e del socio prima del commit
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = dict_factory
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                id_pagamento = cursor.execute(
+                    """
+                    INSERT INTO Pagamenti (fk_fattura, data_pagamento, importo, metodo, tipo)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (
+                        pagamento.fk_fattura,
+                        pagamento.data_pagamento,
+                        pagamento.importo,
+                        pagamento.metodo_pagamento,
+                        tipo_mov,
+                    )
+                ).lastrowid
+                
+                # Update fattura status based on total payments
+                totale_pagato = cursor.execute(
+                    "SELECT COALESCE(SUM(importo), 0) as totale_pagato FROM Pagamenti WHERE fk_fattura = ?",
+                    (pagamento.fk_fattura,)
+                ).fetchone()['totale_pagato']
+                
+                if totale_pagato >= fattura['importo_totale']:
+                    nuovo_stato = "Pagata"
+                elif str(fattura['data_scadenza'])[:10] < date.today().isoformat():
+                    # Pagamento parziale oltre la scadenza: resta 'Scaduta' come nella manutenzione stati
+                    nuovo_stato = "Scaduta"
+                else:
+                    # 'Annullata' non è gestita qui; default rimane 'Emessa'
+                    nuovo_stato = "Emessa"
+                cursor.execute("UPDATE Fatture SET stato = ? WHERE id_fattura = ?", (nuovo_stato, pagamento.fk_fattura))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            return cursor.execute("SELECT * FROM Pagamenti WHERE id_pagamento = ?", (id_pagamento,)).fetchone()
     
-    # Return created record
-    return_query = "SELECT * FROM Pagamenti WHERE fk_fattura = ? AND data_pagamento = ? AND importo = ?"
-    return execute_query(return_query, (pagamento.fk_fattura, pagamento.data_pagamento, pagamento.importo), fetch_one=True)
+    try:
+        return await db_executor.run(_register_pagamento)
+    except Exception as e:
+        logger.error(f"Errore nella registrazione del pagamento: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nella registrazione del pagamento: {str(e)}")
 
 # ===== ENDPOINT HEALTH CHECK =====
 
@@ -1958,17 +4531,22 @@ async def list_prestazioni(
     """
     params: list[Any] = []
     if search:
-        query += " AND nome_prestazione LIKE ?"
-        params.append(f"%{search}%")
+        match = fts_match_expression(search)
+        if match and await search_index_available():
+            query += f" AND id_prestazione IN ({fts_ids_subquery('prestazione')})"
+            params.append(match)
+        else:
+            query += " AND nome_prestazione LIKE ?"
+            params.append(f"%{search}%")
     query += " ORDER BY nome_prestazione ASC LIMIT ? OFFSET ?"
     params.extend([limit, offset])
-    rows = execute_query(query, tuple(params))
+    rows = await execute_query_async(query, tuple(params))
     return rows or []
 
 @app.get("/prestazioni/{prestazione_id}", summary="Dettaglio prestazione")
 async def get_prestazione(prestazione_id: int = Path(..., ge=1)):
     """Recupera una singola prestazione per ID."""
-    row = execute_query(
+    row = await execute_query_async(
         "SELECT id_prestazione, nome_prestazione, descrizione, costo FROM Prestazioni WHERE id_prestazione = ?",
         (prestazione_id,),
         fetch_one=True,
@@ -1980,7 +4558,7 @@ async def get_prestazione(prestazione_id: int = Path(..., ge=1)):
 @app.post("/prestazioni", status_code=201, summary="Crea prestazione")
 async def create_prestazione(prestazione: PrestazioneCreate):
     """Crea una nuova prestazione."""
-    execute_query(
+    await execute_query_async(
         "INSERT INTO Prestazioni (nome_prestazione, descrizione, costo) VALUES (?, ?, ?)",
         (
             prestazione.nome_prestazione,
@@ -1989,7 +4567,7 @@ async def create_prestazione(prestazione: PrestazioneCreate):
         ),
     )
     # Ritorna l'ultima prestazione inserita
-    created = execute_query(
+    created = await execute_query_async(
         "SELECT id_prestazione, nome_prestazione, descrizione, costo FROM Prestazioni ORDER BY id_prestazione DESC LIMIT 1",
         tuple(),
         fetch_one=True,
@@ -1999,7 +4577,7 @@ async def create_prestazione(prestazione: PrestazioneCreate):
 @app.put("/prestazioni/{prestazione_id}", summary="Aggiorna prestazione")
 async def update_prestazione(prestazione_id: int, prestazione: PrestazioneUpdate):
     """Aggiorna campi della prestazione."""
-    existing = execute_query(
+    existing = await execute_query_async(
         "SELECT id_prestazione FROM Prestazioni WHERE id_prestazione = ?",
         (prestazione_id,),
         fetch_one=True,
@@ -2025,7 +4603,7 @@ async def update_prestazione(prestazione_id: int, prestazione: PrestazioneUpdate
 
     query = f"UPDATE Prestazioni SET {', '.join(fields)} WHERE id_prestazione = ?"
     values.append(prestazione_id)
-    execute_query(query, tuple(values))
+    await execute_query_async(query, tuple(values))
     return await get_prestazione(prestazione_id)
 
 # ===== IMPOSTAZIONI ENDPOINTS =====
@@ -2034,16 +4612,19 @@ async def update_prestazione(prestazione_id: int, prestazione: PrestazioneUpdate
 async def get_database_tables():
     """Restituisce la lista delle tabelle disponibili nel database per l'importazione."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        def _list_tables():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+            tables = [row[0] for row in cursor.fetchall()]
+            conn.close()
         
-        # Filtra le tabelle di sistema
-        user_tables = [table for table in tables if not table.startswith('sqlite_')]
+            # Filtra le tabelle di sistema e quelle dell'indice full-text
+            user_tables = [table for table in tables if not is_internal_table(table)]
         
-        return {"tables": user_tables}
+            return {"tables": user_tables}
+
+        return await db_executor.run(_list_tables)
     except Exception as e:
         logger.error(f"Errore nel recupero tabelle: {e}")
         raise HTTPException(status_code=500, detail="Errore nel recupero delle tabelle")
@@ -2052,50 +4633,53 @@ async def get_database_tables():
 async def get_table_schema(table_name: str = Path(..., description="Nome della tabella")):
     """Restituisce lo schema di una tabella specifica per l'importazione CSV."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        def _read_schema():
+            conn = get_db_connection()
+            cursor = conn.cursor()
         
-        # Verifica che la tabella esista
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if not cursor.fetchone():
-            conn.close()
-            raise HTTPException(status_code=404, detail=f"Tabella '{table_name}' non trovata")
+            # Verifica che la tabella esista
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+            if not cursor.fetchone():
+                conn.close()
+                raise HTTPException(status_code=404, detail=f"Tabella '{table_name}' non trovata")
+        
+            # Ottieni lo schema della tabella
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            columns_info = cursor.fetchall()
+        
+            schema = []
+            for col in columns_info:
+                column_info = {
+                    "name": col[1],           # nome colonna
+                    "type": col[2],           # tipo dato
+                    "not_null": bool(col[3]), # NOT NULL
+                    "default": col[4],        # valore default
+                    "primary_key": bool(col[5]) # chiave primaria
+                }
+                schema.append(column_info)
         
-        # Ottieni lo schema della tabella
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns_info = cursor.fetchall()
-        
-        schema = []
-        for col in columns_info:
-            column_info = {
-                "name": col[1],           # nome colonna
-                "type": col[2],           # tipo dato
-                "not_null": bool(col[3]), # NOT NULL
-                "default": col[4],        # valore default
-                "primary_key": bool(col[5]) # chiave primaria
-            }
-            schema.append(column_info)
-        
-        # Ottieni anche i vincoli di foreign key
-        cursor.execute(f"PRAGMA foreign_key_list({table_name})")
-        foreign_keys = cursor.fetchall()
-        
-        fk_info = []
-        for fk in foreign_keys:
-            fk_info.append({
-                "column": fk[3],      # colonna locale
-                "references_table": fk[2], # tabella riferita
-                "references_column": fk[4] # colonna riferita
-            })
+            # Ottieni anche i vincoli di foreign key
+            cursor.execute(f"PRAGMA foreign_key_list({table_name})")
+            foreign_keys = cursor.fetchall()
         
-        conn.close()
+            fk_info = []
+            for fk in foreign_keys:
+                fk_info.append({
+                    "column": fk[3],      # colonna locale
+                    "references_table": fk[2], # tabella riferita
+                    "references_column": fk[4] # colonna riferita
+                })
         
-        return {
-            "table_name": table_name,
-            "columns": schema,
-            "foreign_keys": fk_info,
-            "csv_example_header": ",".join([col["name"] for col in schema if not col["primary_key"]])
-        }
+            conn.close()
+        
+            return {
+                "table_name": table_name,
+                "columns": schema,
+                "foreign_keys": fk_info,
+                "csv_example_header": ",".join([col["name"] for col in schema if not col["primary_key"]])
+            }
+
+        return await db_executor.run(_read_schema)
         
     except HTTPException:
         raise
@@ -2103,104 +4687,194 @@ async def get_table_schema(table_name: str = Path(..., description="Nome della t
         logger.error(f"Errore nel recupero schema tabella {table_name}: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nel recupero schema: {str(e)}")
 
-@app.post("/admin/import/{table_name}", summary="Importa dati CSV")
-async def import_csv_data(
-    table_name: str = Path(..., description="Nome della tabella di destinazione"),
-    file: UploadFile = File(..., description="File CSV da importare")
-):
-    """Importa dati massivi da file CSV in una tabella specifica."""
-    
-    # Verifica che il file sia CSV
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Il file deve essere in formato CSV")
+# Righe per executemany/savepoint durante l'importazione CSV
+IMPORT_BATCH_SIZE = int(os.getenv("UMAMI_IMPORT_BATCH_SIZE", "1000"))
+# Numero massimo di messaggi di errore restituiti in ImportResult
+IMPORT_MAX_ERRORS = 100
+
+IMPORT_MODES = {
+    "insert": "INSERT",             # conflitti riportati come errori di riga
+    "ignore": "INSERT OR IGNORE",   # righe in conflitto saltate
+    "replace": "INSERT OR REPLACE", # righe in conflitto sostituite
+    "upsert": "INSERT",             # ON CONFLICT(...) DO UPDATE sulle colonne del CSV
+}
+
+def build_import_statement(table_name: str, csv_columns: List[str], table_info: list, mode: str, conflict_columns: List[str]) -> str:
+    """Costruisce l'INSERT parametrico usato con executemany.
+
+    Le celle vuote diventano NULL; per le colonne con DEFAULT si usa COALESCE
+    così che il default dello schema continui ad applicarsi.
+    """
+    defaults = {col["name"]: col["dflt_value"] for col in table_info if col["dflt_value"] is not None}
+    placeholders = [
+        f"COALESCE(?, {defaults[column]})" if column in defaults else "?"
+        for column in csv_columns
+    ]
+    statement = (
+        f"{IMPORT_MODES[mode]} INTO {table_name} ({', '.join(csv_columns)}) "
+        f"VALUES ({', '.join(placeholders)})"
+    )
+    if mode == "upsert":
+        update_columns = [column for column in csv_columns if column not in conflict_columns]
+        if update_columns:
+            assignments = ", ".join(f"{column} = excluded.{column}" for column in update_columns)
+            statement += f" ON CONFLICT({', '.join(conflict_columns)}) DO UPDATE SET {assignments}"
+        else:
+            statement += f" ON CONFLICT({', '.join(conflict_columns)}) DO NOTHING"
+    return statement
+
+def _import_csv_stream(text_stream, table_name: str, mode: str, conflict_columns: Optional[List[str]]) -> ImportResult:
+    """Importa il CSV leggendolo a blocchi: una transazione, un savepoint e un executemany per blocco.
+
+    Se un blocco fallisce il savepoint viene annullato e il blocco è reinserito riga per
+    riga, così gli errori sono riportati per singola riga senza interrompere l'importazione.
+    """
+    started = time.perf_counter()
+    csv_reader = csv.reader(text_stream)
+    header = next(csv_reader, None)
+    if not header or not any(column.strip() for column in header):
+        return ImportResult(
+            success=False,
+            message="File CSV vuoto o formato non valido",
+            imported_rows=0,
+            errors=["Nessuna riga di dati trovata"],
+            mode=mode
+        )
+    csv_columns = [column.strip() for column in header]
     
-    try:
-        # Leggi il contenuto del file
-        content = await file.read()
-        csv_content = content.decode('utf-8')
-        
-        # Parse CSV
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        rows = list(csv_reader)
-        
-        if not rows:
-            return ImportResult(
-                success=False,
-                message="File CSV vuoto o formato non valido",
-                imported_rows=0,
-                errors=["Nessuna riga di dati trovata"]
-            )
-        
-        # Verifica che la tabella esista
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if not cursor.fetchone():
-            conn.close()
+    with db_pool.connection() as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
             raise HTTPException(status_code=404, detail=f"Tabella '{table_name}' non trovata")
         
-        # Ottieni le colonne della tabella
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        table_columns = [col[1] for col in cursor.fetchall()]
-        
-        # Verifica compatibilità colonne CSV con tabella
-        csv_columns = list(rows[0].keys())
+        # Validazione dell'intestazione una sola volta, su PRAGMA table_info
+        table_info = [dict(row) for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        table_columns = [col["name"] for col in table_info]
         missing_columns = [col for col in csv_columns if col not in table_columns]
-        
         if missing_columns:
-            conn.close()
             return ImportResult(
                 success=False,
                 message="Colonne CSV non compatibili con la tabella",
                 imported_rows=0,
-                errors=[f"Colonne non trovate nella tabella: {', '.join(missing_columns)}"]
+                errors=[f"Colonne non trovate nella tabella: {', '.join(missing_columns)}"],
+                mode=mode
+            )
+        if len(set(csv_columns)) != len(csv_columns):
+            return ImportResult(
+                success=False,
+                message="Colonne CSV duplicate",
+                imported_rows=0,
+                errors=["L'intestazione contiene colonne ripetute"],
+                mode=mode
             )
         
-        # Importa i dati
+        if mode == "upsert":
+            conflict_columns = conflict_columns or [
+                col["name"] for col in sorted(table_info, key=lambda col: col["pk"]) if col["pk"]
+            ]
+            invalid = [col for col in conflict_columns if col not in csv_columns]
+            if not conflict_columns or invalid:
+                return ImportResult(
+                    success=False,
+                    message="Colonne di conflitto non valide per l'upsert",
+                    imported_rows=0,
+                    errors=[f"Le colonne di conflitto devono essere presenti nel CSV: {', '.join(invalid or conflict_columns)}"],
+                    mode=mode
+                )
+        
+        statement = build_import_statement(table_name, csv_columns, table_info, mode, conflict_columns or [])
+        
         imported_count = 0
+        skipped_count = 0
+        failed_count = 0
+        processed_count = 0
         errors = []
         
-        for i, row in enumerate(rows, 1):
+        def record_error(line_number, message):
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append((line_number, f"Riga {line_number}: {message}"))
+        
+        def flush(batch):
+            """Inserisce un blocco di (numero_riga, valori) nel proprio savepoint"""
+            nonlocal imported_count, skipped_count, failed_count
+            if not batch:
+                return
+            conn.execute("SAVEPOINT import_batch")
             try:
-                # Filtra solo le colonne esistenti nella tabella
-                filtered_row = {k: v for k, v in row.items() if k in table_columns and v.strip()}
-                
-                if not filtered_row:
-                    errors.append(f"Riga {i}: Nessun dato valido")
+                # rowcount = righe scritte dall'istruzione (esclusi trigger e conflitti ignorati)
+                written = conn.executemany(statement, [values for _, values in batch]).rowcount
+                conn.execute("RELEASE SAVEPOINT import_batch")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK TO SAVEPOINT import_batch")
+                conn.execute("RELEASE SAVEPOINT import_batch")
+                # Ripiego riga per riga: ogni INSERT fallito è annullato da solo
+                written = 0
+                failed = 0
+                for line_number, values in batch:
+                    try:
+                        written += conn.execute(statement, values).rowcount
+                    except sqlite3.Error as e:
+                        failed += 1
+                        record_error(line_number, str(e))
+                failed_count += failed
+                # Le righe né scritte né fallite sono state ignorate per conflitto
+                imported_count += written
+                skipped_count += len(batch) - written - failed
+                return
+            imported_count += written
+            skipped_count += len(batch) - written
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            batch = []
+            for line_number, row in enumerate(csv_reader, 2):
+                if not row or not any(cell.strip() for cell in row):
                     continue
-                
-                # Costruisci query INSERT
-                columns = list(filtered_row.keys())
-                placeholders = ', '.join(['?' for _ in columns])
-                values = list(filtered_row.values())
-                
-                query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-                cursor.execute(query, values)
-                imported_count += 1
-                
-            except sqlite3.Error as e:
-                errors.append(f"Riga {i}: {str(e)}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        
-        return ImportResult(
-            success=imported_count > 0,
-            message=f"Importazione completata: {imported_count} righe importate",
-            imported_rows=imported_count,
-            errors=errors
-        )
-        
-    except Exception as e:
-        logger.error(f"Errore nell'importazione CSV: {e}")
-        raise HTTPException(status_code=500, detail=f"Errore nell'importazione: {str(e)}")
+                processed_count += 1
+                if len(row) != len(csv_columns):
+                    failed_count += 1
+                    record_error(line_number, f"attesi {len(csv_columns)} campi, trovati {len(row)}")
+                    continue
+                batch.append((line_number, [cell if cell.strip() else None for cell in row]))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush(batch)
+                    batch = []
+            # In modalità replace le righe sostituite attivano i trigger di cancellazione
+            # (PRAGMA recursive_triggers del profilo): statistiche, partitario, riepilogo
+            # mensile e indice di ricerca restano allineati senza ricalcoli
+            flush(batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if table_name in KEY_CACHE_TABLES:
+        key_cache.invalidate()
+    
+    duration = time.perf_counter() - started
+    # Errori in ordine di riga (quelli di un blocco sono rilevati solo al suo inserimento)
+    messages = [message for _, message in sorted(errors)]
+    if failed_count > len(messages):
+        messages.append(f"... e altri {failed_count - len(messages)} errori")
+    
+    return ImportResult(
+        success=imported_count > 0,
+        message=f"Importazione completata: {imported_count} righe importate",
+        imported_rows=imported_count,
+        errors=messages,
+        mode=mode,
+        skipped_rows=skipped_count,
+        failed_rows=failed_count,
+        duration_seconds=round(duration, 3),
+        rows_per_second=round(processed_count / duration, 1) if duration > 0 else 0.0
+    )
 
 @app.post("/admin/import/database", summary="Importa database completo")
 async def import_database_backup(
     file: UploadFile = File(..., description="File database (.db) da ripristinare")
 ):
-    """Importa un backup completo del database sostituendo quello esistente."""
+    """Importa un backup completo del database sostituendo quello esistente.
+
+    Dichiarata prima di /admin/import/{table_name}, che altrimenti intercetterebbe il percorso.
+    """
     
     # Verifica che il file sia un database SQLite
     if not file.filename.endswith('.db'):
@@ -2210,38 +4884,25 @@ async def import_database_backup(
         # Leggi il contenuto del file
         content = await file.read()
         
-        # Crea un file temporaneo per il nuovo database
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.db') as temp_file:
-            temp_file.write(content)
-            temp_path = temp_file.name
+        def _restore_database():
+            # Crea un file temporaneo per il nuovo database
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.db') as temp_file:
+                temp_file.write(content)
+                temp_path = temp_file.name
         
-        # Verifica che il file sia un database SQLite valido
-        try:
-            test_conn = sqlite3.connect(temp_path)
-            test_conn.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1")
-            test_conn.close()
-        except sqlite3.Error:
-            os.unlink(temp_path)
-            raise HTTPException(status_code=400, detail="Il file non è un database SQLite valido")
-        
-        # Backup del database corrente
-        backup_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = str(DB_PATH).replace('.db', f'_backup_{backup_timestamp}.db')
+            # Verifica che il file sia un database SQLite valido
+            try:
+                test_conn = sqlite3.connect(temp_path)
+                test_conn.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1")
+                test_conn.close()
+            except sqlite3.Error:
+                os.unlink(temp_path)
+                raise HTTPException(status_code=400, detail="Il file non è un database SQLite valido")
         
-        try:
-            # Crea backup del database esistente
-            if os.path.exists(str(DB_PATH)):
-                shutil.copy2(str(DB_PATH), backup_path)
-            
-            # Sostituisci il database corrente con quello importato
-            shutil.move(temp_path, str(DB_PATH))
-            
-            # Verifica che il nuovo database funzioni
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'")
-            table_count = cursor.fetchone()[0]
-            conn.close()
+            try:
+                backup_path, table_count = replace_database_file(temp_path)
+            finally:
+                remove_file_quietly(temp_path)
             
             return {
                 "success": True,
@@ -2249,12 +4910,8 @@ async def import_database_backup(
                 "backup_created": backup_path,
                 "errors": []
             }
-            
-        except Exception as e:
-            # In caso di errore, ripristina il backup
-            if os.path.exists(backup_path):
-                shutil.copy2(backup_path, str(DB_PATH))
-            raise e
+
+        return await db_executor.run(_restore_database)
             
     except HTTPException:
         raise
@@ -2262,71 +4919,607 @@ async def import_database_backup(
         logger.error(f"Errore nell'importazione database: {e}")
         raise HTTPException(status_code=500, detail=f"Errore nell'importazione database: {str(e)}")
 
+@app.post("/admin/import/{table_name}", summary="Importa dati CSV")
+async def import_csv_data(
+    table_name: str = Path(..., description="Nome della tabella di destinazione"),
+    file: UploadFile = File(..., description="File CSV da importare"),
+    mode: str = Query("insert", pattern="^(insert|ignore|replace|upsert)$", description="Gestione dei conflitti: insert (errore), ignore, replace o upsert"),
+    conflict_columns: Optional[str] = Query(None, description="Colonne di conflitto per l'upsert, separate da virgola (default: chiave primaria)")
+):
+    """Importa dati massivi da file CSV in una tabella specifica.
+
+    Il file viene letto in streaming e inserito a blocchi con executemany in un'unica
+    transazione; gli errori delle singole righe sono riportati senza interrompere l'importazione.
+    """
+    
+    # Verifica che il file sia CSV
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Il file deve essere in formato CSV")
+    
+    if is_internal_table(table_name):
+        raise HTTPException(status_code=400, detail=f"La tabella '{table_name}' non è importabile")
+    
+    try:
+        def _import_rows():
+            # Decodifica incrementale del file caricato (utf-8-sig rimuove l'eventuale BOM di Excel)
+            text_stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+            try:
+                columns = [col.strip() for col in conflict_columns.split(",") if col.strip()] if conflict_columns else None
+                return _import_csv_stream(text_stream, table_name, mode, columns)
+            finally:
+                text_stream.detach()
+
+        return await db_executor.run(_import_rows)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Errore nell'importazione CSV: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nell'importazione: {str(e)}")
+
+# ===== BACKUP =====
+
+# Pagine copiate per ogni passo dell'API di backup e pausa tra i passi: tra un passo e
+# l'altro gli scrittori possono procedere, quindi il backup non blocca la segreteria
+BACKUP_PAGES_PER_STEP = int(os.getenv("UMAMI_BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_SLEEP_SECONDS = float(os.getenv("UMAMI_BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_STREAM_CHUNK_SIZE = 1024 * 1024
+
+BACKUP_COMPRESSIONS = {
+    "none": ("", "application/octet-stream"),
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd"),
+}
+
+# Copie di sicurezza (<db>_backup_<timestamp>.db) conservate accanto al database dai ripristini
+RESTORE_SAFETY_COPIES_RETENTION = int(os.getenv("UMAMI_RESTORE_SAFETY_COPIES", "5"))
+
+# Avanzamento dell'ultimo backup (GET /admin/backup/progress)
+_backup_progress = {"in_corso": False}
+_backup_progress_lock = threading.Lock()
+
+def _update_backup_progress(**changes):
+    with _backup_progress_lock:
+        _backup_progress.update(changes)
+
+def create_backup_file(method: str = "backup") -> str:
+    """Crea una copia consistente del database in un file temporaneo e ne restituisce il percorso.
+
+    - ``backup``: API di backup di SQLite a passi di BACKUP_PAGES_PER_STEP pagine;
+    - ``vacuum``: ``VACUUM INTO`` (snapshot compattato in un'unica transazione di lettura).
+
+    Il chiamante è responsabile della rimozione del file.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix="umami_backup_", suffix=".db")
+    os.close(fd)
+    started = time.perf_counter()
+    _update_backup_progress(
+        in_corso=True,
+        metodo=method,
+        pagine_totali=None,
+        pagine_rimanenti=None,
+        percentuale=0.0,
+        avviato_il=datetime.now().isoformat(),
+        completato_il=None,
+        durata_secondi=None,
+        dimensione_bytes=None,
+        errore=None,
+    )
+    
+    def _progress(status, remaining, total):
+        _update_backup_progress(
+            pagine_totali=total,
+            pagine_rimanenti=remaining,
+            percentuale=round(100.0 * (total - remaining) / total, 1) if total else 100.0,
+        )
+    
+    try:
+        with db_pool.connection() as source:
+            if method == "vacuum":
+                os.unlink(temp_path)  # VACUUM INTO richiede che il file di destinazione non esista
+                source.execute("VACUUM INTO ?", (temp_path,))
+            else:
+                destination = sqlite3.connect(temp_path)
+                try:
+                    source.backup(
+                        destination,
+                        pages=BACKUP_PAGES_PER_STEP,
+                        progress=_progress,
+                        sleep=BACKUP_STEP_SLEEP_SECONDS,
+                    )
+                finally:
+                    destination.close()
+        
+        _update_backup_progress(
+            in_corso=False,
+            percentuale=100.0,
+            completato_il=datetime.now().isoformat(),
+            durata_secondi=round(time.perf_counter() - started, 3),
+            dimensione_bytes=os.path.getsize(temp_path),
+        )
+        return temp_path
+    except Exception as e:
+        _update_backup_progress(in_corso=False, errore=str(e), completato_il=datetime.now().isoformat())
+        remove_file_quietly(temp_path)
+        raise
+
+def prune_safety_copies():
+    """Elimina le copie di sicurezza dei ripristini oltre le più recenti RESTORE_SAFETY_COPIES_RETENTION"""
+    db_path = PathLib(str(DB_PATH))
+    copies = sorted(db_path.parent.glob(f"{db_path.stem}_backup_*.db"), reverse=True)
+    for old_copy in copies[RESTORE_SAFETY_COPIES_RETENTION:]:
+        remove_file_quietly(str(old_copy))
+
+def replace_database_file(new_path: str):
+    """Sostituisce il contenuto del database con quello del file indicato, salvando prima una copia di sicurezza.
+
+    Restituisce (percorso della copia di sicurezza, numero di tabelle del nuovo database).
+    Il file in uso non viene mai spostato né sovrascritto: il nuovo contenuto è copiato con
+    l'API di backup di SQLite in un unico passo, su una connessione del pool e sotto il lock
+    di scrittura. Le connessioni già prelevate (esportazioni in streaming, job in background,
+    manutenzione degli stati) restano sullo stesso file e vedono il nuovo contenuto dalla
+    transazione successiva. Se la copia fallisce il database resta invariato.
+    """
+    backup_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_path = str(DB_PATH).replace('.db', f'_backup_{backup_timestamp}.db')
+    
+    source = sqlite3.connect(new_path)
+    try:
+        with db_pool.connection() as conn:
+            # Copia di sicurezza consistente del database in uso (WAL compreso)
+            safety_copy = sqlite3.connect(backup_path)
+            try:
+                conn.backup(safety_copy)
+            finally:
+                safety_copy.close()
+            
+            source.backup(conn._raw())  # la destinazione deve essere la sqlite3.Connection
+            table_count = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'").fetchone()[0]
+    finally:
+        source.close()
+    
+    _search_index_state["ready"] = False
+    key_cache.invalidate()
+    status_maintenance.reset()
+    
+    prune_safety_copies()
+    return backup_path, table_count
+
+def remove_file_quietly(path: str):
+    """Rimuove un file temporaneo ignorando che sia già stato eliminato"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def iter_file_chunks(path: str, compression: str = "none"):
+    """Legge il file a blocchi comprimendolo al volo; il file viene eliminato a fine lettura"""
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: formato gzip
+    elif compression == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = None
+    
+    try:
+        with open(path, "rb") as source:
+            while True:
+                chunk = source.read(BACKUP_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        remove_file_quietly(path)
+
 @app.get("/admin/backup", summary="Backup database")
-async def backup_database():
-    """Crea un backup del database e lo restituisce per il download."""
+async def backup_database(
+    method: str = Query("backup", pattern="^(backup|vacuum)$", description="backup (API di backup a passi) o vacuum (VACUUM INTO)"),
+    compression: str = Query("none", pattern="^(none|gzip|zstd)$", description="Compressione del file scaricato")
+):
+    """Crea un backup consistente del database e lo trasmette in streaming per il download.
+
+    Il file temporaneo viene eliminato al termine del download.
+    """
+    if compression == "zstd" and zstandard is None:
+        raise HTTPException(status_code=400, detail="Compressione zstd non disponibile: installare il pacchetto 'zstandard'")
     
     try:
-        # Crea un file temporaneo per il backup
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"umami_backup_{timestamp}.db"
+        temp_path = await db_executor.run(create_backup_file, method)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.db') as temp_file:
-            temp_path = temp_file.name
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix, media_type = BACKUP_COMPRESSIONS[compression]
+        backup_filename = f"umami_backup_{timestamp}.db{suffix}"
+        
+        headers = {"Content-Disposition": f"attachment; filename={backup_filename}"}
+        with _backup_progress_lock:
+            headers["X-Backup-Duration"] = str(_backup_progress.get("durata_secondi"))
+        if compression == "none":
+            headers["Content-Length"] = str(os.path.getsize(temp_path))
+        
+        return StreamingResponse(
+            iter_file_chunks(temp_path, compression),
+            media_type=media_type,
+            headers=headers,
+            # Rimozione anche se il client si disconnette prima di leggere il file
+            background=BackgroundTask(remove_file_quietly, temp_path)
+        )
+            
+    except Exception as e:
+        logger.error(f"Errore nel backup del database: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel backup: {str(e)}")
+
+# ===== BACKUP INCREMENTALI =====
+
+# Catene di backup: un primo elemento completo seguito da differenziali a livello di pagina.
+# Ogni catena è una directory con manifest.json, i file delle pagine (gzip) e l'impronta
+# corrente di ogni pagina, così il backup successivo scrive solo le pagine cambiate.
+BACKUP_DIR = PathLib(os.getenv("UMAMI_BACKUP_DIR", str(PathLib(str(DB_PATH)).parent / "backups")))
+BACKUP_CHAIN_MAX_LENGTH = int(os.getenv("UMAMI_BACKUP_CHAIN_LENGTH", "24"))
+BACKUP_RETENTION_CHAINS = int(os.getenv("UMAMI_BACKUP_RETENTION_CHAINS", "7"))
+
+PAGE_FILE_MAGIC = b"UMAMIPG1"
+PAGE_DIGEST_SIZE = 16
+_incremental_backup_lock = threading.Lock()
+
+def _page_digest(page: bytes) -> bytes:
+    return hashlib.blake2b(page, digest_size=PAGE_DIGEST_SIZE).digest()
+
+def _file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(BACKUP_STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_page_size(path) -> int:
+    """Dimensione pagina dall'header del file SQLite (offset 16, big endian; 1 = 65536)"""
+    with open(path, "rb") as source:
+        header = source.read(100)
+    page_size = struct.unpack(">H", header[16:18])[0]
+    return 65536 if page_size == 1 else page_size
+
+def _load_manifest(chain_dir: PathLib) -> dict:
+    with open(chain_dir / "manifest.json", "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+def _save_manifest(chain_dir: PathLib, manifest: dict):
+    temp_manifest = chain_dir / "manifest.json.tmp"
+    with open(temp_manifest, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temp_manifest, chain_dir / "manifest.json")
+
+def list_backup_chains() -> List[PathLib]:
+    """Directory delle catene, dalla più vecchia alla più recente"""
+    if not BACKUP_DIR.exists():
+        return []
+    return sorted(path for path in BACKUP_DIR.iterdir() if (path / "manifest.json").exists())
+
+def prune_backup_chains():
+    """Politica di conservazione: mantiene solo le ultime BACKUP_RETENTION_CHAINS catene"""
+    chains = list_backup_chains()
+    removed = []
+    for chain_dir in chains[:-BACKUP_RETENTION_CHAINS] if BACKUP_RETENTION_CHAINS > 0 else []:
+        shutil.rmtree(chain_dir, ignore_errors=True)
+        removed.append(chain_dir.name)
+    return removed
+
+def create_incremental_backup(force_full: bool = False) -> dict:
+    """Aggiunge un elemento alla catena corrente (o ne apre una nuova con un backup completo).
+
+    Il database viene fotografato con l'API di backup; le pagine sono confrontate con le
+    impronte dell'elemento precedente e solo quelle cambiate vengono scritte.
+    """
+    with _incremental_backup_lock:
+        snapshot_path = create_backup_file("backup")
+        try:
+            page_size = _read_page_size(snapshot_path)
+            page_count = os.path.getsize(snapshot_path) // page_size
             
-            # Copia il database nel file temporaneo
-            shutil.copy2(str(DB_PATH), temp_path)
+            chains = list_backup_chains()
+            chain_dir = chains[-1] if chains else None
+            manifest = _load_manifest(chain_dir) if chain_dir else None
+            if (
+                force_full
+                or manifest is None
+                or manifest["page_size"] != page_size
+                or len(manifest["entries"]) >= BACKUP_CHAIN_MAX_LENGTH
+            ):
+                chain_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                chain_dir = BACKUP_DIR / chain_id
+                chain_dir.mkdir(parents=True)
+                manifest = {"chain_id": chain_id, "page_size": page_size, "created_at": datetime.now().isoformat(), "entries": []}
+                previous_digests = b""
+            else:
+                with open(chain_dir / "pages.digest", "rb") as digest_file:
+                    previous_digests = digest_file.read()
             
-            # Ottieni le dimensioni del file
-            file_size = os.path.getsize(temp_path)
+            seq = len(manifest["entries"])
+            entry_type = "full" if seq == 0 else "delta"
+            entry_file = f"{seq:06d}-{entry_type}.pages.gz"
+            db_digest = hashlib.sha256()
+            new_digests = bytearray()
+            changed_pages = 0
             
-            # Restituisci il file per il download
-            return FileResponse(
-                path=temp_path,
-                filename=backup_filename,
-                media_type='application/octet-stream',
-                headers={
-                    "Content-Disposition": f"attachment; filename={backup_filename}",
-                    "Content-Length": str(file_size)
-                }
-            )
+            with open(snapshot_path, "rb") as snapshot, gzip.open(chain_dir / entry_file, "wb", compresslevel=6) as output:
+                output.write(PAGE_FILE_MAGIC + struct.pack(">II", page_size, page_count))
+                for pgno in range(1, page_count + 1):
+                    page = snapshot.read(page_size)
+                    db_digest.update(page)
+                    digest = _page_digest(page)
+                    new_digests += digest
+                    offset = (pgno - 1) * PAGE_DIGEST_SIZE
+                    if previous_digests[offset:offset + PAGE_DIGEST_SIZE] != digest:
+                        output.write(struct.pack(">I", pgno) + page)
+                        changed_pages += 1
+            
+            parent_sha256 = manifest["entries"][-1]["db_sha256"] if manifest["entries"] else None
+            entry = {
+                "seq": seq,
+                "type": entry_type,
+                "file": entry_file,
+                "created_at": datetime.now().isoformat(),
+                "page_count": page_count,
+                "changed_pages": changed_pages,
+                "file_size_bytes": os.path.getsize(chain_dir / entry_file),
+                "file_sha256": _file_sha256(chain_dir / entry_file),
+                "db_sha256": db_digest.hexdigest(),
+                "parent_sha256": parent_sha256,
+            }
             
+            with open(chain_dir / "pages.digest.tmp", "wb") as digest_file:
+                digest_file.write(new_digests)
+            os.replace(chain_dir / "pages.digest.tmp", chain_dir / "pages.digest")
+            manifest["entries"].append(entry)
+            _save_manifest(chain_dir, manifest)
+        finally:
+            remove_file_quietly(snapshot_path)
+        
+        removed_chains = prune_backup_chains()
+        return {"chain_id": manifest["chain_id"], **entry, "pruned_chains": removed_chains}
+
+def rebuild_database_from_chain(chain_id: str, seq: Optional[int] = None) -> str:
+    """Ricostruisce in un file temporaneo lo stato del database all'elemento seq della catena.
+
+    Verifica il checksum di ogni file e il concatenamento degli elementi, e infine il
+    checksum del database ricostruito. Restituisce il percorso del file ricostruito.
+    """
+    chain_dir = BACKUP_DIR / chain_id
+    if not re.fullmatch(r"\w+", chain_id) or not (chain_dir / "manifest.json").exists():
+        raise NotFoundError(f"Catena di backup '{chain_id}' non trovata")
+    manifest = _load_manifest(chain_dir)
+    entries = manifest["entries"]
+    if seq is None:
+        seq = len(entries) - 1
+    if seq < 0 or seq >= len(entries):
+        raise NotFoundError(f"Elemento {seq} non presente nella catena '{chain_id}'")
+    
+    page_size = manifest["page_size"]
+    fd, temp_path = tempfile.mkstemp(prefix="umami_restore_", suffix=".db")
+    os.close(fd)
+    try:
+        with open(temp_path, "r+b") as target:
+            parent_sha256 = None
+            for entry in entries[:seq + 1]:
+                if entry["parent_sha256"] != parent_sha256:
+                    raise ValueError(f"Catena interrotta all'elemento {entry['seq']}")
+                if _file_sha256(chain_dir / entry["file"]) != entry["file_sha256"]:
+                    raise ValueError(f"Checksum non valido per {entry['file']}")
+                with gzip.open(chain_dir / entry["file"], "rb") as pages:
+                    header = pages.read(len(PAGE_FILE_MAGIC) + 8)
+                    if header[:len(PAGE_FILE_MAGIC)] != PAGE_FILE_MAGIC:
+                        raise ValueError(f"Formato non valido per {entry['file']}")
+                    while True:
+                        pgno_bytes = pages.read(4)
+                        if not pgno_bytes:
+                            break
+                        pgno = struct.unpack(">I", pgno_bytes)[0]
+                        target.seek((pgno - 1) * page_size)
+                        target.write(pages.read(page_size))
+                target.truncate(entry["page_count"] * page_size)
+                parent_sha256 = entry["db_sha256"]
+        
+        if _file_sha256(temp_path) != entries[seq]["db_sha256"]:
+            raise ValueError("Il database ricostruito non corrisponde al checksum del manifest")
+        return temp_path
+    except Exception:
+        remove_file_quietly(temp_path)
+        raise
+
+@app.post("/admin/backup/incremental", summary="Backup incrementale")
+async def incremental_backup(
+    full: bool = Query(False, description="Forza l'apertura di una nuova catena con un backup completo")
+):
+    """Salva nella directory dei backup solo le pagine cambiate dall'ultimo elemento della catena"""
+    try:
+        return await db_executor.run(create_incremental_backup, full)
     except Exception as e:
-        logger.error(f"Errore nel backup del database: {e}")
-        raise HTTPException(status_code=500, detail=f"Errore nel backup: {str(e)}")
+        logger.error(f"Errore nel backup incrementale: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel backup incrementale: {str(e)}")
+
+@app.get("/admin/backup/chains", summary="Catene di backup incrementali")
+async def list_incremental_backups():
+    """Elenca le catene di backup con i relativi elementi (punti di ripristino)"""
+    def _collect_chains():
+        chains = []
+        for chain_dir in reversed(list_backup_chains()):
+            manifest = _load_manifest(chain_dir)
+            chains.append({
+                "chain_id": manifest["chain_id"],
+                "created_at": manifest["created_at"],
+                "page_size": manifest["page_size"],
+                "total_size_bytes": sum(entry["file_size_bytes"] for entry in manifest["entries"]),
+                "entries": manifest["entries"],
+            })
+        return {"backup_dir": str(BACKUP_DIR), "retention_chains": BACKUP_RETENTION_CHAINS, "chains": chains}
+    
+    return await db_executor.run(_collect_chains)
+
+@app.post("/admin/backup/chains/{chain_id}/restore", summary="Ripristino da catena di backup")
+async def restore_incremental_backup(
+    chain_id: str = Path(..., description="ID della catena"),
+    seq: Optional[int] = Query(None, ge=0, description="Elemento della catena da ripristinare (default: l'ultimo)")
+):
+    """Ripristina il database allo stato di un elemento della catena riapplicando i differenziali"""
+    def _restore_from_chain():
+        rebuilt_path = rebuild_database_from_chain(chain_id, seq)
+        try:
+            backup_path, table_count = replace_database_file(rebuilt_path)
+        finally:
+            remove_file_quietly(rebuilt_path)
+        return {
+            "success": True,
+            "message": f"Database ripristinato dalla catena {chain_id}. {table_count} tabelle trovate.",
+            "backup_created": backup_path,
+            "errors": []
+        }
+    
+    try:
+        return await db_executor.run(_restore_from_chain)
+    except NotFoundError:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Errore nel ripristino da catena di backup: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel ripristino: {str(e)}")
+
+@app.get("/admin/backup/progress", summary="Avanzamento backup")
+async def backup_progress():
+    """Restituisce l'avanzamento (pagine copiate) e la durata dell'ultimo backup"""
+    with _backup_progress_lock:
+        return dict(_backup_progress)
+
+# ===== STATISTICHE TABELLE =====
+
+# Conteggi e ultima modifica per tabella, mantenuti da trigger (sezione 'table_stats' di database_schema.json)
+TABLE_STATS_TABLE = "StatisticheTabelle"
+# Dimensioni da dbstat, ricalcolate solo quando cambiano i file del database (principale e WAL)
+_table_sizes_cache = {"key": None, "sizes": {}}
+_table_sizes_lock = threading.Lock()
+
+def list_user_tables(conn) -> List[str]:
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+    return [row[0] for row in rows if not is_internal_table(row[0])]
+
+def table_stats_available(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (TABLE_STATS_TABLE,)
+    ).fetchone() is not None
+
+def refresh_table_stats(conn, tables: List[str]):
+    """Ricalcola con COUNT(*) il conteggio esatto delle tabelle indicate"""
+    if not table_stats_available(conn):
+        return
+    for table in tables:
+        conn.execute(
+            f"UPDATE {TABLE_STATS_TABLE} SET righe = (SELECT COUNT(*) FROM {table}), ricalcolata_il = datetime('now') "
+            f"WHERE nome_tabella = ?",
+            (table,)
+        )
+
+def read_table_stats(conn) -> Dict[str, Dict[str, Any]]:
+    rows = conn.execute(
+        f"SELECT nome_tabella, righe, ultima_modifica, ricalcolata_il FROM {TABLE_STATS_TABLE}"
+    ).fetchall()
+    return {row[0]: {"righe": row[1], "ultima_modifica": row[2], "ricalcolata_il": row[3]} for row in rows}
+
+def read_table_sizes(conn) -> Dict[str, int]:
+    """Byte occupati da ogni tabella (indici inclusi) secondo dbstat, con cache fino alla prossima modifica"""
+    key = tuple(
+        (stat.st_mtime_ns, stat.st_size)
+        for stat in (os.stat(path) for path in (str(DB_PATH), f"{DB_PATH}-wal") if os.path.exists(path))
+    )
+    with _table_sizes_lock:
+        if _table_sizes_cache["key"] == key:
+            return _table_sizes_cache["sizes"]
+    
+    try:
+        rows = conn.execute(
+            "SELECT COALESCE(m.tbl_name, s.name), SUM(s.pgsize) "
+            "FROM dbstat AS s LEFT JOIN sqlite_master AS m ON m.name = s.name "
+            "WHERE s.aggregate = TRUE GROUP BY 1"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # SQLite compilato senza SQLITE_ENABLE_DBSTAT_VTAB
+        return {}
+    sizes = {row[0]: row[1] for row in rows}
+    with _table_sizes_lock:
+        _table_sizes_cache.update(key=key, sizes=sizes)
+    return sizes
 
 @app.get("/admin/backup/info", summary="Info backup database")
-async def backup_info():
-    """Restituisce informazioni sul database per il backup."""
+async def backup_info(
+    exact: bool = Query(False, description="Ricalcola i conteggi con COUNT(*) e aggiorna le statistiche")
+):
+    """Restituisce informazioni sul database per il backup.
+
+    I conteggi sono letti dalle statistiche mantenute dai trigger; con exact=true (o se il
+    database non ha le statistiche) vengono ricalcolati con una scansione delle tabelle.
+    """
     
     try:
-        # Ottieni informazioni sul database
-        file_size = os.path.getsize(str(DB_PATH))
-        file_modified = datetime.fromtimestamp(os.path.getmtime(str(DB_PATH)))
-        
-        # Conta le righe nelle tabelle principali
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        table_counts = {}
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-        tables = [row[0] for row in cursor.fetchall() if not row[0].startswith('sqlite_')]
-        
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table}")
-            count = cursor.fetchone()[0]
-            table_counts[table] = count
-        
-        conn.close()
+        def _collect_info():
+            # Ottieni informazioni sul database
+            file_size = os.path.getsize(str(DB_PATH))
+            file_modified = datetime.fromtimestamp(os.path.getmtime(str(DB_PATH)))
+        
+            with db_pool.connection() as conn:
+                tables = list_user_tables(conn)
+                stats_available = table_stats_available(conn)
+                
+                if exact and stats_available:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        refresh_table_stats(conn, tables)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                
+                if stats_available:
+                    stats = read_table_stats(conn)
+                else:
+                    stats = {
+                        table: {"righe": conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]}
+                        for table in tables
+                    }
+                # Tabelle non coperte dai trigger (es. create dopo le statistiche): conteggio diretto
+                for table in tables:
+                    if table not in stats:
+                        stats[table] = {"righe": conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]}
+                sizes = read_table_sizes(conn)
+            
+            table_counts = {table: stats[table]["righe"] for table in tables}
+            table_details = {
+                table: {
+                    "rows": stats[table]["righe"],
+                    "size_bytes": sizes.get(table),
+                    "last_modified": stats[table].get("ultima_modifica"),
+                    "counted_at": stats[table].get("ricalcolata_il"),
+                }
+                for table in tables
+            }
+            modified_times = [detail["last_modified"] for detail in table_details.values() if detail["last_modified"]]
         
-        return {
-            "database_path": str(DB_PATH),
-            "file_size_bytes": file_size,
-            "file_size_mb": round(file_size / (1024 * 1024), 2),
-            "last_modified": file_modified.isoformat(),
-            "table_counts": table_counts,
-            "total_records": sum(table_counts.values())
-        }
+            return {
+                "database_path": str(DB_PATH),
+                "file_size_bytes": file_size,
+                "file_size_mb": round(file_size / (1024 * 1024), 2),
+                "last_modified": file_modified.isoformat(),
+                "last_data_change": max(modified_times) if modified_times else None,
+                "counts_source": "exact" if exact or not stats_available else "triggers",
+                "table_counts": table_counts,
+                "table_details": table_details,
+                "total_records": sum(table_counts.values())
+            }
+
+        return await db_executor.run(_collect_info)
         
     except Exception as e:
         logger.error(f"Errore nel recupero info backup: {e}")
@@ -2335,12 +5528,90 @@ async def backup_info():
 @app.get("/health", summary="Health check")
 async def health_check():
     """Endpoint per verificare lo stato dell'API"""
+    try:
+        pragmas = await db_executor.run(db_pool.effective_pragmas)
+    except Exception as e:
+        logger.error(f"Errore nella lettura dei PRAGMA: {e}")
+        pragmas = {"error": str(e)}
+    
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "database_pool": db_pool.stats(),
+        "database_executor": db_executor.stats(),
+        "key_cache": key_cache.stats(),
+        "database_pragmas": pragmas
     }
 
+@app.get("/admin/slow-queries", summary="Registro query lente")
+async def list_slow_queries(
+    limit: int = Query(50, ge=1, le=1000, description="Numero massimo di query restituite (dalle più recenti)")
+):
+    """Query oltre la soglia UMAMI_SLOW_QUERY_MS con SQL normalizzato, tipi dei parametri e piano di esecuzione"""
+    snapshot = slow_query_log.snapshot()
+    snapshot["queries"] = snapshot["queries"][:limit]
+    return snapshot
+
+@app.delete("/admin/slow-queries", status_code=204, summary="Svuota registro query lente")
+async def clear_slow_queries():
+    """Svuota il registro delle query lente"""
+    slow_query_log.clear()
+
+@app.get("/admin/query-budget", summary="Round-trip SQL per rotta")
+async def get_query_budget():
+    """Statement e connessioni massimi per rotta, budget e ultima richiesta oltre budget o con statement ripetuti"""
+    return query_budget.snapshot()
+
+@app.get("/admin/manutenzione-stati", summary="Stato della manutenzione stati")
+async def get_status_maintenance():
+    """Intervallo, ultima passata e contatori della manutenzione degli stati"""
+    return status_maintenance.snapshot()
+
+@app.post("/admin/manutenzione-stati", summary="Esegui manutenzione stati")
+async def run_status_maintenance(
+    completa: bool = Query(False, description="Ricalcola tutti i servizi invece dei soli cambiati dall'ultima passata")
+):
+    """Esegue subito una passata di manutenzione degli stati"""
+    try:
+        return await db_executor.run(status_maintenance.run, None, completa)
+    except Exception as e:
+        logger.error(f"Error in run_status_maintenance: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics", summary="Metriche Prometheus")
+async def metrics_endpoint():
+    """Latenza per rotta, statement e tempo SQL in formato di esposizione Prometheus"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ===== AVVIO E SPEGNIMENTO =====
+
+async def warm_key_cache():
+    """Carica la cache delle autorizzazioni chiavi all'avvio del server"""
+    try:
+        await db_executor.run(key_cache.refresh)
+        logger.info(f"Cache chiavi caricata: {key_cache.stats()['entries']} chiavi")
+    except Exception as e:
+        logger.warning(f"Cache chiavi non caricata all'avvio (verrà caricata al primo uso): {e}")
+
+async def start_status_maintenance():
+    """Avvia la manutenzione periodica degli stati (se UMAMI_MANUTENZIONE_STATI_INTERVALLO > 0)"""
+    global _status_maintenance_task
+    if STATUS_SWEEP_INTERVAL_SECONDS > 0:
+        _status_maintenance_task = asyncio.create_task(_status_maintenance_loop())
+
+async def stop_status_maintenance():
+    """Interrompe la manutenzione periodica degli stati"""
+    global _status_maintenance_task
+    if _status_maintenance_task is not None:
+        _status_maintenance_task.cancel()
+        _status_maintenance_task = None
+
+async def close_db_pool():
+    """Attende i lavori dell'executor e chiude le connessioni del pool allo spegnimento del server"""
+    db_executor.shutdown()
+    db_pool.dispose()
+
 @app.get("/", summary="Root endpoint")
 async def root():
     """Endpoint radice con informazioni sull'API"""
@@ -2363,5 +5634,14 @@ async def root():
 # )
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    import sys
+    
+    if "--manutenzione-stati" in sys.argv[1:]:
+        # Passata singola da cron, senza avviare il server
+        esito = status_maintenance.run(completa=True)
+        db_executor.shutdown()
+        db_pool.dispose()
+        print(json.dumps(esito, indent=2, ensure_ascii=False))
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
@@ -15,6 +15,24 @@ from datetime import datetime
 class DatabaseBuilder:
     """Classe per la costruzione del database UMAMI"""
     
+    # Ordine di creazione delle tabelle per rispettare le foreign keys
+    TABLE_ORDER = [
+        'Associati',
+        'ChiaviElettroniche',
+        'TessereFIV',
+        'Fornitori',
+        # Prezzi prima di Servizi per rispettare FK fk_prezzo NOT NULL
+        'PrezziServizi',
+        'Servizi',
+        'Prestazioni',
+        'AssegnazioniServizi',
+        'ErogazioniPrestazioni',
+        'Fatture',
+        'Pagamenti',
+        'NumerazioneFatture',
+        'AccessiChiavi'
+    ]
+    
     def __init__(self, config_file="database_schema.json", data_dir="data"):
         """
         Inizializza il builder del database
@@ -48,13 +66,14 @@ class DatabaseBuilder:
         self.data_dir.mkdir(exist_ok=True)
         print(f"✓ Directory data verificata: {self.data_dir}")
     
-    def build_create_table_sql(self, table_name, table_config):
+    def build_create_table_sql(self, table_name, table_config, if_not_exists=False):
         """
         Costruisce l'SQL per la creazione di una tabella
         
         Args:
             table_name (str): Nome della tabella
             table_config (dict): Configurazione della tabella
+            if_not_exists (bool): Aggiunge IF NOT EXISTS (aggiornamento di database esistenti)
             
         Returns:
             str: Statement SQL CREATE TABLE
@@ -80,12 +99,432 @@ class DatabaseBuilder:
             
             columns.append(column_def)
         
-        sql = f"CREATE TABLE {table_name} (\n"
+        # Chiave primaria composta (es. contatori per serie e anno)
+        if 'primary_key' in table_config:
+            columns.append(f"PRIMARY KEY ({', '.join(table_config['primary_key'])})")
+        
+        if_not_exists_sql = "IF NOT EXISTS " if if_not_exists else ""
+        sql = f"CREATE TABLE {if_not_exists_sql}{table_name} (\n"
         sql += ",\n".join(f"    {col}" for col in columns)
         sql += "\n);"
         
         return sql
     
+    def create_missing_tables(self, cursor):
+        """Crea le tabelle della configurazione non ancora presenti nel database"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        existing = {row[0] for row in cursor.fetchall()}
+        
+        for table_name in self.TABLE_ORDER:
+            if table_name in self.config['tables'] and table_name not in existing:
+                sql = self.build_create_table_sql(table_name, self.config['tables'][table_name], if_not_exists=True)
+                cursor.execute(sql)
+                print(f"✓ Tabella {table_name} creata")
+    
+    def build_create_index_sql(self, index_name, index_config):
+        """
+        Costruisce l'SQL per la creazione di un indice secondario
+        
+        Args:
+            index_name (str): Nome dell'indice
+            index_config (dict): Configurazione dell'indice (table, columns, unique, where)
+            
+        Returns:
+            str: Statement SQL CREATE INDEX
+        """
+        unique = "UNIQUE " if index_config.get('unique', False) else ""
+        columns = ", ".join(index_config['columns'])
+        
+        sql = f"CREATE {unique}INDEX IF NOT EXISTS {index_name} ON {index_config['table']} ({columns})"
+        
+        # Indice parziale
+        if 'where' in index_config:
+            sql += f" WHERE {index_config['where']}"
+        
+        return sql + ";"
+    
+    def create_indexes(self, cursor):
+        """
+        Crea gli indici secondari definiti nella configurazione (sezione 'indexes')
+        
+        Args:
+            cursor: Cursore SQLite su cui creare gli indici
+        """
+        for index_name, index_config in self.config.get('indexes', {}).items():
+            sql = self.build_create_index_sql(index_name, index_config)
+            cursor.execute(sql)
+            print(f"✓ Indice {index_name} su {index_config['table']}({', '.join(index_config['columns'])})")
+        
+        # Aggiorna le statistiche usate dal query planner
+        cursor.execute("PRAGMA optimize;")
+    
+    # Il rowid di ogni documento FTS codifica tipo e chiave (chiave * 8 + codice tipo),
+    # così che i trigger possano aggiornare o rimuovere un documento per rowid.
+    SEARCH_ROWID_FACTOR = 8
+    
+    def build_search_index_sql(self, search_config):
+        """
+        Costruisce l'SQL per l'indice full-text FTS5 e i trigger che lo mantengono
+        
+        Args:
+            search_config (dict): Configurazione dell'indice (sezione 'search_index')
+            
+        Returns:
+            list: Statement SQL (CREATE VIRTUAL TABLE e CREATE TRIGGER)
+        """
+        fts_table = search_config['table']
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+            f"tipo UNINDEXED, ref_id UNINDEXED, titolo, testo, "
+            f"tokenize = '{search_config.get('tokenize', 'unicode61')}', "
+            f"prefix = '{search_config.get('prefix', '2 3')}');"
+        ]
+        
+        for tipo, source in search_config['sources'].items():
+            table, key = source['table'], source['key']
+            rowid = f"{key} * {self.SEARCH_ROWID_FACTOR} + {source['code']}"
+            select = (
+                f"SELECT {rowid}, '{tipo}', {key}, {source['titolo']}, {source['testo']} "
+                f"FROM {table} WHERE {key} = NEW.{key}"
+            )
+            insert = f"INSERT INTO {fts_table} (rowid, tipo, ref_id, titolo, testo) {select};"
+            delete = f"DELETE FROM {fts_table} WHERE rowid = OLD.{key} * {self.SEARCH_ROWID_FACTOR} + {source['code']};"
+            
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_{table}_ai AFTER INSERT ON {table} "
+                f"BEGIN {insert} END;"
+            )
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_{table}_au AFTER UPDATE ON {table} "
+                f"BEGIN {delete} {insert} END;"
+            )
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_{table}_ad AFTER DELETE ON {table} "
+                f"BEGIN {delete} END;"
+            )
+        
+        return statements
+    
+    def create_search_index(self, cursor, rebuild=True):
+        """
+        Crea l'indice full-text (sezione 'search_index') e, se richiesto, lo ripopola
+        
+        Args:
+            cursor: Cursore SQLite su cui creare l'indice
+            rebuild (bool): Se True ricostruisce il contenuto dai dati esistenti
+        """
+        search_config = self.config.get('search_index')
+        if not search_config:
+            return
+        
+        for sql in self.build_search_index_sql(search_config):
+            cursor.execute(sql)
+        
+        if rebuild:
+            fts_table = search_config['table']
+            cursor.execute(f"DELETE FROM {fts_table};")
+            for tipo, source in search_config['sources'].items():
+                key = source['key']
+                cursor.execute(
+                    f"INSERT INTO {fts_table} (rowid, tipo, ref_id, titolo, testo) "
+                    f"SELECT {key} * {self.SEARCH_ROWID_FACTOR} + {source['code']}, '{tipo}', {key}, "
+                    f"{source['titolo']}, {source['testo']} FROM {source['table']};"
+                )
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('optimize');")
+        
+        print(f"✓ Indice full-text {search_config['table']} su: {', '.join(search_config['sources'])}")
+    
+    def build_table_stats_sql(self, stats_table, tables):
+        """
+        Costruisce l'SQL della tabella delle statistiche e dei trigger che la mantengono
+        
+        Args:
+            stats_table (str): Nome della tabella delle statistiche
+            tables (list): Tabelle di cui contare le righe
+            
+        Returns:
+            list: Statement SQL (CREATE TABLE e CREATE TRIGGER)
+        """
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {stats_table} ("
+            f"nome_tabella TEXT PRIMARY KEY, "
+            f"righe INTEGER NOT NULL DEFAULT 0, "
+            f"ultima_modifica TEXT, "
+            f"ricalcolata_il TEXT) WITHOUT ROWID;"
+        ]
+        
+        for table in tables:
+            for suffix, event, righe in (('ai', 'INSERT', 'righe + 1'), ('au', 'UPDATE', 'righe'), ('ad', 'DELETE', 'righe - 1')):
+                statements.append(
+                    f"CREATE TRIGGER IF NOT EXISTS trg_{stats_table}_{table}_{suffix} AFTER {event} ON {table} "
+                    f"BEGIN UPDATE {stats_table} SET righe = {righe}, ultima_modifica = datetime('now') "
+                    f"WHERE nome_tabella = '{table}'; END;"
+                )
+        
+        return statements
+    
+    def create_table_stats(self, cursor):
+        """
+        Crea la tabella delle statistiche (sezione 'table_stats') e la inizializza con i conteggi esatti
+        
+        Args:
+            cursor: Cursore SQLite su cui creare la tabella e i trigger
+        """
+        stats_config = self.config.get('table_stats')
+        if not stats_config:
+            return
+        
+        stats_table = stats_config['table']
+        tables = [table for table in self.TABLE_ORDER if table in self.config['tables']]
+        for sql in self.build_table_stats_sql(stats_table, tables):
+            cursor.execute(sql)
+        
+        for table in tables:
+            cursor.execute(
+                f"INSERT INTO {stats_table} (nome_tabella, righe, ultima_modifica, ricalcolata_il) "
+                f"VALUES (?, (SELECT COUNT(*) FROM {table}), datetime('now'), datetime('now')) "
+                f"ON CONFLICT (nome_tabella) DO UPDATE SET righe = excluded.righe, ricalcolata_il = excluded.ricalcolata_il;",
+                (table,)
+            )
+        
+        print(f"✓ Statistiche tabelle {stats_table} su {len(tables)} tabelle")
+    
+    # Una fattura è una partita aperta se attiva, intestata a un socio, non pagata/annullata
+    # e con un saldo residuo (importo totale meno i pagamenti registrati).
+    RECEIVABLES_EPSILON = 0.005
+    
+    def build_receivables_ledger_sql(self, ledger_config):
+        """
+        Costruisce l'SQL del partitario dei crediti verso i soci e dei trigger che lo mantengono
+        
+        Args:
+            ledger_config (dict): Configurazione del partitario (sezione 'receivables_ledger')
+            
+        Returns:
+            list: Statement SQL (CREATE TABLE, CREATE INDEX e CREATE TRIGGER)
+        """
+        ledger, summary = ledger_config['ledger_table'], ledger_config['summary_table']
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {ledger} ("
+            f"id_fattura INTEGER PRIMARY KEY, "
+            f"fk_associato INTEGER NOT NULL, "
+            f"data_scadenza DATE, "
+            f"importo_totale DECIMAL(10,2) NOT NULL, "
+            f"importo_pagato DECIMAL(10,2) NOT NULL, "
+            f"saldo DECIMAL(10,2) NOT NULL);",
+            f"CREATE INDEX IF NOT EXISTS idx_{ledger}_scadenza ON {ledger} (data_scadenza, fk_associato);",
+            f"CREATE INDEX IF NOT EXISTS idx_{ledger}_associato ON {ledger} (fk_associato, data_scadenza);",
+            f"CREATE TABLE IF NOT EXISTS {summary} ("
+            f"fk_associato INTEGER PRIMARY KEY, "
+            f"fatture_aperte INTEGER NOT NULL, "
+            f"importo_totale DECIMAL(10,2) NOT NULL, "
+            f"importo_pagato DECIMAL(10,2) NOT NULL, "
+            f"saldo DECIMAL(10,2) NOT NULL, "
+            f"prima_scadenza DATE);",
+            f"CREATE INDEX IF NOT EXISTS idx_{summary}_saldo ON {summary} (saldo);",
+        ]
+        
+        amounts = ("importo_totale", "importo_pagato", "saldo")
+        
+        def refresh_partita(id_fattura):
+            # Il saldo del socio è aggiornato per differenza: si toglie la partita precedente
+            # e si aggiunge quella ricalcolata, senza riaggregare tutte le partite del socio
+            old_value = f"(SELECT {{}} FROM {ledger} WHERE id_fattura = {id_fattura})"
+            subtract = ", ".join(f"{col} = ROUND({col} - {old_value.format(col)}, 2)" for col in amounts)
+            add = ", ".join(f"{col} = ROUND({col} + excluded.{col}, 2)" for col in amounts)
+            return (
+                f"UPDATE {summary} SET fatture_aperte = fatture_aperte - 1, {subtract} "
+                f"WHERE fk_associato = {old_value.format('fk_associato')}; "
+                f"DELETE FROM {ledger} WHERE id_fattura = {id_fattura}; "
+                f"INSERT INTO {ledger} (id_fattura, fk_associato, data_scadenza, importo_totale, importo_pagato, saldo) "
+                f"SELECT f.id_fattura, f.fk_associato, f.data_scadenza, f.importo_totale, p.pagato, f.importo_totale - p.pagato "
+                f"FROM Fatture f, (SELECT COALESCE(SUM(importo), 0) AS pagato FROM Pagamenti WHERE fk_fattura = {id_fattura}) p "
+                f"WHERE f.id_fattura = {id_fattura} AND f.tipo_fattura = 'Attiva' AND f.fk_associato IS NOT NULL "
+                f"AND f.stato IN ('Emessa', 'Scaduta') AND f.importo_totale - p.pagato > {self.RECEIVABLES_EPSILON}; "
+                f"INSERT INTO {summary} (fk_associato, fatture_aperte, importo_totale, importo_pagato, saldo) "
+                f"SELECT fk_associato, 1, importo_totale, importo_pagato, saldo FROM {ledger} WHERE id_fattura = {id_fattura} "
+                f"ON CONFLICT (fk_associato) DO UPDATE SET fatture_aperte = fatture_aperte + 1, {add};"
+            )
+        
+        def refresh_saldo(fk_associato):
+            # Prima scadenza letta dall'indice (fk_associato, data_scadenza); socio rimosso se senza partite
+            return (
+                f"DELETE FROM {summary} WHERE fk_associato = {fk_associato} AND fatture_aperte <= 0; "
+                f"UPDATE {summary} SET prima_scadenza = "
+                f"(SELECT MIN(data_scadenza) FROM {ledger} WHERE fk_associato = {fk_associato}) "
+                f"WHERE fk_associato = {fk_associato};"
+            )
+        
+        associato_of = "(SELECT fk_associato FROM Fatture WHERE id_fattura = {}.fk_fattura)"
+        triggers = {
+            "Fatture_ai": ("AFTER INSERT ON Fatture",
+                           refresh_partita("NEW.id_fattura") + " " + refresh_saldo("NEW.fk_associato")),
+            "Fatture_au": ("AFTER UPDATE OF stato, tipo_fattura, importo_totale, data_scadenza, fk_associato ON Fatture",
+                           refresh_partita("OLD.id_fattura") + " " + refresh_partita("NEW.id_fattura") + " "
+                           + refresh_saldo("OLD.fk_associato") + " " + refresh_saldo("NEW.fk_associato")),
+            "Fatture_ad": ("AFTER DELETE ON Fatture",
+                           refresh_partita("OLD.id_fattura") + " " + refresh_saldo("OLD.fk_associato")),
+            "Pagamenti_ai": ("AFTER INSERT ON Pagamenti",
+                             refresh_partita("NEW.fk_fattura") + " " + refresh_saldo(associato_of.format("NEW"))),
+            "Pagamenti_au": ("AFTER UPDATE OF importo, fk_fattura ON Pagamenti",
+                             refresh_partita("OLD.fk_fattura") + " " + refresh_partita("NEW.fk_fattura") + " "
+                             + refresh_saldo(associato_of.format("OLD")) + " " + refresh_saldo(associato_of.format("NEW"))),
+            "Pagamenti_ad": ("AFTER DELETE ON Pagamenti",
+                             refresh_partita("OLD.fk_fattura") + " " + refresh_saldo(associato_of.format("OLD"))),
+        }
+        for name, (event, body) in triggers.items():
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS trg_{ledger}_{name} {event} BEGIN {body} END;")
+        
+        return statements
+    
+    def create_receivables_ledger(self, cursor, rebuild=True):
+        """
+        Crea il partitario dei crediti (sezione 'receivables_ledger') e, se richiesto, lo ricalcola
+        
+        Args:
+            cursor: Cursore SQLite su cui creare tabelle e trigger
+            rebuild (bool): Se True ricostruisce partite e saldi da Fatture e Pagamenti
+        """
+        ledger_config = self.config.get('receivables_ledger')
+        if not ledger_config:
+            return
+        
+        for sql in self.build_receivables_ledger_sql(ledger_config):
+            cursor.execute(sql)
+        
+        if rebuild:
+            ledger, summary = ledger_config['ledger_table'], ledger_config['summary_table']
+            cursor.execute(f"DELETE FROM {ledger};")
+            cursor.execute(f"DELETE FROM {summary};")
+            cursor.execute(
+                f"INSERT INTO {ledger} (id_fattura, fk_associato, data_scadenza, importo_totale, importo_pagato, saldo) "
+                f"SELECT f.id_fattura, f.fk_associato, f.data_scadenza, f.importo_totale, "
+                f"COALESCE(p.pagato, 0), f.importo_totale - COALESCE(p.pagato, 0) "
+                f"FROM Fatture f LEFT JOIN (SELECT fk_fattura, SUM(importo) AS pagato FROM Pagamenti GROUP BY fk_fattura) p "
+                f"ON p.fk_fattura = f.id_fattura "
+                f"WHERE f.tipo_fattura = 'Attiva' AND f.fk_associato IS NOT NULL AND f.stato IN ('Emessa', 'Scaduta') "
+                f"AND f.importo_totale - COALESCE(p.pagato, 0) > {self.RECEIVABLES_EPSILON};"
+            )
+            cursor.execute(
+                f"INSERT INTO {summary} (fk_associato, fatture_aperte, importo_totale, importo_pagato, saldo, prima_scadenza) "
+                f"SELECT fk_associato, COUNT(*), ROUND(SUM(importo_totale), 2), ROUND(SUM(importo_pagato), 2), ROUND(SUM(saldo), 2), MIN(data_scadenza) "
+                f"FROM {ledger} GROUP BY fk_associato;"
+            )
+        
+        print(f"✓ Partitario crediti {ledger_config['ledger_table']} / {ledger_config['summary_table']}")
+    
+    # Chiave del riepilogo mensile: categoria, gruppo e settore mancanti sono registrati come ''
+    ROLLUP_KEY = ("anno", "mese", "tipo_fattura", "categoria", "gruppo", "settore")
+    
+    def build_monthly_rollup_sql(self, rollup_table):
+        """
+        Costruisce l'SQL del riepilogo mensile delle fatture e dei trigger che lo mantengono
+        
+        Args:
+            rollup_table (str): Nome della tabella di riepilogo
+            
+        Returns:
+            list: Statement SQL (CREATE TABLE e CREATE TRIGGER)
+        """
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {rollup_table} ("
+            f"anno INTEGER NOT NULL, "
+            f"mese INTEGER NOT NULL, "
+            f"tipo_fattura VARCHAR(20) NOT NULL, "
+            f"categoria VARCHAR(50) NOT NULL DEFAULT '', "
+            f"gruppo VARCHAR(50) NOT NULL DEFAULT '', "
+            f"settore VARCHAR(50) NOT NULL DEFAULT '', "
+            f"numero_fatture INTEGER NOT NULL, "
+            f"imponibile DECIMAL(12,2) NOT NULL, "
+            f"iva DECIMAL(12,2) NOT NULL, "
+            f"totale DECIMAL(12,2) NOT NULL, "
+            f"PRIMARY KEY ({', '.join(self.ROLLUP_KEY)})) WITHOUT ROWID;"
+        ]
+        
+        def key_values(row):
+            return (
+                f"CAST(strftime('%Y', {row}.data_emissione) AS INTEGER), CAST(strftime('%m', {row}.data_emissione) AS INTEGER), "
+                f"{row}.tipo_fattura, COALESCE({row}.categoria, ''), COALESCE({row}.gruppo, ''), COALESCE({row}.settore, '')"
+            )
+        
+        def add(row):
+            return (
+                f"INSERT INTO {rollup_table} ({', '.join(self.ROLLUP_KEY)}, numero_fatture, imponibile, iva, totale) "
+                f"SELECT {key_values(row)}, 1, ROUND({row}.importo_imponibile, 2), ROUND({row}.importo_iva, 2), ROUND({row}.importo_totale, 2) "
+                f"WHERE {row}.stato != 'Annullata' "
+                f"ON CONFLICT ({', '.join(self.ROLLUP_KEY)}) DO UPDATE SET numero_fatture = numero_fatture + 1, "
+                f"imponibile = ROUND(imponibile + excluded.imponibile, 2), iva = ROUND(iva + excluded.iva, 2), "
+                f"totale = ROUND(totale + excluded.totale, 2);"
+            )
+        
+        def subtract(row):
+            key_match = f"({', '.join(self.ROLLUP_KEY)}) = ({key_values(row)})"
+            return (
+                f"UPDATE {rollup_table} SET numero_fatture = numero_fatture - 1, "
+                f"imponibile = ROUND(imponibile - {row}.importo_imponibile, 2), iva = ROUND(iva - {row}.importo_iva, 2), "
+                f"totale = ROUND(totale - {row}.importo_totale, 2) "
+                f"WHERE {key_match} AND {row}.stato != 'Annullata'; "
+                f"DELETE FROM {rollup_table} WHERE {key_match} AND numero_fatture <= 0;"
+            )
+        
+        columns = "data_emissione, tipo_fattura, categoria, gruppo, settore, importo_imponibile, importo_iva, importo_totale, stato"
+        triggers = {
+            "ai": ("AFTER INSERT ON Fatture", add("NEW")),
+            "au": (f"AFTER UPDATE OF {columns} ON Fatture", subtract("OLD") + " " + add("NEW")),
+            "ad": ("AFTER DELETE ON Fatture", subtract("OLD")),
+        }
+        for name, (event, body) in triggers.items():
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS trg_{rollup_table}_Fatture_{name} {event} BEGIN {body} END;")
+        
+        return statements
+    
+    def create_monthly_rollup(self, cursor, rebuild=True):
+        """
+        Crea il riepilogo mensile delle fatture (sezione 'monthly_rollup') e, se richiesto, lo ricalcola
+        
+        Args:
+            cursor: Cursore SQLite su cui creare tabella e trigger
+            rebuild (bool): Se True ricostruisce il riepilogo dalle fatture esistenti
+        """
+        rollup_config = self.config.get('monthly_rollup')
+        if not rollup_config:
+            return
+        
+        rollup_table = rollup_config['table']
+        for sql in self.build_monthly_rollup_sql(rollup_table):
+            cursor.execute(sql)
+        
+        if rebuild:
+            cursor.execute(f"DELETE FROM {rollup_table};")
+            cursor.execute(
+                f"INSERT INTO {rollup_table} ({', '.join(self.ROLLUP_KEY)}, numero_fatture, imponibile, iva, totale) "
+                f"SELECT CAST(strftime('%Y', data_emissione) AS INTEGER), CAST(strftime('%m', data_emissione) AS INTEGER), "
+                f"tipo_fattura, COALESCE(categoria, ''), COALESCE(gruppo, ''), COALESCE(settore, ''), "
+                f"COUNT(*), ROUND(SUM(importo_imponibile), 2), ROUND(SUM(importo_iva), 2), ROUND(SUM(importo_totale), 2) "
+                f"FROM Fatture WHERE stato != 'Annullata' GROUP BY 1, 2, 3, 4, 5, 6;"
+            )
+        
+        print(f"✓ Riepilogo mensile {rollup_table}")
+    
+    def apply_pragmas(self, cursor):
+        """
+        Applica il profilo PRAGMA definito nella configurazione (sezione 'pragmas')
+        
+        Args:
+            cursor: Cursore SQLite su cui eseguire i PRAGMA
+            
+        Returns:
+            dict: Valori effettivi dei PRAGMA dopo l'applicazione
+        """
+        effective = {}
+        for pragma, value in self.config.get('pragmas', {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value};")
+            cursor.execute(f"PRAGMA {pragma};")
+            row = cursor.fetchone()
+            effective[pragma] = row[0] if row else None
+            print(f"✓ PRAGMA {pragma} = {effective[pragma]}")
+        return effective
+    
     def create_database(self):
         """Crea il database e tutte le tabelle"""
         if not self.config:
@@ -112,24 +551,11 @@ class DatabaseBuilder:
             
             print(f"✓ Database creato: {self.db_path}")
             
-            # Ordine di creazione delle tabelle per rispettare le foreign keys
-            table_order = [
-                'Associati',
-                'ChiaviElettroniche',
-                'TessereFIV',
-                'Fornitori',
-                # Prezzi prima di Servizi per rispettare FK fk_prezzo NOT NULL
-                'PrezziServizi',
-                'Servizi',
-                'Prestazioni',
-                'AssegnazioniServizi',
-                'ErogazioniPrestazioni',
-                'Fatture',
-                'Pagamenti'
-            ]
+            # Profilo di configurazione (WAL, synchronous, cache, mmap...)
+            self.apply_pragmas(cursor)
             
             # Crea le tabelle nell'ordine corretto
-            for table_name in table_order:
+            for table_name in self.TABLE_ORDER:
                 if table_name in self.config['tables']:
                     table_config = self.config['tables'][table_name]
                     sql = self.build_create_table_sql(table_name, table_config)
@@ -142,6 +568,21 @@ class DatabaseBuilder:
                 else:
                     print(f"⚠ Tabella {table_name} non trovata nella configurazione")
             
+            # Crea gli indici secondari
+            self.create_indexes(cursor)
+            
+            # Crea l'indice full-text e i trigger di aggiornamento
+            self.create_search_index(cursor)
+            
+            # Crea le statistiche delle tabelle (conteggi mantenuti da trigger)
+            self.create_table_stats(cursor)
+            
+            # Crea il partitario dei crediti verso i soci
+            self.create_receivables_ledger(cursor)
+            
+            # Crea il riepilogo mensile per fatturato e bilancio
+            self.create_monthly_rollup(cursor)
+            
             # Commit delle modifiche
             conn.commit()
             
@@ -166,6 +607,40 @@ class DatabaseBuilder:
             print(f"✗ Errore generico: {e}")
             return False
     
+    def upgrade_database(self):
+        """Applica a un database esistente il profilo PRAGMA e gli oggetti mancanti (tabelle, indici, ricerca full-text, statistiche, partitario crediti, riepilogo mensile)"""
+        if not self.config:
+            print("✗ Errore: Configurazione non caricata")
+            return False
+        
+        if not self.db_path:
+            self.db_path = self.data_dir / self.config.get('database_name', 'umami.db')
+        
+        if not Path(self.db_path).exists():
+            print(f"✗ Database non trovato per l'aggiornamento: {self.db_path}")
+            return False
+        
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            print(f"✓ Aggiornamento database: {self.db_path}")
+            self.apply_pragmas(cursor)
+            self.create_missing_tables(cursor)
+            self.create_indexes(cursor)
+            self.create_search_index(cursor)
+            self.create_table_stats(cursor)
+            self.create_receivables_ledger(cursor)
+            self.create_monthly_rollup(cursor)
+            
+            conn.commit()
+            conn.close()
+            return True
+            
+        except sqlite3.Error as e:
+            print(f"✗ Errore SQLite: {e}")
+            return False
+    
     def verify_database(self):
         """Verifica l'integrità del database creato"""
         if not self.db_path or not self.db_path.exists():
@@ -190,6 +665,16 @@ class DatabaseBuilder:
             else:
                 print("✓ Foreign keys verificate correttamente")
             
+            # Verifica modalità journal (persistente nel file del database)
+            expected_journal = self.config.get('pragmas', {}).get('journal_mode')
+            if expected_journal:
+                cursor.execute("PRAGMA journal_mode;")
+                journal_mode = cursor.fetchone()[0]
+                if journal_mode.lower() != str(expected_journal).lower():
+                    print(f"✗ journal_mode atteso {expected_journal}, trovato {journal_mode}")
+                    return False
+                print(f"✓ journal_mode: {journal_mode}")
+            
             # Verifica struttura tabelle
             for table_name in self.config['tables'].keys():
                 cursor.execute(f"PRAGMA table_info({table_name});")
@@ -201,6 +686,93 @@ class DatabaseBuilder:
                     print(f"✗ Tabella {table_name} non trovata o vuota")
                     return False
             
+            # Verifica indici secondari
+            for index_name, index_config in self.config.get('indexes', {}).items():
+                cursor.execute(
+                    "SELECT tbl_name FROM sqlite_master WHERE type='index' AND name=?;",
+                    (index_name,)
+                )
+                row = cursor.fetchone()
+                if not row or row[0] != index_config['table']:
+                    print(f"✗ Indice {index_name} non trovato su {index_config['table']}")
+                    return False
+                
+                cursor.execute(f"PRAGMA index_info({index_name});")
+                indexed_columns = [col[2] for col in cursor.fetchall()]
+                expected_columns = [col.split()[0] for col in index_config['columns']]
+                if indexed_columns != expected_columns:
+                    print(f"✗ Indice {index_name}: colonne {indexed_columns}, attese {expected_columns}")
+                    return False
+                
+                print(f"✓ Indice {index_name}: {', '.join(indexed_columns)}")
+            
+            # Verifica indice full-text e relativi trigger
+            search_config = self.config.get('search_index')
+            if search_config:
+                fts_table = search_config['table']
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (fts_table,))
+                if not cursor.fetchone():
+                    print(f"✗ Indice full-text {fts_table} non trovato")
+                    return False
+                
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+                    (f"trg_{fts_table}_%",)
+                )
+                trigger_count = cursor.fetchone()[0]
+                expected_triggers = 3 * len(search_config['sources'])
+                if trigger_count != expected_triggers:
+                    print(f"✗ Indice full-text {fts_table}: {trigger_count} trigger, attesi {expected_triggers}")
+                    return False
+                
+                print(f"✓ Indice full-text {fts_table}: {trigger_count} trigger")
+            
+            # Verifica statistiche delle tabelle e relativi trigger
+            stats_config = self.config.get('table_stats')
+            if stats_config:
+                stats_table = stats_config['table']
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+                    (f"trg_{stats_table}_%",)
+                )
+                trigger_count = cursor.fetchone()[0]
+                expected_triggers = 3 * len([table for table in self.TABLE_ORDER if table in self.config['tables']])
+                if trigger_count != expected_triggers:
+                    print(f"✗ Statistiche {stats_table}: {trigger_count} trigger, attesi {expected_triggers}")
+                    return False
+                
+                print(f"✓ Statistiche {stats_table}: {trigger_count} trigger")
+            
+            # Verifica partitario crediti e relativi trigger
+            ledger_config = self.config.get('receivables_ledger')
+            if ledger_config:
+                ledger = ledger_config['ledger_table']
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+                    (f"trg_{ledger}_%",)
+                )
+                trigger_count = cursor.fetchone()[0]
+                if trigger_count != 6:
+                    print(f"✗ Partitario {ledger}: {trigger_count} trigger, attesi 6")
+                    return False
+                
+                print(f"✓ Partitario {ledger}: {trigger_count} trigger")
+            
+            # Verifica riepilogo mensile e relativi trigger
+            rollup_config = self.config.get('monthly_rollup')
+            if rollup_config:
+                rollup_table = rollup_config['table']
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+                    (f"trg_{rollup_table}_%",)
+                )
+                trigger_count = cursor.fetchone()[0]
+                if trigger_count != 3:
+                    print(f"✗ Riepilogo {rollup_table}: {trigger_count} trigger, attesi 3")
+                    return False
+                
+                print(f"✓ Riepilogo {rollup_table}: {trigger_count} trigger")
+            
             conn.close()
             print("✓ Verifica database completata con successo")
             return True
@@ -223,6 +795,7 @@ class DatabaseBuilder:
                 columns_count = len(table_config['columns'])
                 description = table_config.get('description', 'Nessuna descrizione')
                 print(f"  - {table_name}: {columns_count} colonne - {description}")
+            print(f"Indici configurati: {len(self.config.get('indexes', {}))}")
         
         print("\nPer utilizzare il database:")
         print(f"  sqlite3 {self.db_path}")
@@ -248,8 +821,13 @@ def main():
     # Crea la directory data
     builder.create_data_directory()
     
-    # Crea il database
-    if not builder.create_database():
+    if "--upgrade" in sys.argv[1:]:
+        # Aggiorna il database esistente senza ricrearlo
+        if not builder.upgrade_database():
+            print("✗ Aggiornamento database fallito")
+            sys.exit(1)
+    elif not builder.create_database():
+        # Crea il database
         print("✗ Creazione database fallita")
         sys.exit(1)
     
@@ -46,7 +46,7 @@ class DatabasePopulator:
         """Pulisce tutti i dati dalle tabelle per un nuovo inserimento."""
         print("\nPulizia dati esistenti...")
         tables = [
-            'Pagamenti', 'Fatture', 'ErogazioniPrestazioni',
+            'AccessiChiavi', 'Pagamenti', 'Fatture', 'ErogazioniPrestazioni',
             'AssegnazioniServizi', 'Servizi', 'PrezziServizi', 'Prestazioni',
             'Fornitori', 'TessereFIV', 'ChiaviElettroniche', 'Associati'
         ]
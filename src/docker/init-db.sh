@@ -44,6 +44,19 @@ except Exception as e:
     exit(1)
 "; then
         echo "✓ Database verificato e funzionante"
+        
+        # Applica profilo PRAGMA e indici mancanti senza ricreare il database
+        echo "🔧 Aggiornamento schema (PRAGMA e indici)..."
+        (cd /app/src/database && python3 -c "
+import os
+from db_build import DatabaseBuilder
+
+db_path = os.environ.get('DATABASE_PATH', '/app/data/umami.db')
+builder = DatabaseBuilder(config_file='database_schema.json', data_dir=os.path.dirname(db_path))
+builder.db_path = db_path
+if not (builder.load_config() and builder.upgrade_database()):
+    exit(1)
+") || echo "⚠ Aggiornamento schema non riuscito, il database resta invariato"
     else
         echo "⚠ Database presente ma non valido, rimuovo e ricreo..."
         rm -f "$DATABASE_PATH"
@@ -23,6 +23,15 @@ def _request(method, endpoint, params=None, json=None):
         gr.Warning(f"Errore imprevisto: {str(e)}")
         return None
 
+# --- Ricerca ---
+def search(q, tipi=None, limit=20):
+    params = {'q': q, 'limit': limit}
+    if tipi: params['tipi'] = ",".join(tipi) if isinstance(tipi, (list, tuple)) else tipi
+    data = _request("GET", "/search", params=params)
+    if data and 'results' in data:
+        return pd.DataFrame(data['results'])
+    return pd.DataFrame()
+
 # --- Associati ---
 def get_associati(search="", stato="", tesserato_fiv=None):
     params = {}
@@ -39,8 +48,9 @@ def get_associati(search="", stato="", tesserato_fiv=None):
 def create_erogazione_prestazione(erogazione_data):
     return _request("POST", "/erogazioni-prestazioni", json=erogazione_data)
 
-def get_associato(associato_id):
-    return _request("GET", f"/associati/{associato_id}")
+def get_associato(associato_id, include=None):
+    params = {"include": include} if include is not None else None
+    return _request("GET", f"/associati/{associato_id}", params=params)
 
 def create_associato(associato_data):
     return _request("POST", "/associati", json=associato_data)
@@ -126,10 +136,10 @@ def get_report_soci_morosi(giorni_ritardo=0, importo_minimo=None, solo_conteggio
         return pd.DataFrame(data['results'])
     return pd.DataFrame()
 
-def get_bilancio_economico(anno):
-    """Ottiene i dati per il bilancio economico di un anno specifico"""
-    params = {'anno': anno}
-    data = _request("GET", "/reports/bilancio-economico", params=params)
+def get_bilancio_economico(anno, rebuild=False, top_controparti=10):
+    """Ottiene il bilancio economico di un anno (totali, mesi, categorie e controparti calcolati dal backend)"""
+    params = {'rebuild': rebuild, 'top_controparti': top_controparti}
+    data = _request("GET", f"/report/bilancio/{int(anno)}", params=params)
     return data if data else {}
 
 def get_fatture_per_bilancio(anno, tipo=None):
@@ -223,6 +233,15 @@ def update_fattura(fattura_id, fattura_data):
     return _request("PUT", f"/fatture/{fattura_id}", json=fattura_data)
 
 # --- Pagamenti ---
+def genera_fatture_attive(periodo_inizio, periodo_fine, data_emissione, data_scadenza, dry_run=False):
+    payload = {
+        'periodo_inizio': periodo_inizio,
+        'periodo_fine': periodo_fine,
+        'data_emissione': data_emissione,
+        'data_scadenza': data_scadenza,
+    }
+    return _request("POST", "/fatture/genera-attive", params={'dry_run': dry_run}, json=payload)
+
 def get_pagamenti(metodo="", dal=None, al=None, associato_id=None):
     params = {}
     if metodo: params['metodo'] = metodo
@@ -291,12 +310,14 @@ def get_table_schema(table_name):
     """Ottiene lo schema di una tabella specifica."""
     return _request("GET", f"/admin/tables/{table_name}/schema")
 
-def import_csv_data(table_name, file_path):
-    """Importa dati CSV in una tabella specifica."""
+def import_csv_data(table_name, file_path, mode="insert", conflict_columns=None):
+    """Importa dati CSV in una tabella specifica (mode: insert, ignore, replace, upsert)."""
     try:
+        params = {'mode': mode}
+        if conflict_columns: params['conflict_columns'] = conflict_columns
         with open(file_path, 'rb') as file:
             files = {'file': (os.path.basename(file_path), file, 'text/csv')}
-            response = requests.post(f"{BASE_URL}/admin/import/{table_name}", files=files)
+            response = requests.post(f"{BASE_URL}/admin/import/{table_name}", params=params, files=files)
             response.raise_for_status()
             return response.json()
     except requests.exceptions.RequestException as e:
@@ -272,17 +272,16 @@ def scheda_associato_ui():
                 return [""] * 19 + [gr.update(visible=False), pd.DataFrame(), gr.update(visible=False), pd.DataFrame()]
             
             # Dati anagrafici (inclusi i nuovi campi)
-            # Gestione associato di riferimento
+            # Gestione associato di riferimento (sezione 'riferimento' del profilo)
             associato_rif_text = ""
             fk_associato_rif = safe_get(data, 'fk_associato_riferimento')
             if fk_associato_rif:
-                try:
-                    rif_data = api_client.get_associato(fk_associato_rif)
-                    if rif_data:
-                        nome_rif = safe_get(rif_data, 'nome', '')
-                        cognome_rif = safe_get(rif_data, 'cognome', '')
-                        associato_rif_text = f"{nome_rif} {cognome_rif} (ID: {fk_associato_rif})".strip()
-                except:
+                rif_data = data.get('riferimento')
+                if rif_data:
+                    nome_rif = safe_get(rif_data, 'nome', '')
+                    cognome_rif = safe_get(rif_data, 'cognome', '')
+                    associato_rif_text = f"{nome_rif} {cognome_rif} (ID: {fk_associato_rif})".strip()
+                else:
                     associato_rif_text = f"ID: {fk_associato_rif}"
             
             anagrafica = [
@@ -349,9 +348,9 @@ def scheda_associato_ui():
                 safe_get(chiave_data, 'data_riconsegna', '')
             ]
             
-            # Carica fatture dell'associato
+            # Fatture e pagamenti arrivano nello stesso profilo dell'associato
             try:
-                fatture_df = api_client.get_fatture(associato_id=int(aid))
+                fatture_df = pd.DataFrame(data.get('fatture') or [])
                 if len(fatture_df) == 0:
                     fatture_df = pd.DataFrame(columns=["ID", "Numero", "Data", "Tipo", "Importo", "Stato"])
                 else:
@@ -375,9 +374,8 @@ def scheda_associato_ui():
                 print(f"Errore caricamento fatture: {e}")
                 fatture_df = pd.DataFrame(columns=["ID", "Numero", "Data", "Tipo", "Importo", "Stato"])
             
-            # Carica pagamenti dell'associato
             try:
-                pagamenti_df = api_client.get_pagamenti(associato_id=int(aid))
+                pagamenti_df = pd.DataFrame(data.get('pagamenti') or [])
                 if len(pagamenti_df) == 0:
                     pagamenti_df = pd.DataFrame(columns=["ID", "Data", "Importo", "Metodo", "Note"])
                 else:
@@ -1122,7 +1120,8 @@ def scheda_servizio_ui():
             gr.Warning("Inserisci un ID associato")
             return "", ""
         try:
-            data = api_client.get_associato(int(aid))
+            # Basta l'anagrafica: nessuna sezione del profilo
+            data = api_client.get_associato(int(aid), include="")
             if not data:
                 gr.Warning("Associato non trovato")
                 return "", ""
@@ -1748,222 +1747,6 @@ def create_report_section():
         with gr.TabItem("⚠️ Soci Morosi"):
             soci_morosi_ui()
 
-def bilancio_economico_ui():
-    """Report bilancio economico"""
-    gr.Markdown("### 📊 Bilancio Economico")
-    
-    with gr.Row():
-        anno = gr.Number(label="Anno", value=datetime.now().year, precision=0)
-        genera_btn = gr.Button("📈 Genera Bilancio", variant="primary")
-        scarica_pdf_btn = gr.Button("📄 Scarica PDF", variant="secondary")
-    
-    bilancio_summary = gr.HTML()
-    bilancio_state = gr.State({})
-    pdf_file = gr.File(label="Bilancio PDF", interactive=False, visible=False)
-    
-    def _fmt_euro(v):
-        try:
-            return format_currency(float(v))
-        except Exception:
-            return format_currency(0)
-    
-    def _month_name(m):
-        mesi = ["Gen", "Feb", "Mar", "Apr", "Mag", "Giu", "Lug", "Ago", "Set", "Ott", "Nov", "Dic"]
-        return mesi[m-1] if 1 <= m <= 12 else str(m)
-    
-    def genera_bilancio(anno_val):
-        try:
-            year = int(anno_val)
-        except Exception:
-            gr.Warning("Anno non valido")
-            return gr.update(), {}
-        dal = date(year, 1, 1)
-        al = date(year, 12, 31)
-        df = api_client.get_pagamenti(dal=dal, al=al)
-        if df is None or df.empty:
-            html = f"""
-            <div style='padding:16px;background:#fff3cd;border:1px solid #ffeeba;border-radius:8px;'>
-                <h3>Bilancio {year}</h3>
-                <p>Nessun movimento trovato per l'anno selezionato.</p>
-            </div>
-            """
-            return html, {"anno": year, "tables": {}, "totals": {}}
-        # Normalizza colonne attese
-        cols = {c.lower(): c for c in df.columns}
-        def col(name): return cols.get(name, name)
-        # Split Entrate/Uscite
-        entrate = df[df[col('tipo')] == 'Entrata'].copy() if col('tipo') in df.columns else pd.DataFrame()
-        uscite = df[df[col('tipo')] == 'Uscita'].copy() if col('tipo') in df.columns else pd.DataFrame()
-        # Totali
-        tot_entrate = float(entrate[col('importo')].sum()) if not entrate.empty else 0.0
-        tot_uscite = float(uscite[col('importo')].sum()) if not uscite.empty else 0.0
-        saldo = tot_entrate - tot_uscite
-        # Per metodo
-        def agg_by(colname, frame):
-            if frame.empty or col(colname) not in frame.columns:
-                return pd.DataFrame(columns=[colname, 'importo']).astype({colname: 'object', 'importo': 'float'})
-            return frame.groupby(col(colname), dropna=False)[col('importo')].sum().reset_index().rename(columns={col(colname): colname, col('importo'): 'importo'}).sort_values('importo', ascending=False)
-        entrate_by_metodo = agg_by('metodo', entrate)
-        uscite_by_metodo = agg_by('metodo', uscite)
-        # Mensile
-        if col('data_pagamento') in df.columns:
-            df['_mese'] = pd.to_datetime(df[col('data_pagamento')]).dt.month
-            mensile = df.groupby(['_mese', col('tipo')])[col('importo')].sum().reset_index()
-        else:
-            mensile = pd.DataFrame(columns=['_mese', 'tipo', 'importo'])
-        # Top controparti
-        cont_col = col('cliente_fornitore') if col('cliente_fornitore') in df.columns else None
-        def top_by_counterparty(frame, n=10):
-            if frame.empty or not cont_col:
-                return pd.DataFrame(columns=['cliente_fornitore', 'importo'])
-            return frame.groupby(cont_col)[col('importo')].sum().reset_index().rename(columns={cont_col: 'cliente_fornitore', col('importo'): 'importo'}).sort_values('importo', ascending=False).head(n)
-        top_entrate = top_by_counterparty(entrate)
-        top_uscite = top_by_counterparty(uscite)
-        # HTML rendering
-        def df_to_html_table(df_in, title):
-            if df_in is None or df_in.empty:
-                return f"<h4 style='margin-top:16px'>{title}</h4><p>Nessun dato</p>"
-            rows = "".join(
-                f"<tr><td>{str(r[0])}</td><td style='text-align:right'>{_fmt_euro(r[1])}</td></tr>" for r in df_in.values
-            )
-            return f"""
-            <h4 style='margin-top:16px'>{title}</h4>
-            <table style='width:100%;border-collapse:collapse'>
-                <thead>
-                    <tr style='background:#f8f9fa'>
-                        <th style='text-align:left;padding:6px;border-bottom:1px solid #dee2e6'>Voce</th>
-                        <th style='text-align:right;padding:6px;border-bottom:1px solid #dee2e6'>Importo</th>
-                    </tr>
-                </thead>
-                <tbody>{rows}</tbody>
-            </table>
-            """
-        # Mensile HTML
-        if not mensile.empty:
-            mensile_pivot = mensile.pivot(index='_mese', columns=col('tipo'), values=col('importo')).fillna(0)
-            mensile_pivot = mensile_pivot.rename_axis(None, axis=1).reset_index()
-            mensile_rows = "".join(
-                f"<tr><td>{_month_name(int(r['_mese']))}</td>" +
-                f"<td style='text-align:right'>{_fmt_euro(r.get('Entrata',0))}</td>" +
-                f"<td style='text-align:right'>{_fmt_euro(r.get('Uscita',0))}</td>" +
-                f"<td style='text-align:right'>{_fmt_euro(r.get('Entrata',0)-r.get('Uscita',0))}</td></tr>"
-                for _, r in mensile_pivot.iterrows()
-            )
-            mensile_html = f"""
-            <h4 style='margin-top:16px'>Andamento Mensile</h4>
-            <table style='width:100%;border-collapse:collapse'>
-                <thead>
-                    <tr style='background:#f8f9fa'>
-                        <th style='text-align:left;padding:6px;border-bottom:1px solid #dee2e6'>Mese</th>
-                        <th style='text-align:right;padding:6px;border-bottom:1px solid #dee2e6'>Entrate</th>
-                        <th style='text-align:right;padding:6px;border-bottom:1px solid #dee2e6'>Uscite</th>
-                        <th style='text-align:right;padding:6px;border-bottom:1px solid #dee2e6'>Saldo</th>
-                    </tr>
-                </thead>
-                <tbody>{mensile_rows}</tbody>
-            </table>
-            """
-        else:
-            mensile_html = ""
-        header_html = f"""
-        <div style='padding: 20px; background: #ffffff; border:1px solid #e9ecef; border-radius: 10px;'>
-            <h3 style='margin-top:0'>Bilancio {year}</h3>
-            <div style='display:flex;gap:24px;flex-wrap:wrap'>
-                <div style='flex:1;min-width:220px;background:#f8fafc;padding:12px;border-radius:8px;border:1px solid #e2e8f0'>
-                    <div style='color:#64748b;font-size:12px'>Totale Entrate</div>
-                    <div style='font-size:20px;font-weight:600;color:#16a34a'>{_fmt_euro(tot_entrate)}</div>
-                </div>
-                <div style='flex:1;min-width:220px;background:#f8fafc;padding:12px;border-radius:8px;border:1px solid #e2e8f0'>
-                    <div style='color:#64748b;font-size:12px'>Totale Uscite</div>
-                    <div style='font-size:20px;font-weight:600;color:#dc2626'>{_fmt_euro(tot_uscite)}</div>
-                </div>
-                <div style='flex:1;min-width:220px;background:#f8fafc;padding:12px;border-radius:8px;border:1px solid #e2e8f0'>
-                    <div style='color:#64748b;font-size:12px'>Saldo Netto</div>
-                    <div style='font-size:20px;font-weight:600;color:{('#16a34a' if saldo>=0 else '#dc2626')}'>{_fmt_euro(saldo)}</div>
-                </div>
-            </div>
-        </div>
-        """
-        html = (
-            header_html +
-            df_to_html_table(entrate_by_metodo, "Entrate per Metodo") +
-            df_to_html_table(uscite_by_metodo, "Uscite per Metodo") +
-            mensile_html +
-            df_to_html_table(top_entrate, "Top 10 Controparti (Entrate)") +
-            df_to_html_table(top_uscite, "Top 10 Controparti (Uscite)")
-        )
-        state = {
-            "anno": year,
-            "tot_entrate": tot_entrate,
-            "tot_uscite": tot_uscite,
-            "saldo": saldo,
-            "entrate_by_metodo": entrate_by_metodo.to_dict(orient='records'),
-            "uscite_by_metodo": uscite_by_metodo.to_dict(orient='records'),
-            "top_entrate": top_entrate.to_dict(orient='records'),
-            "top_uscite": top_uscite.to_dict(orient='records'),
-            "mensile": mensile.to_dict(orient='records'),
-        }
-        return html, state
-    
-    def scarica_pdf(state):
-        try:
-            from reportlab.lib.pagesizes import A4
-            from reportlab.lib import colors
-            from reportlab.lib.styles import getSampleStyleSheet
-            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-            from reportlab.lib.units import cm
-        except Exception:
-            gr.Warning("Per l'esportazione in PDF installa il pacchetto 'reportlab' (es: uv add reportlab)")
-            return gr.update(visible=False)
-        if not state or not isinstance(state, dict):
-            gr.Warning("Genera prima il bilancio")
-            return gr.update(visible=False)
-        anno = state.get('anno')
-        fn = f"bilancio_{anno}.pdf"
-        out_path = f"/tmp/{fn}"
-        doc = SimpleDocTemplate(out_path, pagesize=A4, rightMargin=24, leftMargin=24, topMargin=24, bottomMargin=24)
-        styles = getSampleStyleSheet()
-        elems = []
-        elems.append(Paragraph(f"Bilancio {anno}", styles['Title']))
-        elems.append(Spacer(1, 0.3*cm))
-        # Totali
-        tot_tbl = [["Totale Entrate", _fmt_euro(state.get('tot_entrate',0))],
-                   ["Totale Uscite", _fmt_euro(state.get('tot_uscite',0))],
-                   ["Saldo Netto", _fmt_euro(state.get('saldo',0))]]
-        t = Table(tot_tbl, colWidths=[8*cm, 6*cm])
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.whitesmoke),
-            ('GRID', (0,0), (-1,-1), 0.25, colors.gray),
-            ('ALIGN', (1,0), (1,-1), 'RIGHT'),
-        ]))
-        elems.append(t)
-        elems.append(Spacer(1, 0.4*cm))
-        # Helper to add tables
-        def add_table(title, records):
-            elems.append(Paragraph(title, styles['Heading3']))
-            if not records:
-                elems.append(Paragraph("Nessun dato", styles['Normal']))
-                return
-            data = [["Voce", "Importo"]] + [[r.get('metodo') or r.get('cliente_fornitore') or '—', _fmt_euro(r.get('importo',0))] for r in records]
-            tbl = Table(data, colWidths=[8*cm, 6*cm])
-            tbl.setStyle(TableStyle([
-                ('GRID', (0,0), (-1,-1), 0.25, colors.gray),
-                ('BACKGROUND', (0,0), (-1,0), colors.whitesmoke),
-                ('ALIGN', (1,1), (1,-1), 'RIGHT'),
-            ]))
-            elems.append(tbl)
-            elems.append(Spacer(1, 0.3*cm))
-        add_table("Entrate per Metodo", state.get('entrate_by_metodo'))
-        add_table("Uscite per Metodo", state.get('uscite_by_metodo'))
-        add_table("Top 10 Controparti (Entrate)", state.get('top_entrate'))
-        add_table("Top 10 Controparti (Uscite)", state.get('top_uscite'))
-        # Build
-        doc.build(elems)
-        return gr.update(value=out_path, visible=True)
-    
-    genera_btn.click(genera_bilancio, [anno], [bilancio_summary, bilancio_state])
-    scarica_pdf_btn.click(scarica_pdf, [bilancio_state], [pdf_file])
-
 def soci_morosi_ui():
     """Report soci morosi"""
     gr.Markdown("### ⚠️ Soci Morosi")
@@ -1994,17 +1777,11 @@ def create_empty_bilancio_response():
         "",  # totale_uscite
         "",  # risultato
         "",  # margine
-        empty_df,  # entrate_quote
-        empty_df,  # entrate_servizi
-        empty_df,  # entrate_prestazioni
-        empty_df,  # entrate_altre
-        empty_df,  # uscite_operative
-        empty_df,  # uscite_fornitori
-        empty_df,  # uscite_manutenzioni
-        empty_df,  # uscite_altre
-        empty_df,  # andamento_mensile
+        empty_df,  # entrate_categorie
         empty_df,  # top_entrate
+        empty_df,  # uscite_categorie
         empty_df,  # top_uscite
+        empty_df,  # andamento_mensile
         gr.update(visible=False)  # scarica_pdf_btn
     ]
 
@@ -2035,142 +1812,92 @@ def bilancio_economico_ui():
     gr.Markdown("#### 💰 **ENTRATE**")
     with gr.Row():
         with gr.Column():
-            gr.Markdown("**Quote Associative**")
-            entrate_quote = gr.DataFrame(interactive=False, headers=["Categoria", "Importo", "%"])
-        with gr.Column():
-            gr.Markdown("**Servizi Fisici**")
-            entrate_servizi = gr.DataFrame(interactive=False, headers=["Servizio", "Importo", "%"])
-    
-    with gr.Row():
-        with gr.Column():
-            gr.Markdown("**Prestazioni/Corsi**")
-            entrate_prestazioni = gr.DataFrame(interactive=False, headers=["Prestazione", "Importo", "%"])
+            gr.Markdown("**Per Categoria**")
+            entrate_categorie = gr.DataFrame(interactive=False, headers=["Categoria", "Gruppo", "Settore", "Importo", "%"])
         with gr.Column():
-            gr.Markdown("**Altre Entrate**")
-            entrate_altre = gr.DataFrame(interactive=False, headers=["Descrizione", "Importo", "%"])
+            gr.Markdown("**Principali Soci**")
+            top_entrate = gr.DataFrame(interactive=False, headers=["Controparte", "Fatture", "Importo"])
     
     # Dettagli Uscite
     gr.Markdown("#### 💸 **USCITE**")
     with gr.Row():
         with gr.Column():
-            gr.Markdown("**Costi Operativi**")
-            uscite_operative = gr.DataFrame(interactive=False, headers=["Categoria", "Importo", "%"])
+            gr.Markdown("**Per Categoria**")
+            uscite_categorie = gr.DataFrame(interactive=False, headers=["Categoria", "Gruppo", "Settore", "Importo", "%"])
         with gr.Column():
-            gr.Markdown("**Fornitori**")
-            uscite_fornitori = gr.DataFrame(interactive=False, headers=["Fornitore", "Importo", "%"])
-    
-    with gr.Row():
-        with gr.Column():
-            gr.Markdown("**Manutenzioni**")
-            uscite_manutenzioni = gr.DataFrame(interactive=False, headers=["Descrizione", "Importo", "%"])
-        with gr.Column():
-            gr.Markdown("**Altre Uscite**")
-            uscite_altre = gr.DataFrame(interactive=False, headers=["Descrizione", "Importo", "%"])
+            gr.Markdown("**Principali Fornitori**")
+            top_uscite = gr.DataFrame(interactive=False, headers=["Controparte", "Fatture", "Importo"])
     
     # Analisi Temporale
     gr.Markdown("#### 📅 **ANALISI TEMPORALE**")
-    with gr.Row():
-        with gr.Column():
-            andamento_mensile = gr.DataFrame(interactive=False, headers=["Mese", "Entrate", "Uscite", "Saldo"])
-        with gr.Column():
-            top_entrate = gr.DataFrame(interactive=False, headers=["Controparte", "Importo"])
-            top_uscite = gr.DataFrame(interactive=False, headers=["Controparte", "Importo"])
+    andamento_mensile = gr.DataFrame(interactive=False, headers=["Mese", "Entrate", "Uscite", "Saldo"])
     
     # File PDF per download
     pdf_file = gr.File(visible=False, label="Bilancio PDF")
     
     def genera_bilancio(anno_val):
-        """Genera il bilancio economico per l'anno specificato"""
+        """Genera il bilancio economico per l'anno specificato (aggregazioni calcolate dal backend)"""
         try:
             if not anno_val or anno_val < 2020 or anno_val > datetime.now().year + 1:
                 gr.Warning("Inserire un anno valido")
                 return create_empty_bilancio_response()
             
-            # Ottieni fatture per l'anno (usa API esistente)
-            fatture_df = api_client.get_fatture()  # Ottieni tutte le fatture
-            
-            # Filtra per anno se ci sono dati
-            if len(fatture_df) > 0:
-                # Prova a filtrare per anno se esiste una colonna data
-                if 'data_emissione' in fatture_df.columns:
-                    fatture_df['anno'] = pd.to_datetime(fatture_df['data_emissione'], errors='coerce').dt.year
-                    fatture_df = fatture_df[fatture_df['anno'] == int(anno_val)]
-                elif 'data' in fatture_df.columns:
-                    fatture_df['anno'] = pd.to_datetime(fatture_df['data'], errors='coerce').dt.year
-                    fatture_df = fatture_df[fatture_df['anno'] == int(anno_val)]
+            bilancio = api_client.get_bilancio_economico(int(anno_val))
+            if not bilancio:
+                return create_empty_bilancio_response()
             
-            if len(fatture_df) == 0:
+            totali = bilancio['totali']
+            if totali['Attiva']['numero_fatture'] == 0 and totali['Passiva']['numero_fatture'] == 0:
                 gr.Warning(f"Nessun dato trovato per l'anno {int(anno_val)}")
                 return create_empty_bilancio_response()
             
-            # Calcola totali con gestione sicura delle colonne
-            entrate_totale = 0
-            uscite_totale = 0
+            entrate_totale = totali['Attiva']['totale']
+            uscite_totale = totali['Passiva']['totale']
+            risultato_val = bilancio['risultato']
+            margine_val = (risultato_val / entrate_totale * 100) if entrate_totale > 0 else 0
             
-            if len(fatture_df) > 0 and 'importo' in fatture_df.columns and 'tipo' in fatture_df.columns:
-                entrate_totale = fatture_df[fatture_df['tipo'] == 'Attiva']['importo'].sum()
-                uscite_totale = fatture_df[fatture_df['tipo'] == 'Passiva']['importo'].sum()
+            def categorie_data(tipo, totale):
+                return [
+                    [voce['categoria'] or "Non classificata", voce['gruppo'] or "—", voce['settore'] or "—",
+                     f"€ {voce['totale']:,.2f}", f"{(voce['totale'] / totale * 100) if totale else 0:.1f}%"]
+                    for voce in bilancio['per_categoria'] if voce['tipo_fattura'] == tipo
+                ]
             
-            risultato_val = entrate_totale - uscite_totale
-            margine_val = (risultato_val / entrate_totale * 100) if entrate_totale > 0 else 0
+            def controparti_data(tipo):
+                return [
+                    [voce['controparte'], voce['numero_fatture'], f"€ {voce['totale']:,.2f}"]
+                    for voce in bilancio['controparti'][tipo]
+                ]
+            
+            nomi_mesi = ["Gen", "Feb", "Mar", "Apr", "Mag", "Giu", "Lug", "Ago", "Set", "Ott", "Nov", "Dic"]
+            andamento_data = []
+            for voce in bilancio['mensile']:
+                entrate_mese = voce['Attiva']['totale']
+                uscite_mese = voce['Passiva']['totale']
+                andamento_data.append([nomi_mesi[voce['mese'] - 1], f"€ {entrate_mese:,.2f}",
+                                       f"€ {uscite_mese:,.2f}", f"€ {entrate_mese - uscite_mese:,.2f}"])
             
-            # Prepara dati per le tabelle
             state = {
-                'anno': anno_val,
+                'anno': int(anno_val),
                 'entrate_totale': entrate_totale,
                 'uscite_totale': uscite_totale,
                 'risultato': risultato_val,
-                'margine': margine_val
+                'margine': margine_val,
+                'per_categoria': bilancio['per_categoria'],
+                'controparti': bilancio['controparti']
             }
             
-            # Crea dati semplificati per le tabelle
-            entrate_quote_data = [["Quote Associative", f"€ {entrate_totale * 0.6:,.2f}", "60.0%"]] if entrate_totale > 0 else []
-            entrate_servizi_data = [["Servizi Fisici", f"€ {entrate_totale * 0.3:,.2f}", "30.0%"]] if entrate_totale > 0 else []
-            entrate_prestazioni_data = [["Corsi e Prestazioni", f"€ {entrate_totale * 0.1:,.2f}", "10.0%"]] if entrate_totale > 0 else []
-            entrate_altre_data = []
-            
-            uscite_operative_data = [["Costi Operativi", f"€ {uscite_totale * 0.4:,.2f}", "40.0%"]] if uscite_totale > 0 else []
-            uscite_fornitori_data = [["Fornitori", f"€ {uscite_totale * 0.3:,.2f}", "30.0%"]] if uscite_totale > 0 else []
-            uscite_manutenzioni_data = [["Manutenzioni", f"€ {uscite_totale * 0.3:,.2f}", "30.0%"]] if uscite_totale > 0 else []
-            uscite_altre_data = []
-            
-            # Andamento mensile semplificato
-            andamento_data = []
-            for mese in range(1, 13):
-                nome_mese = ["Gen", "Feb", "Mar", "Apr", "Mag", "Giu", 
-                           "Lug", "Ago", "Set", "Ott", "Nov", "Dic"][mese-1]
-                entrate_mese = entrate_totale / 12
-                uscite_mese = uscite_totale / 12
-                saldo_mese = entrate_mese - uscite_mese
-                andamento_data.append([nome_mese, f"€ {entrate_mese:,.2f}", 
-                                     f"€ {uscite_mese:,.2f}", f"€ {saldo_mese:,.2f}"])
-            
-            # Top controparti
-            top_entrate_data = [["Soci", f"€ {entrate_totale * 0.7:,.2f}"], 
-                              ["Corsi", f"€ {entrate_totale * 0.2:,.2f}"],
-                              ["Altri", f"€ {entrate_totale * 0.1:,.2f}"]]
-            
-            top_uscite_data = [["Fornitori", f"€ {uscite_totale * 0.4:,.2f}"],
-                             ["Utenze", f"€ {uscite_totale * 0.3:,.2f}"],
-                             ["Manutenzioni", f"€ {uscite_totale * 0.3:,.2f}"]]
-            
             return [
                 state,  # bilancio_state
                 f"€ {entrate_totale:,.2f}",  # totale_entrate
                 f"€ {uscite_totale:,.2f}",  # totale_uscite
                 f"€ {risultato_val:,.2f}",  # risultato
                 f"{margine_val:.1f}%",  # margine
-                pd.DataFrame(entrate_quote_data, columns=["Categoria", "Importo", "%"]),
-                pd.DataFrame(entrate_servizi_data, columns=["Servizio", "Importo", "%"]),
-                pd.DataFrame(entrate_prestazioni_data, columns=["Prestazione", "Importo", "%"]),
-                pd.DataFrame(entrate_altre_data, columns=["Descrizione", "Importo", "%"]),
-                pd.DataFrame(uscite_operative_data, columns=["Categoria", "Importo", "%"]),
-                pd.DataFrame(uscite_fornitori_data, columns=["Fornitore", "Importo", "%"]),
-                pd.DataFrame(uscite_manutenzioni_data, columns=["Descrizione", "Importo", "%"]),
-                pd.DataFrame(uscite_altre_data, columns=["Descrizione", "Importo", "%"]),
+                pd.DataFrame(categorie_data('Attiva', entrate_totale), columns=["Categoria", "Gruppo", "Settore", "Importo", "%"]),
+                pd.DataFrame(controparti_data('Attiva'), columns=["Controparte", "Fatture", "Importo"]),
+                pd.DataFrame(categorie_data('Passiva', uscite_totale), columns=["Categoria", "Gruppo", "Settore", "Importo", "%"]),
+                pd.DataFrame(controparti_data('Passiva'), columns=["Controparte", "Fatture", "Importo"]),
                 pd.DataFrame(andamento_data, columns=["Mese", "Entrate", "Uscite", "Saldo"]),
-                pd.DataFrame(top_entrate_data, columns=["Controparte", "Importo"]),
-                pd.DataFrame(top_uscite_data, columns=["Controparte", "Importo"]),
                 gr.update(visible=True)  # scarica_pdf_btn
             ]
             
@@ -2208,6 +1935,13 @@ def bilancio_economico_ui():
             else:
                 temp_file.write("❌ Risultato NEGATIVO\n")
             
+            for tipo, titolo in (('Attiva', "ENTRATE"), ('Passiva', "USCITE")):
+                temp_file.write(f"\n{titolo} PER CATEGORIA:\n")
+                for voce in state.get('per_categoria', []):
+                    if voce['tipo_fattura'] == tipo:
+                        nome = " / ".join(v for v in (voce['categoria'], voce['gruppo'], voce['settore']) if v) or "Non classificata"
+                        temp_file.write(f"  {nome}: € {voce['totale']:,.2f}\n")
+            
             temp_file.write("\n" + "=" * 50 + "\n")
             temp_file.write("Generato il: " + datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
             
@@ -2220,10 +1954,8 @@ def bilancio_economico_ui():
             return gr.update(visible=False)
     
     genera_btn.click(genera_bilancio, [anno], [bilancio_state, totale_entrate, totale_uscite, 
-                                             risultato, margine, entrate_quote, entrate_servizi,
-                                             entrate_prestazioni, entrate_altre, uscite_operative,
-                                             uscite_fornitori, uscite_manutenzioni, uscite_altre,
-                                             andamento_mensile, top_entrate, top_uscite, scarica_pdf_btn])
+                                             risultato, margine, entrate_categorie, top_entrate,
+                                             uscite_categorie, top_uscite, andamento_mensile, scarica_pdf_btn])
     scarica_pdf_btn.click(scarica_pdf, [bilancio_state], [pdf_file])
 
 # ===== IMPOSTAZIONI SECTION =====
@@ -2416,6 +2148,8 @@ def create_impostazioni_section():
                         message = f"✅ **Importazione Completata**\n\n"
                         message += f"**Tabella:** {tabella}\n"
                         message += f"**Righe importate:** {result['imported_rows']}\n"
+                        if result.get('rows_per_second'):
+                            message += f"**Velocità:** {result['rows_per_second']:.0f} righe/s in {result.get('duration_seconds', 0):.1f} s\n"
                         message += f"**Messaggio:** {result['message']}"
                         
                         dettagli = ""
@@ -0,0 +1,59 @@
+"""
+Fixture pytest per l'API UMAMI.
+
+Il database di test viene creato una volta per sessione con DatabaseBuilder e
+popolato con i dati di db_test.py; ogni test lavora su una copia. Il monitor dei
+budget di query è in modalità strict: una rotta che supera il proprio budget di
+statement SQL fa fallire il test con QueryBudgetExceeded. La manutenzione
+periodica degli stati è disattivata: i test la eseguono esplicitamente.
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "backend"))
+sys.path.insert(0, str(ROOT / "src" / "database"))
+
+import fastapi_builder
+from db_build import DatabaseBuilder
+from db_test import DatabasePopulator
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def dataset_db(tmp_path_factory):
+    """Database creato dallo schema e popolato con il dataset di db_test.py"""
+    data_dir = tmp_path_factory.mktemp("data")
+    builder = DatabaseBuilder(data_dir=str(data_dir))
+    assert builder.load_config()
+    builder.create_data_directory()
+    assert builder.create_database()
+    
+    populator = DatabasePopulator()
+    populator.db_path = data_dir / "umami.db"
+    populator.run()
+    return data_dir / "umami.db"
+
+
+@pytest.fixture
+def api(dataset_db, tmp_path, monkeypatch):
+    """TestClient su una copia del dataset, con il budget di query in modalità strict"""
+    db_path = tmp_path / "umami.db"
+    shutil.copy2(dataset_db, db_path)
+    
+    pool = fastapi_builder.ConnectionPool(db_path)
+    monkeypatch.setattr(fastapi_builder, "DB_PATH", db_path)
+    monkeypatch.setattr(fastapi_builder, "BACKUP_DIR", tmp_path / "backups")
+    monkeypatch.setattr(fastapi_builder, "db_pool", pool)
+    monkeypatch.setattr(fastapi_builder.query_budget, "strict", True)
+    monkeypatch.setattr(fastapi_builder, "STATUS_SWEEP_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(fastapi_builder, "status_maintenance", fastapi_builder.StatusMaintenance())
+    fastapi_builder.query_budget.reset()
+    
+    with TestClient(fastapi_builder.app) as client:
+        yield client
+    pool.dispose()
@@ -0,0 +1,86 @@
+"""Eventi dei lettori di chiavi elettroniche sul dataset di db_test.py"""
+
+
+def test_docce_non_portano_il_credito_sotto_zero(api):
+    credito = api.get("/associati/1/chiave-elettronica").json()["credito"]
+    eventi = [{"key_code": "KEY001", "varco": "DOCCIA-1", "tipo": "Doccia", "costo": 4.0}] * 10
+    
+    risposta = api.post("/chiavi/accessi", json={"eventi": eventi}).json()
+    
+    addebitati = int(credito // 4.0)
+    assert risposta["consentiti"] == addebitati
+    assert {r["motivo"] for r in risposta["risultati"][addebitati:]} == {"Credito insufficiente"}
+    assert api.get("/associati/1/chiave-elettronica").json()["credito"] == round(credito - 4.0 * addebitati, 2)
+
+
+def test_eventi_negati_finiscono_nel_registro(api):
+    risposta = api.post("/chiavi/accessi", json={"eventi": [{"key_code": "SCONOSCIUTA", "varco": "INGRESSO"}]}).json()
+    assert risposta["risultati"][0]["motivo"] == "Chiave sconosciuta"
+    
+    registro = api.get("/chiavi/accessi", params={"esito": "Negato"}).json()
+    assert registro["results"][0]["key_code"] == "SCONOSCIUTA"
+
+
+def test_snapshot_segue_le_modifiche_delle_chiavi(api):
+    snapshot = api.get("/chiavi/snapshot")
+    etag = snapshot.headers["etag"]
+    assert api.get("/chiavi/snapshot", headers={"If-None-Match": etag}).status_code == 304
+    
+    api.post("/associati/1/chiave-elettronica", json={"key_code": "KEY001-BIS", "in_regola": False, "credito": 0})
+    
+    aggiornato = api.get("/chiavi/snapshot", headers={"If-None-Match": etag})
+    assert aggiornato.status_code == 200
+    chiavi = {chiave["key_code"]: chiave for chiave in aggiornato.json()["chiavi"]}
+    assert "KEY001" not in chiavi
+    assert chiavi["KEY001-BIS"]["in_regola"] is False
+    
+    porta = api.post("/chiavi/accessi", json={"eventi": [{"key_code": "KEY001", "varco": "INGRESSO"}]}).json()
+    assert porta["risultati"][0]["motivo"] == "Chiave sconosciuta"
+
+
+def test_socio_non_attivo_negato(api):
+    credito = api.get("/associati/1/chiave-elettronica").json()["credito"]
+    api.put("/associati/1", json={"stato_associato": "Sospeso"})
+    
+    eventi = [
+        {"key_code": "KEY001", "varco": "INGRESSO", "tipo": "Porta"},
+        {"key_code": "KEY001", "varco": "DOCCIA-1", "tipo": "Doccia"},
+    ]
+    risposta = api.post("/chiavi/accessi", json={"eventi": eventi}).json()
+    
+    assert risposta["consentiti"] == 0
+    assert {r["motivo"] for r in risposta["risultati"]} == {"Socio Sospeso"}
+    assert api.get("/associati/1/chiave-elettronica").json()["credito"] == credito
+    chiavi = {c["key_code"]: c for c in api.get("/chiavi/snapshot").json()["chiavi"]}
+    assert chiavi["KEY001"]["autorizzata"] is False and chiavi["KEY003"]["autorizzata"] is True
+
+
+def test_socio_scaduto_dalla_manutenzione_negato(api):
+    porta = {"eventi": [{"key_code": "KEY003", "varco": "INGRESSO", "tipo": "Porta"}]}
+    assert api.post("/chiavi/accessi", json=porta).json()["consentiti"] == 1
+    
+    api.post("/associati/3/tesseramento-fiv", json={
+        "numero_tessera_fiv": "FIV67890", "scadenza_tesseramento_fiv": "2020-01-01", "scadenza_certificato_medico": "2020-01-01",
+    })
+    api.post("/admin/manutenzione-stati")
+    
+    assert api.post("/chiavi/accessi", json=porta).json()["risultati"][0]["motivo"] == "Socio Scaduto"
+
+
+def test_tessera_fiv_scaduta_negata_prima_della_manutenzione(api):
+    credito = api.get("/associati/3/chiave-elettronica").json()["credito"]
+    api.post("/associati/3/tesseramento-fiv", json={
+        "numero_tessera_fiv": "FIV67890", "scadenza_tesseramento_fiv": "2020-01-01", "scadenza_certificato_medico": "2030-01-01",
+    })
+    
+    eventi = [
+        {"key_code": "KEY003", "varco": "INGRESSO", "tipo": "Porta"},
+        {"key_code": "KEY003", "varco": "DOCCIA-1", "tipo": "Doccia"},
+    ]
+    risposta = api.post("/chiavi/accessi", json={"eventi": eventi}).json()
+    
+    assert risposta["consentiti"] == 0
+    assert {r["motivo"] for r in risposta["risultati"]} == {"Tessera FIV scaduta"}
+    assert api.get("/associati/3/chiave-elettronica").json()["credito"] == credito
+    chiavi = {c["key_code"]: c for c in api.get("/chiavi/snapshot").json()["chiavi"]}
+    assert chiavi["KEY003"]["autorizzata"] is False
@@ -0,0 +1,70 @@
+"""Backup incrementali e ripristino del database sul dataset di db_test.py"""
+
+import sqlite3
+
+import fastapi_builder
+
+
+def _nome(api, associato_id=1):
+    return api.get(f"/associati/{associato_id}", params={"include": ""}).json()["nome"]
+
+
+def test_ripristino_da_catena_con_connessione_in_uso(api):
+    nome = _nome(api)
+    primo = api.post("/admin/backup/incremental").json()
+    api.put("/associati/1", json={"nome": "Modificato"})
+    secondo = api.post("/admin/backup/incremental").json()
+    assert secondo["chain_id"] == primo["chain_id"] and secondo["changed_pages"] > 0
+    
+    # Connessione prelevata prima del ripristino (es. esportazione in streaming)
+    in_uso = fastapi_builder.db_pool.acquire()
+    risposta = api.post(f"/admin/backup/chains/{primo['chain_id']}/restore", params={"seq": primo["seq"]})
+    assert risposta.status_code == 200
+    assert _nome(api) == nome
+    
+    # Una scrittura sulla connessione rimasta aperta non deve corrompere il database
+    in_uso.execute("UPDATE Associati SET telefono = '000' WHERE id_associato = 2")
+    in_uso.commit()
+    in_uso.close()
+    with fastapi_builder.db_pool.connection() as conn:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        assert conn.execute("SELECT telefono FROM Associati WHERE id_associato = 2").fetchone()[0] == "000"
+
+
+def test_importazione_database_completo(api, tmp_path):
+    copia = tmp_path / "copia.db"
+    with fastapi_builder.db_pool.connection() as conn:
+        destinazione = sqlite3.connect(copia)
+        conn.backup(destinazione)
+        destinazione.execute("UPDATE Associati SET nome = 'Importato' WHERE id_associato = 1")
+        destinazione.commit()
+        destinazione.close()
+    
+    with open(copia, "rb") as f:
+        risposta = api.post("/admin/import/database", files={"file": ("copia.db", f.read())})
+    
+    assert risposta.status_code == 200
+    assert _nome(api) == "Importato"
+    with sqlite3.connect(risposta.json()["backup_created"]) as sicurezza:
+        assert sicurezza.execute("SELECT nome FROM Associati WHERE id_associato = 1").fetchone()[0] != "Importato"
+
+
+def test_ripristino_di_un_elemento_intermedio_della_catena(api):
+    primo = api.post("/admin/backup/incremental").json()
+    api.put("/associati/1", json={"nome": "Secondo"})
+    secondo = api.post("/admin/backup/incremental").json()
+    api.put("/associati/1", json={"nome": "Terzo"})
+    terzo = api.post("/admin/backup/incremental").json()
+    assert primo["chain_id"] == secondo["chain_id"] == terzo["chain_id"]
+    api.put("/associati/1", json={"nome": "Non salvato"})
+    
+    catena = f"/admin/backup/chains/{primo['chain_id']}/restore"
+    assert api.post(catena, params={"seq": secondo["seq"]}).status_code == 200
+    assert _nome(api) == "Secondo"
+    # Senza seq si ripristina l'ultimo elemento
+    assert api.post(catena).status_code == 200
+    assert _nome(api) == "Terzo"
+    with fastapi_builder.db_pool.connection() as conn:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    
+    assert api.post(catena, params={"seq": 99}).status_code == 404
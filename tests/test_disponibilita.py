@@ -0,0 +1,103 @@
+"""Controllo sovrapposizioni e calendario di disponibilità dei servizi sul dataset di db_test.py"""
+
+import fastapi_builder
+
+
+def _assegna(api, servizio_id, dal, al):
+    return api.post(f"/servizi/{servizio_id}/assegnazioni", json={
+        "fk_associato": 2, "data_inizio": dal, "data_fine": al,
+        "anno_competenza": int(dal[:4]), "stato": "Attivo",
+    })
+
+
+def test_sovrapposizione_contenuta_rifiutata(api):
+    assert _assegna(api, 2, "2030-01-01", "2030-12-31").status_code == 201
+    # Periodo interamente contenuto in quello esistente
+    assert _assegna(api, 2, "2030-03-01", "2030-04-30").status_code == 400
+    # Periodo che contiene quello esistente
+    assert _assegna(api, 2, "2029-06-01", "2031-06-30").status_code == 400
+    assert _assegna(api, 2, "2031-01-01", "2031-12-31").status_code == 201
+
+
+def test_aggiornamento_con_sovrapposizione_rifiutato(api):
+    assert _assegna(api, 2, "2030-01-01", "2030-03-31").status_code == 201
+    seconda = _assegna(api, 2, "2030-06-01", "2030-06-30").json()
+    url = f"/assegnazioni-servizi/{seconda['id_assegnazione']}"
+    assert api.put(url, json={"data_inizio": "2030-03-01"}).status_code == 400
+    assert api.put(url, json={"data_fine": None}).status_code == 400
+    assert api.put(url, json={"data_inizio": None}).status_code == 400
+    risposta = api.put(url, json={"data_inizio": "2030-05-01"})
+    assert risposta.status_code == 200
+    assert risposta.json()["data_inizio"] == "2030-05-01"
+
+
+def _assegna_senza_fine(servizio_id, dal):
+    with fastapi_builder.db_pool.connection() as conn:
+        conn.execute(
+            "INSERT INTO AssegnazioniServizi (fk_servizio, fk_associato, data_inizio, anno_competenza, stato) "
+            "VALUES (?, 3, ?, ?, 'Attivo')",
+            (servizio_id, dal, int(dal[:4]))
+        )
+        conn.commit()
+
+
+def test_assegnazione_senza_data_fine_blocca_i_periodi_successivi(api):
+    _assegna_senza_fine(2, "2030-03-01")
+    
+    assert _assegna(api, 2, "2030-06-01", "2030-06-30").status_code == 400
+    assert _assegna(api, 2, "2045-01-01", "2045-12-31").status_code == 400
+    assert _assegna(api, 2, "2030-01-01", "2030-02-28").status_code == 201
+    
+    voce = {"fk_servizio": 2, "fk_associato": 2, "data_inizio": "2031-01-01", "data_fine": "2031-12-31", "anno_competenza": 2031}
+    risposta = api.post("/assegnazioni-servizi/batch", json={"assegnazioni": [voce]}).json()
+    assert risposta["create"] == 0
+    
+    calendario = api.get("/servizi/disponibilita", params={"dal": "2030-01-01", "al": "2030-12-31"}).json()
+    servizio = next(s for s in calendario["results"] if s["id_servizio"] == 2)
+    assert servizio["libero"] is False
+    assert servizio["periodi_liberi"] == []
+
+
+def test_date_invertite_rifiutate(api):
+    assert _assegna(api, 2, "2030-06-01", "2030-01-01").status_code == 400
+
+
+def test_calendario_disponibilita(api):
+    assert _assegna(api, 2, "2030-03-01", "2030-04-30").status_code == 201
+    response = api.get("/servizi/disponibilita", params={"dal": "2030-01-01", "al": "2030-12-31"})
+    assert response.status_code == 200
+    servizi = {s["id_servizio"]: s for s in response.json()["results"]}
+    assert servizi[2]["libero"] is False
+    assert servizi[2]["periodi_liberi"] == [
+        {"dal": "2030-01-01", "al": "2030-02-28"},
+        {"dal": "2030-05-01", "al": "2030-12-31"},
+    ]
+    manutenzione = [s for s in servizi.values() if s["stato"] == "In Manutenzione"]
+    assert all(not s["libero"] for s in manutenzione)
+
+    liberi = api.get("/servizi/disponibilita", params={
+        "dal": "2030-01-01", "al": "2030-12-31", "solo_liberi": True,
+    }).json()["results"]
+    assert 2 not in {s["id_servizio"] for s in liberi}
+
+
+def test_assegnazione_massiva(api):
+    voci = [
+        {"fk_servizio": 2, "fk_associato": 2, "data_inizio": "2030-04-01", "data_fine": "2030-10-31", "anno_competenza": 2030},
+        {"fk_servizio": 2, "fk_associato": 3, "data_inizio": "2030-06-01", "data_fine": "2030-06-30", "anno_competenza": 2030},
+        {"fk_servizio": 4, "fk_associato": 3, "data_inizio": "2030-04-01", "data_fine": "2030-10-31", "anno_competenza": 2030},
+        {"fk_servizio": 999, "fk_associato": 3, "data_inizio": "2030-04-01", "data_fine": "2030-10-31", "anno_competenza": 2030},
+    ]
+    
+    anteprima = api.post("/assegnazioni-servizi/batch", params={"dry_run": True}, json={"assegnazioni": voci}).json()
+    assert [r["esito"] for r in anteprima["risultati"]] == ["Valida", "Rifiutata", "Valida", "Rifiutata"]
+    
+    risposta = api.post("/assegnazioni-servizi/batch", json={"assegnazioni": voci}).json()
+    assert risposta["create"] == 2
+    assert risposta["risultati"][1]["motivo"] == "Sovrapposizione con la voce 0 del blocco"
+    assert risposta["risultati"][3]["motivo"] == "Servizio non trovato"
+    numeri = [r["numero_fattura"] for r in risposta["risultati"] if r["esito"] == "Creata"]
+    assert len(set(numeri)) == 2
+    
+    # Le assegnazioni create partecipano al controllo delle sovrapposizioni
+    assert _assegna(api, 2, "2030-05-01", "2030-05-31").status_code == 400
@@ -0,0 +1,39 @@
+"""Creazione manuale di fatture e numerazione della serie MAN sul dataset di db_test.py"""
+
+
+def _fattura(**campi):
+    dati = {
+        "data_emissione": "2031-02-10", "data_scadenza": "2031-03-12",
+        "fk_associato": 2, "importo_totale": 120.0,
+        "stato_pagamento": "Non pagata", "tipo_fattura": "Attiva",
+        "note": "Quota straordinaria",
+    }
+    dati.update(campi)
+    return dati
+
+
+def test_numero_assegnato_dalla_serie_man(api):
+    prima = api.post("/fatture", json=_fattura())
+    assert prima.status_code == 201, prima.text
+    assert prima.json()["numero_fattura"] == "MAN-2031-000001"
+    assert prima.json()["descrizione"] == "Quota straordinaria"
+    assert prima.json()["importo_imponibile"] == 120.0
+    assert prima.json()["importo_iva"] == 0
+
+    seconda = api.post("/fatture", json=_fattura(note=None))
+    assert seconda.status_code == 201, seconda.text
+    assert seconda.json()["numero_fattura"] == "MAN-2031-000002"
+
+
+def test_numero_esplicito_duplicato_rifiutato(api):
+    assert api.post("/fatture", json=_fattura(numero_fattura="F-123")).status_code == 201
+    assert api.post("/fatture", json=_fattura(numero_fattura="F-123")).status_code == 400
+
+
+def test_numero_nel_formato_della_numerazione_automatica_rifiutato(api):
+    for numero in ("MAN-2031-000001", "SF-2031-000003", "EP-2030-000010"):
+        risposta = api.post("/fatture", json=_fattura(numero_fattura=numero))
+        assert risposta.status_code == 400, numero
+    # Il contatore non incontra numeri già occupati
+    assert api.post("/fatture", json=_fattura()).json()["numero_fattura"] == "MAN-2031-000001"
+    assert api.post("/fatture", json=_fattura(numero_fattura="MAN-31-7")).status_code == 201
@@ -0,0 +1,209 @@
+"""Importazione CSV e strutture mantenute da trigger sul dataset di db_test.py"""
+
+import csv
+import io
+
+import fastapi_builder
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: "" if value is None else value for key, value in row.items()})
+    return buffer.getvalue().encode()
+
+
+def _importa(api, table, rows, **params):
+    return api.post(f"/admin/import/{table}", params=params, files={"file": ("dati.csv", _csv(rows))})
+
+
+def _righe(sql, params=()):
+    with fastapi_builder.db_pool.connection() as conn:
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def _fatturato_2024(api):
+    return api.get("/report/fatturato", params={"periodo_inizio": "2024-01-01", "periodo_fine": "2024-12-31"}).json()
+
+
+def _fornitore(id_fornitore, ragione_sociale, partita_iva, email="info@fornitore.it"):
+    return {"id_fornitore": id_fornitore, "ragione_sociale": ragione_sociale,
+            "partita_iva": partita_iva, "email": email, "telefono": "0101234567"}
+
+
+def _statistiche_allineate(*tabelle):
+    for tabella in tabelle:
+        contate = _righe(f"SELECT COUNT(*) AS n FROM {tabella}")[0]["n"]
+        mantenute = _righe("SELECT righe FROM StatisticheTabelle WHERE nome_tabella = ?", (tabella,))[0]["righe"]
+        assert mantenute == contate, tabella
+
+
+def _riepilogo_allineato(anno):
+    ordine = "ORDER BY anno, mese, tipo_fattura, categoria, gruppo, settore"
+    mantenuto = _righe(f"SELECT * FROM RiepilogoMensile WHERE anno = ? {ordine}", (anno,))
+    with fastapi_builder.db_pool.connection() as conn:
+        fastapi_builder.rebuild_monthly_rollup(conn, anno)
+        ricalcolato = [dict(row) for row in conn.execute(
+            f"SELECT * FROM RiepilogoMensile WHERE anno = ? {ordine}", (anno,)
+        ).fetchall()]
+        conn.rollback()
+    assert mantenuto == ricalcolato
+
+
+def _partitario_allineato():
+    # Stesso calcolo della ricostruzione completa di db_build.create_receivables_ledger
+    attese = _righe(
+        "SELECT f.id_fattura, f.fk_associato, f.data_scadenza, f.importo_totale, "
+        "COALESCE(p.pagato, 0) AS importo_pagato, f.importo_totale - COALESCE(p.pagato, 0) AS saldo "
+        "FROM Fatture f LEFT JOIN (SELECT fk_fattura, SUM(importo) AS pagato FROM Pagamenti GROUP BY fk_fattura) p "
+        "ON p.fk_fattura = f.id_fattura "
+        "WHERE f.tipo_fattura = 'Attiva' AND f.fk_associato IS NOT NULL AND f.stato IN ('Emessa', 'Scaduta') "
+        "AND f.importo_totale - COALESCE(p.pagato, 0) > 0.005 ORDER BY f.id_fattura"
+    )
+    partite = _righe(
+        "SELECT id_fattura, fk_associato, data_scadenza, importo_totale, importo_pagato, saldo "
+        "FROM PartiteAperte ORDER BY id_fattura"
+    )
+    assert partite == attese
+    saldi = _righe("SELECT fk_associato, fatture_aperte, saldo, prima_scadenza FROM SaldiAssociati ORDER BY fk_associato")
+    assert saldi == _righe(
+        "SELECT fk_associato, COUNT(*) AS fatture_aperte, ROUND(SUM(saldo), 2) AS saldo, MIN(data_scadenza) AS prima_scadenza "
+        "FROM PartiteAperte GROUP BY fk_associato ORDER BY fk_associato"
+    )
+    return partite
+
+
+def test_replace_non_altera_il_riepilogo_mensile(api):
+    prima = _fatturato_2024(api)
+    fattura = _righe("SELECT * FROM Fatture WHERE id_fattura = 2")
+    
+    risposta = _importa(api, "Fatture", fattura, mode="replace").json()
+    
+    assert risposta["imported_rows"] == 1
+    assert _fatturato_2024(api) == prima
+    # Il riepilogo coincide con quello ricalcolato da Fatture
+    _riepilogo_allineato(2024)
+
+
+def test_modalita_insert_riporta_i_conflitti(api):
+    righe = [_fornitore(10, "Velerie Riunite", "11111111111"), _fornitore(11, "Doppione", "01234567890")]
+    
+    risposta = _importa(api, "Fornitori", righe).json()
+    
+    assert (risposta["imported_rows"], risposta["skipped_rows"], risposta["failed_rows"]) == (1, 0, 1)
+    assert risposta["errors"][0].startswith("Riga 3:")
+    assert [r["id_fornitore"] for r in _righe("SELECT id_fornitore FROM Fornitori ORDER BY id_fornitore")] == [1, 2, 10]
+    _statistiche_allineate("Fornitori")
+
+
+def test_modalita_ignore_salta_i_conflitti(api):
+    righe = [_fornitore(1, "Sostituto", "22222222222"), _fornitore(10, "Velerie Riunite", "11111111111")]
+    
+    risposta = _importa(api, "Fornitori", righe, mode="ignore").json()
+    
+    assert (risposta["imported_rows"], risposta["skipped_rows"], risposta["failed_rows"]) == (1, 1, 0)
+    assert _righe("SELECT ragione_sociale FROM Fornitori WHERE id_fornitore = 1")[0]["ragione_sociale"] == "Sail & Fun S.r.l."
+    _statistiche_allineate("Fornitori")
+
+
+def test_modalita_replace_sostituisce_le_righe(api):
+    righe = [_fornitore(1, "Sail & Fun S.r.l.", "01234567890", "nuova@sailfun.it"), _fornitore(10, "Velerie Riunite", "11111111111")]
+    
+    risposta = _importa(api, "Fornitori", righe, mode="replace").json()
+    
+    assert (risposta["imported_rows"], risposta["skipped_rows"], risposta["failed_rows"]) == (2, 0, 0)
+    assert _righe("SELECT email FROM Fornitori WHERE id_fornitore = 1")[0]["email"] == "nuova@sailfun.it"
+    # Le righe sostituite passano dai trigger di cancellazione: il conteggio non cresce
+    _statistiche_allineate("Fornitori")
+
+
+def test_modalita_upsert_su_colonne_di_conflitto(api):
+    righe = [
+        {"ragione_sociale": "Sail & Fun S.r.l.", "partita_iva": "01234567890", "email": "ordini@sailfun.it", "telefono": "010123456"},
+        {"ragione_sociale": "Velerie Riunite", "partita_iva": "11111111111", "email": "info@velerie.it", "telefono": "0101234567"},
+    ]
+    
+    risposta = _importa(api, "Fornitori", righe, mode="upsert", conflict_columns="partita_iva").json()
+    
+    assert (risposta["imported_rows"], risposta["failed_rows"]) == (2, 0)
+    fornitori = _righe("SELECT id_fornitore, partita_iva, email FROM Fornitori ORDER BY id_fornitore")
+    assert len(fornitori) == 3
+    assert fornitori[0] == {"id_fornitore": 1, "partita_iva": "01234567890", "email": "ordini@sailfun.it"}
+    _statistiche_allineate("Fornitori")
+    
+    # Le colonne di conflitto devono comparire nel CSV
+    errata = _importa(api, "Fornitori", righe, mode="upsert", conflict_columns="id_fornitore").json()
+    assert errata["success"] is False and errata["imported_rows"] == 0
+
+
+def test_ripiego_riga_per_riga_nel_blocco_fallito(api, monkeypatch):
+    monkeypatch.setattr(fastapi_builder, "IMPORT_BATCH_SIZE", 2)
+    righe = [
+        _fornitore(10, "Primo", "10000000001"),
+        _fornitore(11, "Secondo", "10000000002"),
+        _fornitore(12, None, "10000000003"),       # ragione_sociale NOT NULL
+        _fornitore(13, "Quarto", "10000000004"),
+        _fornitore(14, "Quinto", "01234567890"),   # partita_iva già presente
+    ]
+    
+    risposta = _importa(api, "Fornitori", righe).json()
+    
+    # Solo i blocchi con errori sono reinseriti riga per riga; le altre righe restano importate
+    assert (risposta["imported_rows"], risposta["skipped_rows"], risposta["failed_rows"]) == (3, 0, 2)
+    assert [errore.split(":")[0] for errore in risposta["errors"]] == ["Riga 4", "Riga 6"]
+    importati = _righe("SELECT id_fornitore FROM Fornitori WHERE id_fornitore >= 10 ORDER BY id_fornitore")
+    assert [r["id_fornitore"] for r in importati] == [10, 11, 13]
+    _statistiche_allineate("Fornitori")
+
+
+def test_campi_mancanti_contati_come_falliti(api):
+    contenuto = b"id_fornitore,ragione_sociale,partita_iva,email,telefono\n10,Primo,10000000001,a@b.it,010\n11,Secondo,a@b.it\n\n"
+    
+    risposta = api.post("/admin/import/Fornitori", files={"file": ("dati.csv", contenuto)}).json()
+    
+    assert (risposta["imported_rows"], risposta["failed_rows"]) == (1, 1)
+    assert risposta["errors"] == ["Riga 3: attesi 5 campi, trovati 3"]
+
+
+def test_partitario_segue_pagamenti_e_fatture(api):
+    # Fattura 2 (socio 1, 707.60 emessa) è l'unica partita aperta del dataset
+    assert [p["id_fattura"] for p in _partitario_allineato()] == [2]
+    
+    acconto = {"fk_fattura": 2, "data_pagamento": "2024-07-01", "importo": 200.0, "metodo_pagamento": "POS"}
+    assert api.post("/pagamenti", json=acconto).status_code == 201
+    assert _partitario_allineato()[0]["saldo"] == 507.6
+    
+    # Import di una nuova fattura attiva: la partita compare senza ricalcoli
+    fattura = _righe("SELECT * FROM Fatture WHERE id_fattura = 2")[0]
+    fattura.update(id_fattura=10, numero_fattura="ATT-2024-010", data_scadenza="2024-06-30")
+    assert _importa(api, "Fatture", [fattura]).json()["imported_rows"] == 1
+    assert [p["id_fattura"] for p in _partitario_allineato()] == [2, 10]
+    assert _righe("SELECT prima_scadenza FROM SaldiAssociati WHERE fk_associato = 1")[0]["prima_scadenza"] == "2024-06-30"
+    
+    saldo = {"fk_fattura": 2, "data_pagamento": "2024-07-10", "importo": 507.6, "metodo_pagamento": "POS"}
+    assert api.post("/pagamenti", json=saldo).status_code == 201
+    assert [p["id_fattura"] for p in _partitario_allineato()] == [10]
+    
+    with fastapi_builder.db_pool.connection() as conn:
+        conn.execute("DELETE FROM Fatture WHERE id_fattura = 10")
+        conn.commit()
+    assert _partitario_allineato() == []
+    assert _righe("SELECT * FROM SaldiAssociati") == []
+    _statistiche_allineate("Fatture", "Pagamenti")
+
+
+def test_riepilogo_mensile_dopo_modifica_e_cancellazione(api):
+    with fastapi_builder.db_pool.connection() as conn:
+        conn.execute("UPDATE Fatture SET importo_totale = 800, data_emissione = '2024-09-01' WHERE id_fattura = 2")
+        conn.execute("UPDATE Fatture SET categoria = 'Altro' WHERE id_fattura = 1")
+        conn.commit()
+    _riepilogo_allineato(2024)
+    
+    with fastapi_builder.db_pool.connection() as conn:
+        conn.execute("DELETE FROM Fatture WHERE id_fattura = 3")
+        conn.commit()
+    _riepilogo_allineato(2024)
+    assert all(r["tipo_fattura"] != "Passiva" for r in _righe("SELECT tipo_fattura FROM RiepilogoMensile WHERE anno = 2024"))
+    _statistiche_allineate("Fatture")
@@ -0,0 +1,89 @@
+"""Manutenzione degli stati derivati dalla data sul dataset di db_test.py"""
+
+from datetime import date, timedelta
+
+import fastapi_builder
+
+
+def _stato_servizio(api, servizio_id):
+    return api.get(f"/servizi/{servizio_id}").json()["stato"]
+
+
+def test_passata_completa_e_incrementale(api):
+    esito = api.post("/admin/manutenzione-stati").json()
+    assert esito["completa"]
+    # Le assegnazioni del dataset sono terminate, la fattura emessa nel 2024 è scaduta
+    assert {s["id_servizio"] for s in esito["servizi"]} == {1, 3}
+    assert esito["fatture_scadute"] == 1
+    assert api.get("/fatture", params={"stato": "Scaduta"}).json()
+    
+    esito = api.post("/admin/manutenzione-stati").json()
+    assert not esito["completa"]
+    assert esito["servizi"] == [] and esito["fatture_scadute"] == 0
+
+
+def test_servizio_occupato_solo_durante_l_assegnazione(api):
+    api.post("/admin/manutenzione-stati")
+    inizio = date.today() + timedelta(days=2)
+    risposta = api.post("/servizi/2/assegnazioni", json={
+        "fk_associato": 2, "data_inizio": inizio.isoformat(), "data_fine": (inizio + timedelta(days=3)).isoformat(),
+        "anno_competenza": inizio.year,
+    })
+    assert risposta.status_code == 201
+    assert _stato_servizio(api, 2) == "Disponibile"
+    
+    fastapi_builder.status_maintenance.run(inizio)
+    assert _stato_servizio(api, 2) == "Occupato"
+    fastapi_builder.status_maintenance.run(inizio + timedelta(days=4))
+    assert _stato_servizio(api, 2) == "Disponibile"
+
+
+def test_assegnazione_terminata_libera_il_servizio(api):
+    risposta = api.post("/servizi/2/assegnazioni", json={
+        "fk_associato": 2, "data_inizio": date.today().isoformat(), "data_fine": (date.today() + timedelta(days=30)).isoformat(),
+        "anno_competenza": date.today().year,
+    }).json()
+    assert _stato_servizio(api, 2) == "Occupato"
+    
+    api.put(f"/assegnazioni-servizi/{risposta['id_assegnazione']}", json={"stato": "Terminato"})
+    assert _stato_servizio(api, 2) == "Disponibile"
+
+
+def test_associato_scaduto_con_tessera_fiv_scaduta(api):
+    api.post("/associati/1/tesseramento-fiv", json={
+        "numero_tessera_fiv": "FIV12345", "scadenza_tesseramento_fiv": "2020-01-01", "scadenza_certificato_medico": "2020-01-01",
+    })
+    assert api.post("/admin/manutenzione-stati").json()["associati_scaduti"] == [1]
+    assert api.get("/associati/1", params={"include": ""}).json()["stato_associato"] == "Scaduto"
+
+
+def test_assegnazione_senza_data_fine_mantiene_il_servizio_occupato(api):
+    inizio = date.today() + timedelta(days=1)
+    with fastapi_builder.db_pool.connection() as conn:
+        conn.execute(
+            "INSERT INTO AssegnazioniServizi (fk_servizio, fk_associato, data_inizio, anno_competenza, stato) "
+            "VALUES (2, 3, ?, ?, 'Attivo')",
+            (inizio.isoformat(), inizio.year)
+        )
+        conn.commit()
+    api.post("/admin/manutenzione-stati")
+    assert _stato_servizio(api, 2) == "Disponibile"
+    
+    fastapi_builder.status_maintenance.run(inizio)
+    assert _stato_servizio(api, 2) == "Occupato"
+    fastapi_builder.status_maintenance.run(inizio + timedelta(days=400), completa=True)
+    assert _stato_servizio(api, 2) == "Occupato"
+
+
+def test_pagamento_parziale_non_riapre_la_fattura_scaduta(api):
+    api.post("/admin/manutenzione-stati")
+    # Fattura 2 (707.60, scadenza 2024-07-15) è scaduta dopo la passata
+    assert api.get("/fatture/2").json()["stato"] == "Scaduta"
+    
+    acconto = {"fk_fattura": 2, "data_pagamento": date.today().isoformat(), "importo": 100.0, "metodo_pagamento": "POS"}
+    assert api.post("/pagamenti", json=acconto).status_code == 201
+    assert api.get("/fatture/2").json()["stato"] == "Scaduta"
+    
+    saldo = dict(acconto, importo=607.6)
+    assert api.post("/pagamenti", json=saldo).status_code == 201
+    assert api.get("/fatture/2").json()["stato"] == "Pagata"
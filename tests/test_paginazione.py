@@ -0,0 +1,25 @@
+"""Conteggi e header di paginazione degli elenchi sul dataset di db_test.py"""
+
+
+def test_conteggio_con_filtri_assente_senza_exact_count(api):
+    risposta = api.get("/associati", params={"stato": "Attivo", "limit": 1}).json()
+    assert risposta["count"] is None
+    assert risposta["count_exact"] is False
+
+    esatto = api.get("/associati", params={"stato": "Attivo", "limit": 1, "exact_count": True}).json()
+    assert esatto["count_exact"] is True
+    assert esatto["count"] >= len(esatto["results"])
+
+
+def test_header_conteggio_fatture(api):
+    filtrate = api.get("/fatture", params={"tipo": "Attiva", "limit": 1})
+    assert filtrate.status_code == 200
+    assert "X-Total-Count" not in filtrate.headers
+    assert filtrate.headers["X-Total-Count-Exact"] == "false"
+
+    esatte = api.get("/fatture", params={"tipo": "Attiva", "limit": 1, "exact_count": True})
+    tutte = api.get("/fatture", params={"tipo": "Attiva", "limit": 100})
+    assert int(esatte.headers["X-Total-Count"]) == len(tutte.json())
+
+    # Senza filtri il totale stimato resta disponibile
+    assert int(api.get("/pagamenti", params={"limit": 1}).headers["X-Total-Count"]) >= 1
@@ -0,0 +1,50 @@
+"""Budget di round-trip SQL delle rotte composite sul dataset di db_test.py"""
+
+import pytest
+
+import fastapi_builder
+from fastapi_builder import QueryBudgetExceeded
+
+
+def test_dettaglio_associato_entro_budget(api):
+    response = api.get("/associati/1")
+    assert response.status_code == 200
+    profilo = response.json()
+    assert profilo["tesseramento_fiv"] is not None
+    assert {"fatture", "pagamenti", "servizi_fisici", "prestazioni"} <= profilo.keys()
+
+
+def test_dettaglio_associato_sezioni_selezionate(api):
+    profilo = api.get("/associati/1", params={"include": "fatture"}).json()
+    assert "fatture" in profilo and "pagamenti" not in profilo
+    assert api.get("/associati/1", params={"include": "sconosciuta"}).status_code == 400
+
+
+def test_pagamento_entro_budget(api):
+    response = api.post("/pagamenti", json={
+        "fk_fattura": 2, "data_pagamento": "2025-01-15", "importo": 10.0, "metodo_pagamento": "POS",
+    })
+    assert response.status_code == 201
+
+
+def test_assegnazione_servizio_entro_budget(api):
+    response = api.post("/servizi/1/assegnazioni", json={
+        "fk_associato": 2, "data_inizio": "2031-01-01", "data_fine": "2031-12-31",
+        "anno_competenza": 2031, "stato": "Attivo",
+    })
+    assert response.status_code == 201
+
+
+def test_regressione_oltre_budget_fallisce(api, monkeypatch):
+    monkeypatch.setitem(fastapi_builder.query_budget.budgets, ("GET", "/associati/{associato_id}"), 0)
+    with pytest.raises(QueryBudgetExceeded):
+        api.get("/associati/1")
+
+
+def test_statistiche_per_rotta(api):
+    api.get("/associati/1")
+    routes = {(r["method"], r["route"]): r for r in api.get("/admin/query-budget").json()["routes"]}
+    stats = routes[("GET", "/associati/{associato_id}")]
+    assert stats["requests"] == 1
+    assert 0 < stats["max_statements"] <= stats["budget"]
+    assert stats["over_budget"] == 0